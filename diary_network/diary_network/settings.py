@@ -35,20 +35,26 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'sorl.thumbnail',
-    'debug_toolbar',
 ]
 
 MIDDLEWARE = [
+    'posts.middleware.StaticFilesMiddleware',
+    'posts.middleware.MediaFilesMiddleware',
+    'posts.middleware.PerformanceMiddleware',
+    'posts.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'posts.middleware.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'diary_network.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
@@ -68,22 +74,88 @@ TEMPLATES = [
     }
 ]
 
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+# The cache is shared by all worker processes. DIARY_CACHE_URL selects the
+# backend: file:///path (default), redis://host:port/db or locmem://
+CACHE_URL = os.environ.get('DIARY_CACHE_URL', 'file://' + os.path.join(BASE_DIR, 'cache'))
+
+if CACHE_URL.startswith('redis://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'posts.cache_backends.RedisCache',
+            'LOCATION': CACHE_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': os.environ.get('DIARY_REDIS_CLIENT', 'redis.Redis'),
+            },
+        }
     }
-}
+elif CACHE_URL.startswith('file://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'posts.cache_backends.FileBasedCache',
+            'LOCATION': CACHE_URL[len('file://'):],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+POSTS_CACHE_ALIAS = 'default'
+
+# Sessions and their users are read from the cache, see posts/auth.py. With
+# locmem:// each worker process would keep serving sessions logged out in
+# another one, use it with a single process only.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = POSTS_CACHE_ALIAS
+
+TEST_RUNNER = 'diary_network.test_runner.TestRunner'
 
 WSGI_APPLICATION = 'diary_network.wsgi.application'
+ASGI_APPLICATION = 'diary_network.asgi.application'
+
 
+# Seconds a database connection is kept open between requests
+CONN_MAX_AGE = int(os.environ.get('DIARY_DB_CONN_MAX_AGE', '60'))
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': CONN_MAX_AGE,
     }
 }
 
+# Read replicas: comma separated SQLite files, refreshed from the primary
+# with the sync_replicas command. Reads of safe requests are routed to them
+# by posts.db.ReplicaRouter
+for number, path in enumerate(filter(None, os.environ.get('DIARY_DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+POSTS_DB_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['posts.db.ReplicaRouter']
+
+# After a write the client reads from the primary for this many seconds,
+# which must cover the replication lag
+POSTS_DB_PIN_SECONDS = 5
+POSTS_DB_PIN_COOKIE = 'db_pin'
+
+# Applied to every new SQLite connection by posts.db.configure_connection
+POSTS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,
+    'temp_store': 'MEMORY',
+    'mmap_size': 134217728,
+    'busy_timeout': 5000,
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -120,6 +192,34 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
+# Hashed, minified and precompressed by collectstatic, see posts/staticfiles.py
+STATICFILES_STORAGE = 'posts.staticfiles.CompressedManifestStorage'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Uploads go to disk in chunks and are hashed for posts.media.ContentAddressedStorage
+FILE_UPLOAD_HANDLERS = ['posts.media.HashingUploadHandler']
+
+# Full-text index used when the database is not SQLite, see posts/search.py
+POSTS_SEARCH_INDEX = os.path.join(BASE_DIR, 'search_index.sqlite3')
+
+# Share of requests instrumented by posts.middleware.PerformanceMiddleware,
+# their timings are exposed on /metrics/ to INTERNAL_IPS
+POSTS_METRICS_SAMPLE_RATE = float(os.environ.get('DIARY_METRICS_SAMPLE_RATE', '0.01'))
+
+# Threads running independent queries of a view concurrently, shared by
+# all request threads, see posts/parallel.py. 0 runs them one after another
+POSTS_QUERY_WORKERS = int(os.environ.get('DIARY_QUERY_WORKERS', '0'))
+
+# Longest ?wait= of a long-polling feed API request, and the lifetime of
+# its event streams, in seconds. Both hold a worker thread meanwhile
+POSTS_FEED_WAIT_MAX = 25
+POSTS_FEED_STREAM_SECONDS = 60
+# Requests of a process waiting at the same time, keep it well below the
+# number of threads serving requests. Others are asked to retry later
+POSTS_FEED_MAX_WAITERS = int(os.environ.get('DIARY_FEED_MAX_WAITERS', '8'))
+
+# Queue of the side effects of writes, see posts/jobs.py. The database
+# backend needs `python manage.py run_worker`; tests run jobs inline, see
+# diary_network/test_runner.py
+POSTS_JOB_BACKEND = os.environ.get('DIARY_JOB_BACKEND', 'posts.jobs.DatabaseBackend')
@@ -0,0 +1,258 @@
+"""Streaming export and bulk import of diaries.
+
+An archive is a sequence of records, one per post, comment and follow,
+written as NDJSON or CSV. Posts come first, then comments, then follows,
+so an importer reading the stream once always meets a post before its
+comments. Records keep their ids, which makes importing the same archive
+twice harmless: rows whose id already exists are skipped. Users and
+groups are referred to by username and slug and must exist on import.
+Images are referenced by their storage name, their files are not copied.
+
+Both directions read and write in batches, so memory stays constant
+whatever the size of the archive.
+"""
+import csv
+import io
+import json
+from collections import Counter
+
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from . import follows, hot, search, timeline
+from .cache import bump_generation
+from .counters import bump_post, bump_user
+from .models import Comment, Follow, Group, Post, User
+
+
+BATCH_SIZE = 1000
+CSV_FIELDS = ("type", "id", "user", "author", "post", "group", "date", "text", "image")
+FORMATS = ("ndjson", "csv")
+
+
+# Export
+
+def records(users=None, chunk_size=BATCH_SIZE):
+    """Archive records of the given users, or of everyone, as dicts."""
+    posts = Post.objects.order_by("id")
+    comments = Comment.objects.order_by("id")
+    follow_rows = Follow.objects.order_by("id")
+    if users is not None:
+        posts = posts.filter(author__in=users)
+        comments = comments.filter(author__in=users)
+        follow_rows = follow_rows.filter(user__in=users)
+
+    fields = ("id", "author__username", "group__slug", "pub_date", "text", "image")
+    for pk, author, group, date, text, image in posts.values_list(*fields).iterator(chunk_size=chunk_size):
+        yield {"type": "post", "id": pk, "author": author, "group": group,
+               "date": date.isoformat(), "text": text, "image": image or None}
+
+    fields = ("id", "author__username", "post_id", "created", "text")
+    for pk, author, post, date, text in comments.values_list(*fields).iterator(chunk_size=chunk_size):
+        yield {"type": "comment", "id": pk, "author": author, "post": post,
+               "date": date.isoformat(), "text": text}
+
+    fields = ("user__username", "author__username")
+    for user, author in follow_rows.values_list(*fields).iterator(chunk_size=chunk_size):
+        yield {"type": "follow", "user": user, "author": author}
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def csv_lines(records):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_FIELDS)
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def lines(records, format="ndjson"):
+    return csv_lines(records) if format == "csv" else ndjson_lines(records)
+
+
+# Import
+
+def read_ndjson(lines):
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_csv(lines):
+    for row in csv.DictReader(lines):
+        record = {key: value or None for key, value in row.items() if key in CSV_FIELDS}
+        for key in ("id", "post"):
+            if record.get(key):
+                try:
+                    record[key] = int(record[key])
+                except ValueError:
+                    record[key] = None
+        yield record
+
+
+def read(lines, format="ndjson"):
+    return read_csv(lines) if format == "csv" else read_ndjson(lines)
+
+
+class Importer:
+    """Write archive records in batches of `batch_size` rows per kind.
+
+    bulk_create() sends no signals, so the importer does what posts.signals
+    would: counters, timelines, search documents and cache scopes.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, index=True):
+        self.batch_size = batch_size
+        self.index = index
+        self.pending = {"post": [], "comment": [], "follow": []}
+        self.user_ids = {}
+        self.group_ids = {}
+        self.created = Counter()
+        self.skipped = Counter()
+
+    def add(self, record):
+        kind = record.get("type")
+        if kind not in self.pending:
+            self.skipped["unknown"] += 1
+            return
+        # bulk_update() needs the ids, and they make imports repeatable
+        if kind != "follow" and not isinstance(record.get("id"), int):
+            self.skipped["malformed"] += 1
+            return
+        batch = self.pending[kind]
+        batch.append(record)
+        if len(batch) >= self.batch_size:
+            self.flush(kind)
+
+    def run(self, records):
+        for record in records:
+            self.add(record)
+        self.finish()
+        return self.created, self.skipped
+
+    def finish(self):
+        for kind in self.pending:
+            self.flush(kind)
+
+    def flush(self, kind):
+        batch, self.pending[kind] = self.pending[kind], []
+        if batch:
+            getattr(self, f"_write_{kind}s")(batch)
+
+    def _lookup(self, names, cache, model, field):
+        missing = {name for name in names if name and name not in cache}
+        if missing:
+            found = dict(model.objects.filter(**{f"{field}__in": missing}).values_list(field, "id"))
+            cache.update({name: found.get(name) for name in missing})
+        return cache
+
+    def _date(self, record):
+        """Date of a record, None when it is missing or malformed."""
+        try:
+            return parse_datetime(record.get("date") or "")
+        except ValueError:
+            # Well formed but invalid, e.g. a 13th month
+            return None
+
+    def _new(self, model, batch):
+        ids = [record["id"] for record in batch]
+        existing = set(model.objects.filter(id__in=ids).values_list("id", flat=True))
+        return [record for record in batch if record["id"] not in existing]
+
+    def _create(self, model, objects, date_field, dates):
+        # bulk_create() overwrites auto_now_add fields, the dates are restored afterwards
+        with transaction.atomic():
+            model.objects.bulk_create(objects, batch_size=self.batch_size)
+            for obj, date in zip(objects, dates):
+                setattr(obj, date_field, date)
+            model.objects.bulk_update(objects, [date_field], batch_size=500)
+
+    def _write_posts(self, batch):
+        new = self._new(Post, batch)
+        self.skipped["post"] += len(batch) - len(new)
+        users = self._lookup((r.get("author") for r in new), self.user_ids, User, "username")
+        groups = self._lookup((r.get("group") for r in new), self.group_ids, Group, "slug")
+        posts, dates = [], []
+        for record in new:
+            date = self._date(record)
+            if date is None:
+                self.skipped["malformed"] += 1
+                continue
+            author_id = users.get(record.get("author"))
+            if author_id is None:
+                self.skipped["post"] += 1
+                continue
+            post = Post(
+                id=record["id"], author_id=author_id, group_id=groups.get(record.get("group")),
+                text=record.get("text") or "", image=record.get("image") or "",
+            )
+            post.render_text()
+            posts.append(post)
+            dates.append(date)
+        if not posts:
+            return
+        self._create(Post, posts, "pub_date", dates)
+        self.created["post"] += len(posts)
+
+        authors = Counter(post.author_id for post in posts)
+        for author_id, count in authors.items():
+            bump_user(author_id, "posts_count", count)
+        group_ids = {post.group_id for post in posts if post.group_id}
+        for group_id in group_ids:
+            hot.forget(group_id)
+        timeline.fan_out_posts(posts)
+        bump_generation("index", *(f"author:{pk}" for pk in authors), *(f"group:{pk}" for pk in group_ids))
+        if self.index:
+            for post in posts:
+                search.index_object("post", post)
+
+    def _write_comments(self, batch):
+        new = self._new(Comment, batch)
+        users = self._lookup((r.get("author") for r in new), self.user_ids, User, "username")
+        post_ids = set(Post.objects.filter(id__in={r.get("post") for r in new}).values_list("id", flat=True))
+        comments, dates, malformed = [], [], 0
+        for record in new:
+            date = self._date(record)
+            if date is None:
+                malformed += 1
+                continue
+            author_id = users.get(record.get("author"))
+            if author_id is None or record.get("post") not in post_ids:
+                continue
+            comment = Comment(id=record["id"], author_id=author_id, post_id=record.get("post"),
+                              text=record.get("text") or "")
+            comment.render_text()
+            comments.append(comment)
+            dates.append(date)
+        self.skipped["malformed"] += malformed
+        self.skipped["comment"] += len(batch) - len(comments) - malformed
+        if not comments:
+            return
+        self._create(Comment, comments, "created", dates)
+        self.created["comment"] += len(comments)
+
+        commented = Counter(comment.post_id for comment in comments)
+        for post_id, count in commented.items():
+            bump_post(post_id, "comments_count", count)
+        bump_generation(*(f"post:{pk}" for pk in commented))
+        if self.index:
+            for comment in comments:
+                search.index_object("comment", comment)
+
+    def _write_follows(self, batch):
+        users = self._lookup((name for r in batch for name in (r.get("user"), r.get("author"))),
+                             self.user_ids, User, "username")
+        pairs = [(users.get(r.get("user")), users.get(r.get("author"))) for r in batch]
+        pairs = [(user_id, author_id) for user_id, author_id in pairs if user_id and author_id]
+        created = follows.bulk_follow(pairs)
+        self.created["follow"] += created
+        self.skipped["follow"] += len(batch) - created
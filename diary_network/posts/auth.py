@@ -0,0 +1,65 @@
+"""Authenticated users read from the cache.
+
+With the cached_db session engine a session is read from the cache and
+written through to the database, so only a cache miss reads django_session.
+get_user() does the same for the user of the session: the User row is
+cached under user_key() and posts.signals drops it whenever the user is
+saved or deleted, e.g. by profile_edit or a password change. The password
+hash is left out of the cache: the cached user loads it from the database
+on access, as a deferred field. The session auth hash derived from it is
+cached instead and still checked, so changing the password logs out the
+other sessions as before.
+"""
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, _get_user_session_key, load_backend
+from django.contrib.auth.models import AnonymousUser
+from django.db import router, transaction
+from django.utils.crypto import constant_time_compare
+
+from .cache import get_cache
+from .models import User
+
+
+USER_CACHE_TIMEOUT = 600
+CACHED_FIELDS = [field.attname for field in User._meta.concrete_fields if field.attname != "password"]
+
+
+def user_key(user_id):
+    return f"auth-user:{user_id}"
+
+
+def forget_user(user_id):
+    key = user_key(user_id)
+    get_cache().delete(key)
+    # Again after commit, in case a request cached the old row meanwhile
+    transaction.on_commit(lambda: get_cache().delete(key))
+
+
+def get_user(request):
+    """django.contrib.auth.get_user() reading the user from the cache."""
+    try:
+        user_id = _get_user_session_key(request)
+        backend_path = request.session[BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+
+    cache = get_cache()
+    key = user_key(user_id)
+    cached = cache.get(key)
+    if cached is None:
+        user = load_backend(backend_path).get_user(user_id)
+        if user is None:
+            return AnonymousUser()
+        auth_hash = user.get_session_auth_hash()
+        cache.set(key, ([getattr(user, name) for name in CACHED_FIELDS], auth_hash), USER_CACHE_TIMEOUT)
+    else:
+        values, auth_hash = cached
+        user = User.from_db(router.db_for_read(User), CACHED_FIELDS, values)
+
+    session_hash = request.session.get(HASH_SESSION_KEY)
+    if not (session_hash and constant_time_compare(session_hash, auth_hash)):
+        request.session.flush()
+        return AnonymousUser()
+    return user
@@ -0,0 +1,672 @@
+"""Synthetic datasets and a benchmark harness for the posts views.
+
+`seed()` fills the database with a scaled dataset: authors with a
+power-law follower distribution and a share of comment-heavy posts.
+`run()` drives every route of posts.urls through the test client,
+counting queries and RSS, and optionally through a threaded wsgiref
+server to get latencies under concurrency. Results are plain dicts that
+can be saved as a JSON baseline and compared against later runs, see the
+seed_data and bench management commands.
+
+The configured cache is shared with running servers, so the benchmarks
+fill and invalidate a private in-memory one instead, as the tests do.
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.template import engines
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from . import counters, search, timeline
+from .cache import bump_generation, get_cache
+from .cards import CardRenderer
+from .models import Comment, Follow, Group, Post, PostStats, User, UserStats
+from .pagination import encode_cursor
+
+
+SCALES = {
+    "tiny": {"users": 50, "posts": 500, "groups": 5},
+    "small": {"users": 1000, "posts": 10000, "groups": 20},
+    "medium": {"users": 5000, "posts": 100000, "groups": 50},
+    "large": {"users": 20000, "posts": 1000000, "groups": 100},
+}
+USERNAME_PREFIX = "bench_"
+BATCH_SIZE = 2000
+WORDS = (
+    "morning coffee walk river city night book music rain garden friends "
+    "travel summer winter code music film dinner story train sea mountain"
+).split()
+
+# Latency percentiles reported for every route
+PERCENTILES = (50, 95, 99)
+
+
+# Seeding
+
+def _ids(model, count):
+    start = (model.objects.aggregate(last=Max("id"))["last"] or 0) + 1
+    return range(start, start + count)
+
+
+def _text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _chunks(iterable, size=BATCH_SIZE):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _create_backdated(model, objects, field, dates):
+    """bulk_create() ignores values of auto_now_add fields, restore them afterwards.
+
+    It skips save() too, so the texts are rendered here.
+    """
+    for obj in objects:
+        obj.render_text()
+    model.objects.bulk_create(objects)
+    for obj, date in zip(objects, dates):
+        setattr(obj, field, date)
+    model.objects.bulk_update(objects, [field], batch_size=500)
+
+
+def seed(users, posts, groups, follows_per_user=20, heavy_share=0.01, heavy_comments=200,
+         zipf=1.1, seed=0, index=True, log=None):
+    """Create a synthetic dataset next to any existing rows, returns row counts."""
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    now = timezone.now()
+
+    password = make_password("bench")
+    user_ids = list(_ids(User, users))
+    for chunk in _chunks(user_ids):
+        User.objects.bulk_create(
+            User(id=user_id, username=f"{USERNAME_PREFIX}{user_id}", password=password) for user_id in chunk
+        )
+    log(f"{users} users")
+
+    group_ids = list(_ids(Group, groups))
+    Group.objects.bulk_create(
+        Group(id=group_id, title=f"Bench group {group_id}", slug=f"{USERNAME_PREFIX}{group_id}",
+              description=_text(rng, 8))
+        for group_id in group_ids
+    )
+    log(f"{groups} groups")
+
+    # Popularity follows a Zipf law: the k-th author is followed about
+    # 1 / k ** zipf as often as the first one
+    weights = list(itertools.accumulate(1 / (rank + 1) ** zipf for rank in range(users)))
+    by_rank = user_ids[:]
+    rng.shuffle(by_rank)
+
+    def popular(count):
+        return rng.choices(by_rank, cum_weights=weights, k=count)
+
+    pairs = set()
+    for user_id in user_ids:
+        # Pareto(1.5) has a mean of 3, scale it to the requested average
+        wanted = min(int(rng.paretovariate(1.5) * follows_per_user / 3), users - 1)
+        pairs.update((user_id, author_id) for author_id in popular(wanted) if author_id != user_id)
+    for chunk in _chunks(sorted(pairs)):
+        Follow.objects.bulk_create(
+            [Follow(user_id=user_id, author_id=author_id) for user_id, author_id in chunk],
+            ignore_conflicts=True,
+        )
+    log(f"{len(pairs)} follows")
+
+    post_ids = list(_ids(Post, posts))
+    comment_ids = itertools.count(_ids(Comment, 1)[0])
+    step = timedelta(days=365) / max(posts, 1)
+    start = now - timedelta(days=365)
+    comments = 0
+    for chunk in _chunks(enumerate(post_ids)):
+        # Everybody posts about as often, otherwise the timelines of the
+        # followers of the top authors would hold most of the posts
+        authors = [rng.choice(user_ids) for _ in chunk]
+        _create_backdated(
+            Post,
+            [Post(id=post_id, text=_text(rng, rng.randint(5, 60)), author_id=author_id,
+                  group_id=rng.choice(group_ids) if group_ids and rng.random() < 0.3 else None)
+             for (_, post_id), author_id in zip(chunk, authors)],
+            "pub_date",
+            [start + step * i for i, _ in chunk],
+        )
+        batch, dates = [], []
+        for i, post_id in chunk:
+            count = heavy_comments if rng.random() < heavy_share else rng.randint(0, 3)
+            for _ in range(count):
+                batch.append(Comment(id=next(comment_ids), post_id=post_id, author_id=rng.choice(user_ids),
+                                     text=_text(rng, rng.randint(3, 20))))
+                dates.append(min(start + step * i + timedelta(minutes=rng.randint(1, 600)), now))
+        for comments_chunk, dates_chunk in zip(_chunks(batch), _chunks(dates)):
+            _create_backdated(Comment, comments_chunk, "created", dates_chunk)
+        comments += len(batch)
+    log(f"{posts} posts, {comments} comments")
+
+    # bulk_create() sends no signals, rebuild everything they maintain
+    counters.reconcile()
+    entries = timeline.rebuild()
+    log(f"{entries} timeline entries")
+    if index:
+        search.rebuild()
+        log("search index rebuilt")
+    # Rows reused ids of flushed ones, drop what was cached for those
+    bump_generation("index", *(f"group:{pk}" for pk in group_ids), *(f"author:{pk}" for pk in user_ids))
+    return {"users": users, "groups": groups, "follows": len(pairs), "posts": posts,
+            "comments": comments, "timeline": entries}
+
+
+def flush():
+    """Delete every user created by seed() together with their content."""
+    users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+    Group.objects.filter(slug__startswith=USERNAME_PREFIX).delete()
+    deleted = users.count()
+    for chunk in _chunks(users.values_list("id", flat=True).iterator(), 500):
+        # Deleting through the ORM sends the signals invalidating the cache
+        User.objects.filter(id__in=chunk).delete()
+    return deleted
+
+
+# Measuring
+
+def percentile(values, pct):
+    """Linear interpolation between closest ranks, like numpy's default."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies):
+    """Milliseconds statistics of a list of latencies in seconds."""
+    summary = {f"p{pct}": round(percentile(latencies, pct) * 1000, 3) for pct in PERCENTILES}
+    summary["mean"] = round(sum(latencies) / len(latencies) * 1000, 3)
+    summary["samples"] = len(latencies)
+    return summary
+
+
+def current_rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        # Peak rather than current RSS, but available everywhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Route:
+    """A request to benchmark: `user` is one of the fixtures, writes are rolled back."""
+
+    def __init__(self, name, path, user="viewer", method="get", data=None, write=False):
+        self.name = name
+        self.path = path
+        self.user = user
+        self.method = method
+        self.data = data
+        self.write = write
+
+
+def fixtures():
+    """Representative rows to aim the routes at, taken from the seeded data."""
+    stats = UserStats.objects.filter(user__username__startswith=USERNAME_PREFIX)
+    viewer = stats.order_by("-follows_count").values_list("user_id", flat=True).first()
+    author = stats.order_by("-followers_count").values_list("user_id", flat=True).first()
+    if viewer is None:
+        raise ValueError("No benchmark data, run the seed_data command first")
+    post_id = (
+        PostStats.objects.filter(post__author__username__startswith=USERNAME_PREFIX)
+        .order_by("-comments_count").values_list("post_id", flat=True).first()
+    )
+    post = Post.objects.select_related("author").get(id=post_id)
+    comment = Comment.objects.select_related("author").filter(post=post).order_by("-id").first()
+    group = Group.objects.filter(slug__startswith=USERNAME_PREFIX).first()
+    word = post.text.split()[0].lower()
+    return {
+        "viewer": User.objects.get(id=viewer),
+        "author": User.objects.get(id=author),
+        "post_author": post.author,
+        "commenter": comment.author if comment else post.author,
+        "post": post,
+        "comment": comment,
+        "group": group,
+        "word": word,
+    }
+
+
+def routes(data):
+    """One Route per pattern of posts.urls."""
+    post, author = data["post"], data["post_author"]
+    post_path = f"/{author.username}/{post.id}/"
+    result = [
+        Route("index", "/"),
+        Route("group", f"/group/{data['group'].slug}/") if data["group"] else None,
+        Route("profile", f"/{data['author'].username}/"),
+        Route("post_view", post_path),
+        Route("comment_list", f"{post_path}comments/"),
+        Route("follow_index", "/follow/"),
+        Route("search", f"/search/?q={data['word']}"),
+        Route("api_index", "/api/feed/"),
+        Route("api_index_since", f"/api/feed/?since={encode_cursor([post.pub_date, post.id])}"),
+        Route("api_group", f"/api/feed/group/{data['group'].slug}/") if data["group"] else None,
+        Route("api_profile", f"/api/feed/user/{data['author'].username}/"),
+        Route("api_follow", "/api/feed/follow/"),
+        Route("export", "/export/", user="post_author"),
+        Route("post_new", "/new/"),
+        Route("post_edit", f"{post_path}edit/", user="post_author"),
+        Route("profile_edit", f"/{author.username}/edit/", user="post_author"),
+        Route("page_not_found", "/404"),
+        Route("server_error", "/500"),
+        Route("post_new_submit", "/new/", method="post", data={"text": "Benchmark post"}, write=True),
+        Route("post_edit_submit", f"{post_path}edit/", user="post_author", method="post",
+              data={"text": "Benchmark edit"}, write=True),
+        Route("post_delete", f"{post_path}delete/", user="post_author", write=True),
+        Route("comment_add", f"{post_path}comment/", method="post", data={"text": "Benchmark comment"},
+              write=True),
+        Route("comment_delete", f"{post_path}comment/{data['comment'].id}/delete/", user="commenter",
+              write=True) if data["comment"] else None,
+        Route("profile_follow", f"/{data['author'].username}/follow/", method="post", write=True),
+        Route("profile_unfollow", f"/{data['author'].username}/unfollow/", method="post", write=True),
+    ]
+    return [route for route in result if route is not None]
+
+
+def _request(client, route):
+    return getattr(client, route.method)(route.path, route.data or {})
+
+
+def measure(route, client, requests, warmup=2):
+    """Time a route through the test client, with queries and RSS per request."""
+    for _ in range(warmup if not route.write else 0):
+        _request(client, route)
+    latencies, queries = [], []
+    rss_before = current_rss_kb()
+    for _ in range(requests):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = _request(client, route)
+                latencies.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            # Every sample of a write starts from the same state
+            transaction.set_rollback(route.write)
+    summary = summarize(latencies)
+    summary.update(
+        status=response.status_code,
+        queries=max(queries),
+        rss_kb=current_rss_kb(),
+        rss_delta_kb=current_rss_kb() - rss_before,
+    )
+    return summary
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _closing_application(application):
+    # Worker threads of the server get their own connections, close them
+    # like a real deployment would at the end of each request
+    def wrapper(environ, start_response):
+        try:
+            return application(environ, start_response)
+        finally:
+            connections.close_all()
+    return wrapper
+
+
+def load(route_list, cookies, requests, concurrency):
+    """Hit read-only routes through a threaded wsgiref server with concurrent clients."""
+    server = make_server("127.0.0.1", 0, _closing_application(get_wsgi_application()),
+                         server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    results = {}
+
+    def fetch(route):
+        request = Request(base + route.path, headers={"Cookie": cookies[route.user]})
+        started = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                response.read()
+        except HTTPError as e:
+            e.read()
+        return time.perf_counter() - started
+
+    try:
+        for route in route_list:
+            if route.write:
+                continue
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as executor:
+                latencies = list(executor.map(fetch, [route] * requests))
+            summary = summarize(latencies)
+            summary["rps"] = round(requests / (time.perf_counter() - started), 1)
+            results[route.name] = summary
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def _split(path):
+    path, _, query = path.partition("?")
+    return path, query
+
+
+def _wsgi_fetch(application, route, cookie):
+    path, query = _split(route.path)
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": query, "HTTP_COOKIE": cookie}
+    setup_testing_defaults(environ)
+    started = time.perf_counter()
+    result = application(environ, lambda status, headers, exc_info=None: None)
+    try:
+        b"".join(result)
+    finally:
+        result.close()
+    return time.perf_counter() - started
+
+
+async def _asgi_fetch(application, route, cookie, slots):
+    path, query = _split(route.path)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "query_string": query.encode(), "root_path": "",
+        "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+        "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async with slots:
+        started = time.perf_counter()
+        await application(scope, receive, send)
+        return time.perf_counter() - started
+
+
+def servers(route_list, cookies, requests, concurrency):
+    """Read routes served in process by the WSGI and the ASGI application.
+
+    WSGI requests run on `concurrency` threads and query the database one
+    query after another, like before posts.parallel. ASGI requests run as
+    `concurrency` concurrent tasks of an event loop, with their independent
+    queries run concurrently.
+    """
+    from diary_network.asgi import WsgiToAsgi
+
+    wsgi = get_wsgi_application()
+    asgi = WsgiToAsgi(wsgi, max_workers=concurrency)
+
+    async def asgi_latencies(route, cookie):
+        slots = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(_asgi_fetch(asgi, route, cookie, slots) for _ in range(requests)))
+
+    results = {}
+    try:
+        for route in route_list:
+            if route.write:
+                continue
+            cookie = cookies[route.user]
+            started = time.perf_counter()
+            with override_settings(POSTS_QUERY_WORKERS=0), ThreadPoolExecutor(concurrency) as executor:
+                latencies = list(executor.map(lambda _: _wsgi_fetch(wsgi, route, cookie), range(requests)))
+            wsgi_summary = summarize(latencies)
+            wsgi_summary["rps"] = round(requests / (time.perf_counter() - started), 1)
+
+            started = time.perf_counter()
+            latencies = asyncio.run(asgi_latencies(route, cookie))
+            asgi_summary = summarize(latencies)
+            asgi_summary["rps"] = round(requests / (time.perf_counter() - started), 1)
+            results[route.name] = {"wsgi": wsgi_summary, "asgi": asgi_summary}
+    finally:
+        asgi.executor.shutdown()
+    return results
+
+
+@contextmanager
+def private_cache():
+    """Replace the configured caches with empty in-memory ones meanwhile."""
+    with override_settings(CACHES={
+        alias: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": f"benchmark-{alias}"}
+        for alias in settings.CACHES
+    }):
+        get_cache().clear()
+        yield
+
+
+def run(requests=50, warmup=2, load_requests=200, concurrency=4, only=None, compare_servers=False, log=None):
+    """Benchmark every route, returns a JSON serializable report."""
+    with private_cache():
+        return _run(requests, warmup, load_requests, concurrency, only, compare_servers,
+                    log or (lambda message: None))
+
+
+def _run(requests, warmup, load_requests, concurrency, only, compare_servers, log):
+    data = fixtures()
+    route_list = [route for route in routes(data) if not only or route.name in only]
+
+    clients = {}
+    for name in {route.user for route in route_list}:
+        clients[name] = Client()
+        clients[name].force_login(data[name])
+
+    report = {
+        "meta": {
+            "database": settings.DATABASES["default"]["ENGINE"],
+            "posts": Post.objects.count(),
+            "users": User.objects.count(),
+            "requests": requests,
+            "concurrency": concurrency,
+        },
+        "routes": {},
+    }
+    for route in route_list:
+        report["routes"][route.name] = {"client": measure(route, clients[route.user], requests, warmup)}
+        log(f"{route.name}: {report['routes'][route.name]['client']}")
+
+    cookie = settings.SESSION_COOKIE_NAME
+    cookies = {name: f"{cookie}={client.cookies[cookie].value}" for name, client in clients.items()}
+    if load_requests:
+        for name, summary in load(route_list, cookies, load_requests, concurrency).items():
+            report["routes"][name]["load"] = summary
+            log(f"{name} under load: {summary}")
+    if compare_servers:
+        for name, modes in servers(route_list, cookies, load_requests or requests, concurrency).items():
+            report["routes"][name].update(modes)
+            log(f"{name} WSGI vs ASGI: {modes}")
+    return report
+
+
+def compare(report, baseline, tolerance=0.25, slack_ms=1.0):
+    """Regressions of `report` against `baseline`, as human readable lines.
+
+    A route regresses when it runs more queries than before, or when its p95
+    latency grows by more than `tolerance` and `slack_ms` milliseconds.
+    """
+    regressions = []
+    for name, modes in baseline.get("routes", {}).items():
+        current = report["routes"].get(name)
+        if current is None:
+            continue
+        for mode, before in modes.items():
+            after = current.get(mode)
+            if after is None:
+                continue
+            if "queries" in before and after["queries"] > before["queries"]:
+                regressions.append(f"{name}: {before['queries']} -> {after['queries']} queries")
+            if after["p95"] > before["p95"] * (1 + tolerance) + slack_ms:
+                regressions.append(f"{name} ({mode}): p95 {before['p95']} -> {after['p95']} ms")
+    return regressions
+
+
+def save(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Rendering
+
+# post_item.html as it was before posts.cards, the baseline of render()
+LEGACY_CARD_TEMPLATE = """{% load cache %}
+<div class="card mb-3 mt-1 shadow-sm" style="width: 100%;">
+    {% cache 600 post_card post.pk post.cache_version post.author.username %}
+    {% if post.renditions_pending %}
+        <div class="card-img bg-secondary text-light text-center" style="height: 339px; line-height: 339px;">Изображение обрабатывается…</div>
+    {% elif post.image %}
+        {% with renditions=post.rendition_urls %}
+        {% if renditions.card %}
+        <img class="card-img" src="{{ renditions.card }}" srcset="{{ renditions.small }} 480w, {{ renditions.card }} 960w" sizes="(max-width: 480px) 480px, 960px">
+        {% else %}
+        <img class="card-img" src="{{ post.image.url }}">
+        {% endif %}
+        {% endwith %}
+    {% endif %}
+    <div class="card-body pb-0">
+        <p class="card-text">
+            <strong class="d-block">
+                <a href="{% url 'profile' post.author.username %}" class="card-link">@{{ post.author.get_full_name }}</a>
+                {% if post.group %}
+                (<a href="{% url 'group' post.group.slug %}" class="text-secondary">{{ post.group }}</a>)
+                {% endif %}
+            </strong>
+                {{ post.text|linebreaksbr }}
+        </p>
+    </div>
+    {% endcache %}
+    <div class="card-body pt-0">
+        <div class="d-flex justify-content-between align-items-center">
+            <div class="btn-group ">
+                <a class="btn btn-sm btn-primary" href="{% url 'post' post.author.username post.id %}" role="button">Комментарии</a>
+                {% if post.author.username == user.username %}
+                <a class="btn btn-sm btn-primary" href="{% url 'post_edit' post.author.username post.id %}" role="button">Редактировать</a>
+                <a class="btn btn-sm btn-primary" href="{% url 'post_delete' post.author.username post.id %}" role="button">Удалить</a>
+                {% endif %}
+            </div>                                            
+            <small class="text-muted">{{ post.pub_date|date:"d M Y H:i" }}</small>
+        </div>
+    </div>
+</div>"""
+LEGACY_PAGE_TEMPLATE = "{% for post in posts %}{% include card %}{% endfor %}"
+UNCACHED = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+
+def card_posts(count):
+    """Unsaved posts with authors and half of them with a group, enough to render cards."""
+    now = timezone.now()
+    group = Group(id=1, slug=f"{USERNAME_PREFIX}group", title="Bench group")
+    posts = [
+        Post(
+            id=i, text="First line\nsecond line & <more>", pub_date=now, updated=now,
+            author=User(id=i, username=f"{USERNAME_PREFIX}{i}", first_name="Bench", last_name=f"User {i}"),
+            group=group if i % 2 else None,
+        )
+        for i in range(1, count + 1)
+    ]
+    for post in posts:
+        post.render_text()
+    return posts
+
+
+def _time_page(render_page, repeat):
+    render_page()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        render_page()
+    return round((time.perf_counter() - start) / repeat * 1000, 3)
+
+
+def render(per_page=10, repeat=200):
+    """Milliseconds per feed page of cards, template includes against posts.cards.
+
+    "warm" has every card body cached, as in the steady state of a feed,
+    "uncached" renders them all.
+    """
+    posts = card_posts(per_page)
+    viewer = posts[0].author
+    engine = engines["django"]
+    card = engine.from_string(LEGACY_CARD_TEMPLATE)
+    page = engine.from_string(LEGACY_PAGE_TEMPLATE)
+    renderers = {
+        "template": lambda: page.render({"posts": posts, "card": card, "user": viewer}),
+        "renderer": lambda: CardRenderer(viewer).render(posts),
+    }
+
+    report = {}
+    for name, render_page in renderers.items():
+        with private_cache():
+            report[name] = {"warm": _time_page(render_page, repeat)}
+        with override_settings(CACHES=UNCACHED):
+            report[name]["uncached"] = _time_page(render_page, repeat)
+    return report
+
+
+# Sessions
+
+CACHED_AUTHENTICATION = "posts.middleware.CachedAuthenticationMiddleware"
+
+
+def session_modes():
+    """Settings of the session and authentication setups compared by sessions()."""
+    middleware = [
+        "django.contrib.auth.middleware.AuthenticationMiddleware" if name == CACHED_AUTHENTICATION else name
+        for name in settings.MIDDLEWARE
+    ]
+    return {
+        "database": {"SESSION_ENGINE": "django.contrib.sessions.backends.db", "MIDDLEWARE": middleware},
+        "cached": {},
+    }
+
+
+def sessions(requests=100, path="/follow/"):
+    """Time a login_required page with sessions and users read from the database, then from the cache."""
+    user = fixtures()["viewer"]
+    route = Route("sessions", path)
+    report = {}
+    for mode, overrides in session_modes().items():
+        with private_cache(), override_settings(**overrides):
+            client = Client()
+            client.force_login(user)
+            report[mode] = measure(route, client, requests)
+    return report
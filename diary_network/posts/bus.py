@@ -0,0 +1,72 @@
+"""In-process notifications of new posts, for long-polling feed requests.
+
+Topics are the cache scopes of posts.cache ("index", "author:{id}",
+"group:{id}"). publish() bumps a counter per topic and wakes every waiting
+thread; a waiter takes a snapshot() of the counters of its topics before
+reading the feed and then waits until one of them moves, so a post
+published between the read and the wait is not missed.
+
+The bus only spans one process: a post published by another worker is
+seen when the wait times out and the client polls again.
+
+Every waiting request holds a server thread, under diary_network.asgi one
+of a bounded pool. slot() lets at most POSTS_FEED_MAX_WAITERS requests of
+a process wait at a time, the others are answered at once.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+_condition = threading.Condition()
+_counters = {}
+_waiters = 0
+
+
+def publish(*topics):
+    with _condition:
+        for topic in topics:
+            _counters[topic] = _counters.get(topic, 0) + 1
+        _condition.notify_all()
+
+
+def snapshot(topics):
+    with _condition:
+        return {topic: _counters.get(topic, 0) for topic in topics}
+
+
+def changed(seen):
+    return any(_counters.get(topic, 0) != count for topic, count in seen.items())
+
+
+def wait(seen, timeout):
+    """Block until a topic of the `seen` snapshot is published, at most `timeout` seconds.
+
+    Returns whether one was.
+    """
+    deadline = time.monotonic() + timeout
+    with _condition:
+        while not changed(seen):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _condition.wait(remaining)
+        return True
+
+
+@contextmanager
+def slot():
+    """Reserve a waiting thread, yields whether one of POSTS_FEED_MAX_WAITERS was free."""
+    global _waiters
+    with _condition:
+        free = _waiters < settings.POSTS_FEED_MAX_WAITERS
+        if free:
+            _waiters += 1
+    try:
+        yield free
+    finally:
+        if free:
+            with _condition:
+                _waiters -= 1
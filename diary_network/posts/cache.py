@@ -0,0 +1,126 @@
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+
+from .formatting import FORMAT_VERSION
+
+
+# Fragment name of the cached card contents of posts.cards
+POST_CARD_FRAGMENT = "post_card"
+
+# Seconds a stale value is kept after its logical expiry, so that workers
+# losing the recompute lock still have something to serve
+STALE_GRACE = 60
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+
+
+def get_cache():
+    return caches[getattr(settings, "POSTS_CACHE_ALIAS", "default")]
+
+
+def post_card_key(post):
+    return make_template_fragment_key(
+        POST_CARD_FRAGMENT, [post.pk, post.cache_version, FORMAT_VERSION]
+    )
+
+
+def invalidate_post_card(post):
+    get_cache().delete(post_card_key(post))
+
+
+def post_scopes(post):
+    """Cache scopes of the feeds and the page a post appears in."""
+    scopes = ["index", f"author:{post.author_id}", f"post:{post.id}"]
+    if post.group_id:
+        scopes.append(f"group:{post.group_id}")
+    return scopes
+
+
+def get_or_compute(key, compute, timeout, beta=1.0, lock_timeout=LOCK_TIMEOUT, store=True):
+    """Stampede-safe cache read.
+
+    Entries remember how long they took to compute and are refreshed early
+    with a probability that grows towards expiry (XFetch), so hot keys are
+    usually recomputed before they expire. Only the worker holding the
+    `<key>:lock` entry recomputes; the others keep serving the stale value,
+    or wait for the winner when there is none.
+
+    With `store` False a missing or expiring value is computed but not
+    stored, e.g. when it is read from a replica that may lag behind the
+    generation in `key`.
+    """
+    cache = get_cache()
+    entry = cache.get(key)
+    now = time.time()
+    if entry is not None:
+        value, delta, expiry = entry
+        if now - delta * beta * math.log(1.0 - random.random()) < expiry:
+            return value
+    if not store:
+        return compute()
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            start = time.time()
+            value = compute()
+            delta = time.time() - start
+            cache.set(key, (value, delta, time.time() + timeout), timeout + STALE_GRACE)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    if entry is not None:
+        return entry[0]
+
+    deadline = now + lock_timeout
+    while time.time() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    return compute()
+
+
+def generation(scope):
+    """Current generation of a cache scope, part of the keys stored under it."""
+    cache = get_cache()
+    key = f"generation:{scope}"
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, 1, None)
+        value = cache.get(key, 1)
+    return value
+
+
+def generations(*scopes):
+    """Current generations of several scopes with a single cache read."""
+    cache = get_cache()
+    keys = [f"generation:{scope}" for scope in scopes]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, 1, None)
+            values[key] = cache.get(key, 1)
+    return [values[key] for key in keys]
+
+
+def bump_generation(*scopes):
+    """Invalidate everything cached under the given scopes.
+
+    Generations are stored without expiry and the cache backend must keep it
+    on incr(), see posts.cache_backends: a generation starting over would
+    make old ETags and cached pages valid again.
+    """
+    cache = get_cache()
+    for scope in scopes:
+        key = f"generation:{scope}"
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 2, None)
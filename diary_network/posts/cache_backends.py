@@ -0,0 +1,154 @@
+import os
+import pickle
+import time
+import zlib
+
+from django.core.cache.backends import filebased
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import locks
+from django.utils.module_loading import import_string
+
+
+class RedisCache(BaseCache):
+    """Minimal Redis cache backend for Django 2.2.
+
+    LOCATION is a redis:// URL. OPTIONS["CLIENT_CLASS"] may name any class
+    with a redis-py compatible `from_url()`, e.g. "fakeredis.FakeRedis" as an
+    offline stand-in. `add()` maps to SET NX, so it is safe to use as a lock
+    across processes. Integers are stored as such rather than pickled, so
+    `incr()` is an atomic INCRBY keeping the expiry of the key.
+    """
+
+    def __init__(self, server, params):
+        super().__init__(params)
+        self._server = server
+        self._options = params.get("OPTIONS") or {}
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            client_class = self._options.get("CLIENT_CLASS", "redis.Redis")
+            try:
+                client_class = import_string(client_class)
+            except ImportError:
+                raise ImproperlyConfigured(f"RedisCache requires {client_class} to be installed")
+            self._client = client_class.from_url(self._server)
+        return self._client
+
+    def _ttl(self, timeout):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        return max(int(timeout), 0)
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    @staticmethod
+    def _dumps(value):
+        # bool is an int but must come back as a bool
+        return value if type(value) is int else pickle.dumps(value)
+
+    @staticmethod
+    def _loads(value):
+        try:
+            return int(value)
+        except ValueError:
+            return pickle.loads(value)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        ttl = self._ttl(timeout)
+        if ttl == 0:
+            return False
+        return bool(self.client.set(self._key(key, version), self._dumps(value), nx=True, ex=ttl))
+
+    def get(self, key, default=None, version=None):
+        value = self.client.get(self._key(key, version))
+        return default if value is None else self._loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        ttl = self._ttl(timeout)
+        if ttl == 0:
+            self.client.delete(key)
+        else:
+            self.client.set(key, self._dumps(value), ex=ttl)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        # INCRBY creates missing keys, BaseCache.incr() raises instead
+        if not self.client.exists(key):
+            raise ValueError(f"Key '{key}' not found")
+        return self.client.incrby(key, delta)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        ttl = self._ttl(timeout)
+        if ttl is None:
+            return bool(self.client.persist(key))
+        return bool(self.client.expire(key, ttl))
+
+    def delete(self, key, version=None):
+        self.client.delete(self._key(key, version))
+
+    def has_key(self, key, version=None):
+        return bool(self.client.exists(self._key(key, version)))
+
+    def clear(self):
+        pattern = f"{self.key_prefix}:*"
+        keys = list(self.client.scan_iter(match=pattern))
+        if keys:
+            self.client.delete(*keys)
+
+
+class FileBasedCache(filebased.FileBasedCache):
+    """FileBasedCache with `add()` and `incr()` safe across processes.
+
+    Django's add() checks for the key and then sets it, so two processes
+    could both take a lock entry of posts.cache or posts.hot. Here adds
+    hold an exclusive lock on a file of the cache directory meanwhile.
+
+    BaseCache.incr() sets the new value with the default timeout, so
+    counters stored without one, e.g. the generations of posts.cache, would
+    expire and start over. The file is locked while it is rewritten, so
+    concurrent increments of processes sharing the directory add up.
+    """
+
+    # Not a cache file, so neither culled nor cleared
+    add_lock_name = "add.lock"
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._createdir()
+        with open(os.path.join(self._dir, self.add_lock_name), "ab") as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                if self.has_key(key, version):
+                    return False
+                self.set(key, value, timeout, version)
+                return True
+            finally:
+                locks.unlock(lock)
+
+    def incr(self, key, delta=1, version=None):
+        try:
+            with open(self._key_to_file(key, version), "r+b") as f:
+                locks.lock(f, locks.LOCK_EX)
+                try:
+                    expiry = pickle.load(f)
+                    if expiry is not None and expiry < time.time():
+                        raise ValueError(f"Key '{key}' not found")
+                    value = pickle.loads(zlib.decompress(f.read())) + delta
+                    f.seek(0)
+                    f.write(pickle.dumps(expiry, self.pickle_protocol))
+                    f.write(zlib.compress(pickle.dumps(value, self.pickle_protocol)))
+                    f.truncate()
+                finally:
+                    locks.unlock(f)
+        except (FileNotFoundError, EOFError):
+            raise ValueError(f"Key '{key}' not found")
+        return value
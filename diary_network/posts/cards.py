@@ -0,0 +1,148 @@
+"""Batched rendering of post cards.
+
+Feeds used to {% include %} a card template per post, each resolving its
+urls, filters and fragment cache separately. CardRenderer reverses every
+url once per page with placeholder arguments and only splices usernames
+and ids in per card. It fetches all cached card contents with one get_many()
+and builds the page in a single pass of string formatting.
+
+The image and text of each card are cached under post_card_key(), so
+invalidate_post_card() still applies. The byline, with the names of the
+author and the group, is filled in per card like the owner's buttons and
+the date, so renamed users and groups show up without invalidating cards.
+"""
+from django.urls import reverse
+from django.utils import formats, timezone
+from django.utils.encoding import iri_to_uri
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .cache import get_cache, post_card_key
+
+
+CARD_CACHE_TIMEOUT = 600
+DATE_FORMAT = "d M Y H:i"
+
+# Placeholder arguments, never produced by real usernames, slugs or ids
+USERNAME = "username-placeholder"
+SLUG = "slug-placeholder"
+POST_ID = 9876543210
+
+
+class ReversedUrl:
+    """A url reversed once with placeholder arguments, filled in per object."""
+
+    def __init__(self, name, *placeholders):
+        url = reverse(name, args=placeholders)
+        self.parts = [url]
+        for index, placeholder in enumerate(placeholders):
+            head, tail = self.parts[-1].split(str(placeholder), 1)
+            self.parts[-1:] = [head, index, tail]
+
+    def __call__(self, *values):
+        return "".join(
+            part if isinstance(part, str) else iri_to_uri(str(values[part]))
+            for part in self.parts
+        )
+
+
+PENDING_IMAGE = (
+    '<div class="card-img bg-secondary text-light text-center" style="height: 339px; line-height: 339px;">'
+    'Изображение обрабатывается…</div>'
+)
+RENDITION_IMAGE = (
+    '<img class="card-img" src="{card}" srcset="{small} 480w, {card} 960w" '
+    'sizes="(max-width: 480px) 480px, 960px">'
+)
+PLAIN_IMAGE = '<img class="card-img" src="{url}">'
+GROUP_LINK = '(<a href="{url}" class="text-secondary">{title}</a>)'
+BYLINE = """<strong class="d-block">
+                <a href="{profile_url}" class="card-link">@{full_name}</a>
+                {group}
+            </strong>"""
+BODY = """{image}
+    <div class="card-body pb-0">
+        <p class="card-text">
+            {byline}
+                {text}
+        </p>
+    </div>"""
+OWNER_BUTTONS = """
+                <a class="btn btn-sm btn-primary" href="{edit_url}" role="button">Редактировать</a>
+                <a class="btn btn-sm btn-primary" href="{delete_url}" role="button">Удалить</a>"""
+CARD = """<div class="card mb-3 mt-1 shadow-sm" style="width: 100%;">
+    {body}
+    <div class="card-body pt-0">
+        <div class="d-flex justify-content-between align-items-center">
+            <div class="btn-group ">
+                <a class="btn btn-sm btn-primary" href="{post_url}" role="button">Комментарии</a>{owner_buttons}
+            </div>
+            <small class="text-muted">{date}</small>
+        </div>
+    </div>
+</div>
+"""
+
+
+class CardRenderer:
+    def __init__(self, user):
+        self.username = user.username if user.is_authenticated else None
+        self.profile_url = ReversedUrl("profile", USERNAME)
+        self.group_url = ReversedUrl("group", SLUG)
+        self.post_url = ReversedUrl("post", USERNAME, POST_ID)
+        self.edit_url = ReversedUrl("post_edit", USERNAME, POST_ID)
+        self.delete_url = ReversedUrl("post_delete", USERNAME, POST_ID)
+
+    def image(self, post):
+        if post.renditions_pending:
+            return PENDING_IMAGE
+        if not post.image:
+            return ""
+        renditions = post.rendition_urls
+        if renditions.get("card"):
+            return RENDITION_IMAGE.format(card=escape(renditions["card"]), small=escape(renditions["small"]))
+        return PLAIN_IMAGE.format(url=escape(post.image.url))
+
+    def content(self, post):
+        """The cached parts of a card, which only change with the post."""
+        return self.image(post), post.body_html
+
+    def byline(self, post):
+        group = ""
+        if post.group_id:
+            group = GROUP_LINK.format(url=self.group_url(post.group.slug), title=escape(post.group.title))
+        return BYLINE.format(
+            profile_url=self.profile_url(post.author.username),
+            full_name=escape(post.author.get_full_name()),
+            group=group,
+        )
+
+    def card(self, post, content):
+        image, text = content
+        body = BODY.format(image=image, byline=self.byline(post), text=text)
+        username = post.author.username
+        owner_buttons = ""
+        if username == self.username:
+            owner_buttons = OWNER_BUTTONS.format(
+                edit_url=self.edit_url(username, post.id),
+                delete_url=self.delete_url(username, post.id),
+            )
+        return CARD.format(
+            body=body,
+            post_url=self.post_url(username, post.id),
+            owner_buttons=owner_buttons,
+            date=formats.date_format(timezone.localtime(post.pub_date), DATE_FORMAT),
+        )
+
+    def render(self, posts):
+        posts = list(posts)
+        cache = get_cache()
+        keys = [post_card_key(post) for post in posts]
+        contents = cache.get_many(keys)
+        missing = {}
+        for post, key in zip(posts, keys):
+            if key not in contents:
+                contents[key] = missing[key] = self.content(post)
+        if missing:
+            cache.set_many(missing, CARD_CACHE_TIMEOUT)
+        return mark_safe("".join(self.card(post, contents[key]) for post, key in zip(posts, keys)))
@@ -0,0 +1,115 @@
+"""ETags of the feed and post pages, for views decorated with condition().
+
+An ETag combines the cache generations (posts.cache) of everything a page
+shows with what makes the page differ between requests for the same URL:
+the viewer, the query string and the CSRF token embedded in forms. The
+ids it needs are memoized in the cache, so a conditional request is
+answered with 304 after a couple of cache reads, without running the
+view's queries or rendering its templates. Pages read from a replica get
+no ETag, see make_etag(). Groups are memoized whole, the
+group page shows their title and description.
+"""
+import hashlib
+
+from .cache import bump_generation, generations, get_cache
+from .models import Follow, Group, User
+from . import db
+
+
+# Lookups are also invalidated by posts.signals, this only bounds the
+# lifetime of entries for renamed or deleted rows
+LOOKUP_TIMEOUT = 300
+
+
+def _memoized(key, compute):
+    cache = get_cache()
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        # Replicas may still show what signals just invalidated
+        if value is not None and db.current_replica() is None:
+            cache.set(key, value, LOOKUP_TIMEOUT)
+    return value
+
+
+def user_id_key(username):
+    return f"user-id:{username}"
+
+
+def user_id(username):
+    return _memoized(
+        user_id_key(username),
+        lambda: User.objects.filter(username=username).values_list("id", flat=True).first(),
+    )
+
+
+def group_key(slug):
+    return f"group-slug:{slug}"
+
+
+def group_by_slug(slug):
+    """The group shown by /group/<slug>/, memoized for its header as well."""
+    return _memoized(group_key(slug), lambda: Group.objects.filter(slug=slug).first())
+
+
+def group_id(slug):
+    group = group_by_slug(slug)
+    return group.id if group else None
+
+
+def followed_ids_key(user_id):
+    return f"follows:{user_id}"
+
+
+def followed_ids(user_id):
+    return _memoized(
+        followed_ids_key(user_id),
+        lambda: list(Follow.objects.filter(user_id=user_id).order_by("author_id").values_list("author_id", flat=True)),
+    )
+
+
+def follow_changed(user_id, author_id):
+    # Both profiles show follow counters, the follower's feed changes
+    bump_generation(f"author:{user_id}", f"author:{author_id}")
+    get_cache().delete(followed_ids_key(user_id))
+
+
+def make_etag(request, scopes):
+    # A page read from a lagging replica may be older than the current
+    # generations; without an ETag its clients revalidate on every request
+    if db.current_replica() is not None:
+        return None
+    parts = [
+        *scopes,
+        *generations(*scopes),
+        # The navigation bar shows the viewer's username
+        request.user.id,
+        request.user.get_username(),
+        request.META.get("QUERY_STRING", ""),
+        request.META.get("CSRF_COOKIE", ""),
+    ]
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def index_etag(request):
+    return make_etag(request, ["index"])
+
+
+def group_etag(request, slug):
+    pk = group_id(slug)
+    return make_etag(request, [f"group:{pk}"]) if pk else None
+
+
+def profile_etag(request, username):
+    pk = user_id(username)
+    return make_etag(request, [f"author:{pk}"]) if pk else None
+
+
+def post_etag(request, username, post_id):
+    # The sidebar shows the counters of the author of the url
+    pk = user_id(username)
+    return make_etag(request, [f"post:{post_id}", f"author:{pk}"]) if pk else None
+
+
+def follow_etag(request):
+    return make_etag(request, [f"author:{pk}" for pk in followed_ids(request.user.id)])
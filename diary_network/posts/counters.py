@@ -0,0 +1,117 @@
+"""Denormalized counters for profiles and posts, and references to images.
+
+Counters are bumped with single `UPDATE ... SET n = n + 1` statements from
+the model signals in posts.signals, so the profile sidebar reads one row
+instead of running COUNT queries. `reconcile()` repairs any drift.
+"""
+from django.db.models import Count, F
+
+from . import media
+from .models import Comment, Follow, MediaFile, Post, PostStats, User, UserStats
+
+
+USER_COUNTERS = ("posts_count", "followers_count", "follows_count")
+
+
+def _bump(model, key_field, key, field, delta):
+    rows = model.objects.filter(**{key_field: key})
+    if delta < 0:
+        # Never go below zero, drift is left to reconcile()
+        rows.filter(**{f"{field}__gt": 0}).update(**{field: F(field) + delta})
+        return
+    if rows.update(**{field: F(field) + delta}):
+        return
+    _, created = model.objects.get_or_create(**{key_field: key}, defaults={field: delta})
+    if not created:
+        rows.update(**{field: F(field) + delta})
+
+
+def bump_user(user_id, field, delta=1):
+    _bump(UserStats, "user_id", user_id, field, delta)
+
+
+def bump_post(post_id, field, delta=1):
+    _bump(PostStats, "post_id", post_id, field, delta)
+
+
+def _user_counts(user_ids=None):
+    posts = Post.objects.all()
+    followers = Follow.objects.all()
+    follows = Follow.objects.all()
+    if user_ids is not None:
+        posts = posts.filter(author_id__in=user_ids)
+        followers = followers.filter(author_id__in=user_ids)
+        follows = follows.filter(user_id__in=user_ids)
+    return {
+        "posts_count": dict(posts.values_list("author_id").annotate(n=Count("id"))),
+        "followers_count": dict(followers.values_list("author_id").annotate(n=Count("id"))),
+        "follows_count": dict(follows.values_list("user_id").annotate(n=Count("id"))),
+    }
+
+
+def user_stats(user):
+    """Counters of a user, computed once if the row does not exist yet."""
+    try:
+        return UserStats.objects.get(user_id=user.id)
+    except UserStats.DoesNotExist:
+        counts = _user_counts([user.id])
+        values = {field: counts[field].get(user.id, 0) for field in USER_COUNTERS}
+        stats, _ = UserStats.objects.get_or_create(user_id=user.id, defaults=values)
+        return stats
+
+
+def reconcile():
+    """Recompute every counter from the source tables, returns the number of rows fixed."""
+    fixed = 0
+
+    counts = _user_counts()
+    existing = {stats.user_id: stats for stats in UserStats.objects.all()}
+    changed, missing = [], []
+    for user_id in User.objects.values_list("id", flat=True).iterator():
+        values = {field: counts[field].get(user_id, 0) for field in USER_COUNTERS}
+        stats = existing.get(user_id)
+        if stats is None:
+            missing.append(UserStats(user_id=user_id, **values))
+        elif any(getattr(stats, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(stats, field, value)
+            changed.append(stats)
+    UserStats.objects.bulk_create(missing, batch_size=500)
+    UserStats.objects.bulk_update(changed, USER_COUNTERS, batch_size=500)
+    fixed += len(missing) + len(changed)
+
+    comments = dict(Comment.objects.values_list("post_id").annotate(n=Count("id")))
+    existing = {stats.post_id: stats for stats in PostStats.objects.all()}
+    changed, missing = [], []
+    for post_id in set(comments) | set(existing):
+        value = comments.get(post_id, 0)
+        stats = existing.get(post_id)
+        if stats is None:
+            missing.append(PostStats(post_id=post_id, comments_count=value))
+        elif stats.comments_count != value:
+            stats.comments_count = value
+            changed.append(stats)
+    PostStats.objects.bulk_create(missing, batch_size=500)
+    PostStats.objects.bulk_update(changed, ["comments_count"], batch_size=500)
+    fixed += len(missing) + len(changed)
+
+    images = Post.objects.exclude(image="").exclude(image=None).values_list("image").annotate(n=Count("id"))
+    references = {name: n for name, n in images.order_by() if media.is_content_addressed(name)}
+    existing = {row.name: row for row in MediaFile.objects.all()}
+    changed, missing = [], []
+    for name, value in references.items():
+        row = existing.get(name)
+        if row is None:
+            # e.g. posts of an imported archive
+            missing.append(MediaFile(name=name, refs=value))
+        elif row.refs != value:
+            row.refs = value
+            changed.append(row)
+    # Files no post references are left alone: uploads acquire their
+    # reference before the post is saved, and files are only deleted by
+    # media.release()
+    MediaFile.objects.bulk_create(missing, batch_size=500)
+    MediaFile.objects.bulk_update(changed, ["refs"], batch_size=500)
+    fixed += len(missing) + len(changed)
+
+    return fixed
@@ -0,0 +1,117 @@
+"""Read replicas and SQLite connection tuning.
+
+ReplicaRouter sends the reads of safe requests to one of the aliases in
+POSTS_DB_REPLICAS, chosen once per request, and everything else to
+"default". ReplicaMiddleware decides which requests may use a replica: a
+request that writes pins the client to the primary for POSTS_DB_PIN_SECONDS
+through a cookie, so users always read their own writes. Outside of
+requests (management commands, shell) every query goes to the primary.
+
+Locally, replicas are SQLite files listed in DIARY_DB_REPLICAS and
+refreshed from the primary with the sync_replicas command.
+"""
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+_state = threading.local()
+
+
+def start_request(use_replicas):
+    """Route the reads of the current thread to a replica until end_request()."""
+    replicas = settings.POSTS_DB_REPLICAS
+    _state.replica = random.choice(replicas) if use_replicas and replicas else None
+    _state.wrote = False
+    return _state.replica
+
+
+def end_request():
+    """Stop routing reads to a replica, returns whether the request wrote."""
+    wrote = getattr(_state, "wrote", False)
+    _state.replica = None
+    _state.wrote = False
+    return wrote
+
+
+def current_replica():
+    return getattr(_state, "replica", None)
+
+
+def mark_written():
+    _state.replica = None
+    _state.wrote = True
+
+
+@contextmanager
+def routing(replica):
+    """Route the reads of a helper thread like those of the request it works for.
+
+    Yields a function telling whether the thread wrote in the meantime.
+    """
+    _state.replica = replica
+    _state.wrote = False
+    try:
+        yield lambda: _state.wrote
+    finally:
+        _state.replica = None
+        _state.wrote = False
+
+
+class ReplicaRouter:
+    # Session rows change on every login and must never be read stale
+    PRIMARY_APPS = ("sessions",)
+
+    def db_for_read(self, model, **hints):
+        replica = getattr(_state, "replica", None)
+        if replica is None or model._meta.app_label in self.PRIMARY_APPS:
+            return "default"
+        if connections["default"].in_atomic_block:
+            return "default"
+        return replica
+
+    def db_for_write(self, model, **hints):
+        # Reads after a write in the same request must see it
+        mark_written()
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {"default", *settings.POSTS_DB_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary, never migrated on their own
+        return db == "default"
+
+
+def apply_pragmas(raw_connection, read_only=False):
+    for name, value in settings.POSTS_SQLITE_PRAGMAS.items():
+        raw_connection.execute(f"PRAGMA {name} = {value}")
+    if read_only:
+        raw_connection.execute("PRAGMA query_only = ON")
+
+
+def configure_connection(connection):
+    """Tune new SQLite connections, see POSTS_SQLITE_PRAGMAS."""
+    if connection.vendor != "sqlite":
+        return
+    # The raw connection keeps these statements out of query logs and counts
+    apply_pragmas(connection.connection, read_only=connection.alias in settings.POSTS_DB_REPLICAS)
+
+
+def copy_sqlite(source, target):
+    """Consistent copy of a live SQLite database with the online backup API."""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        with dst:
+            src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
@@ -0,0 +1,89 @@
+"""Posts of a feed newer than a cursor, for the JSON feed API.
+
+A cursor is the encoded (pub_date, post id) of the newest post a client
+has, as returned by the previous response. The same cursor works for every
+feed.
+
+The follow feed reads the posts of the followed authors rather than the
+user's timeline: posts.bus wakes waiting requests as soon as a post is
+saved, while its timeline entries are only written later by the fan_out
+job.
+"""
+from datetime import datetime
+
+from django.urls import reverse
+from django.utils import timezone
+
+from .pagination import FEED_KEYS, decode_cursor, keyset_filter
+from .models import Post
+from . import conditional
+
+
+FEED_API_LIMIT = 20
+
+# Cursor of an empty feed, older than any post
+EPOCH = [datetime(1970, 1, 1, tzinfo=timezone.utc), 0]
+
+
+def parse_cursor(token):
+    return decode_cursor(token, (datetime, int))
+
+
+class Feed:
+    def __init__(self, queryset, topics, keys=FEED_KEYS):
+        self.queryset = queryset
+        # posts.bus topics a new post of this feed is published to
+        self.topics = topics
+        self.keys = keys
+
+    def newer(self, since=None, limit=FEED_API_LIMIT, using=None):
+        """Return (posts newest first, cursor values, has_more).
+
+        Without `since` these are the latest posts. Otherwise they are the
+        oldest `limit` posts after it, and has_more tells the client to ask
+        again with the returned cursor.
+        """
+        queryset = self.queryset if using is None else self.queryset.using(using)
+        if since is None:
+            posts = list(queryset.order_by(*(f"-{key}" for key in self.keys))[:limit])
+            has_more = False
+        else:
+            rows = list(queryset.filter(keyset_filter(self.keys, since, "gt")).order_by(*self.keys)[:limit + 1])
+            has_more = len(rows) > limit
+            posts = rows[:limit][::-1]
+
+        if posts:
+            cursor = [posts[0].pub_date, posts[0].id]
+        else:
+            cursor = since or EPOCH
+        return posts, cursor, has_more
+
+
+def index_feed():
+    return Feed(Post.objects.for_feed(), ["index"])
+
+
+def group_feed(group_id):
+    return Feed(Post.objects.for_feed().filter(group_id=group_id), [f"group:{group_id}"])
+
+
+def author_feed(author_id):
+    return Feed(Post.objects.for_feed().filter(author_id=author_id), [f"author:{author_id}"])
+
+
+def follow_feed(user):
+    author_ids = conditional.followed_ids(user.id)
+    return Feed(Post.objects.for_feed().filter(author_id__in=author_ids), [f"author:{pk}" for pk in author_ids])
+
+
+def serialize(post):
+    return {
+        "id": post.id,
+        "author": post.author.username,
+        "author_name": post.author.get_full_name(),
+        "group": post.group.slug if post.group_id else None,
+        "text": post.text,
+        "pub_date": post.pub_date.isoformat(),
+        "url": reverse("post", args=[post.author.username, post.id]),
+        "image": post.image.url if post.image else None,
+    }
@@ -0,0 +1,123 @@
+"""Idempotent follow and unfollow.
+
+A follow is a single INSERT OR IGNORE, which the unique (user, author)
+constraint turns into a no-op when the row exists, and an unfollow a single
+DELETE. Their row counts tell whether they changed anything, and only then
+are the counters moved, in the same transaction. Neither reads the row
+first: concurrent clicks cannot create duplicates or move the counters
+twice, and SQLite transactions starting with a write wait for each other
+instead of failing on a stale snapshot.
+
+Statements go to the primary, like ORM writes, and skip the Follow signals
+since they do what the signals would.
+"""
+from collections import Counter
+
+from django.db import connections, router, transaction
+
+from . import conditional, jobs, timeline
+from .counters import bump_user
+from .models import Follow
+
+
+BATCH_SIZE = 500
+
+
+def _connection():
+    # The router also pins the request to the primary for its next reads
+    return connections[router.db_for_write(Follow)]
+
+
+def _insert(cursor, connection, user_id, author_id):
+    ops = connection.ops
+    cursor.execute(
+        f"{ops.insert_statement(ignore_conflicts=True)} {ops.quote_name(Follow._meta.db_table)} "
+        f"(user_id, author_id) VALUES (%s, %s) {ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}",
+        [user_id, author_id],
+    )
+    return cursor.rowcount > 0
+
+
+def _delete(cursor, connection, user_id, author_id):
+    cursor.execute(
+        f"DELETE FROM {connection.ops.quote_name(Follow._meta.db_table)} WHERE user_id = %s AND author_id = %s",
+        [user_id, author_id],
+    )
+    return cursor.rowcount > 0
+
+
+def _change(statement, user_id, author_id, delta):
+    connection = _connection()
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            changed = statement(cursor, connection, user_id, author_id)
+        if changed:
+            _bump_counters([(user_id, author_id)], delta)
+            sync_later(user_id, author_id)
+    return changed
+
+
+def follow(user, author):
+    """Follow an author, returns False if the user already follows them."""
+    if user.id == author.id:
+        return False
+    return _change(_insert, user.id, author.id, 1)
+
+
+def unfollow(user, author):
+    """Unfollow an author, returns False if the user did not follow them."""
+    return _change(_delete, user.id, author.id, -1)
+
+
+def sync_later(user_id, author_id):
+    """Backfill or clear the follower's timeline in the background, see posts.tasks."""
+    jobs.enqueue("sync_follow", user_id, author_id, key=f"sync_follow:{user_id}:{author_id}")
+
+
+def _batches(pairs):
+    batch = []
+    for user_id, author_id in pairs:
+        if user_id == author_id:
+            continue
+        batch.append((user_id, author_id))
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _bump_counters(pairs, delta):
+    for author_id, count in Counter(author_id for _, author_id in pairs).items():
+        bump_user(author_id, "followers_count", delta * count)
+    for user_id, count in Counter(user_id for user_id, _ in pairs).items():
+        bump_user(user_id, "follows_count", delta * count)
+    for user_id, author_id in pairs:
+        conditional.follow_changed(user_id, author_id)
+
+
+def _bulk_change(statement, pairs, delta):
+    changed = []
+    for batch in _batches(pairs):
+        connection = _connection()
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                rows = [pair for pair in batch if statement(cursor, connection, *pair)]
+            _bump_counters(rows, delta)
+            # Timelines are written inline rather than by a job per follow
+            if delta > 0:
+                timeline.add_authors(rows)
+            else:
+                timeline.remove_authors(rows)
+        changed += rows
+    return len(changed)
+
+
+def bulk_follow(pairs):
+    """Create follows from (user_id, author_id) pairs in batches, returns how many were new."""
+    return _bulk_change(_insert, pairs, 1)
+
+
+def bulk_unfollow(pairs):
+    """Remove follows given as (user_id, author_id) pairs, returns how many existed."""
+    return _bulk_change(_delete, pairs, -1)
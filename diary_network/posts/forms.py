@@ -1,8 +1,21 @@
+from django.core.exceptions import ValidationError
 from django.forms import ModelForm, Textarea
+from django.urls import NoReverseMatch, Resolver404, resolve, reverse
 
 from .models import Comment, Group, Post, User
 
 
+def validate_username(username):
+    """Reject usernames whose pages are served by fixed routes, e.g. /search/."""
+    for name, args in (("profile", [username]), ("post", [username, 1])):
+        try:
+            match = resolve(reverse(name, args=args))
+        except (NoReverseMatch, Resolver404):
+            continue
+        if match.url_name != name:
+            raise ValidationError("Это имя занято адресом сайта", code="reserved")
+
+
 class GroupForm(ModelForm):
     class Meta:
         model = Group
@@ -46,3 +59,8 @@ class UserEditForm(ModelForm):
             'username': 'Имя пользователя*',
             'email': 'Адрес электронной почты'
         }
+
+    def clean_username(self):
+        username = self.cleaned_data["username"]
+        validate_username(username)
+        return username
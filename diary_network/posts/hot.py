@@ -0,0 +1,147 @@
+"""Per-group cache of the keys of recent posts.
+
+Each group keeps the (pub_date, id) of its newest HOT_SIZE posts in the
+cache. posts.signals updates the list in place when a post of the group is
+created, moved or deleted, rather than dropping it, so busy groups are not
+recomputed on every new post. Cursor pages within the list cost a primary
+key lookup of their posts whatever the size of the group; older pages fall
+back to posts.pagination.
+
+Updates and refills of a list are serialized by a `<key>:lock` entry, so a
+refill reading the database before a post commits cannot overwrite the
+update adding it.
+"""
+import time
+
+from .cache import LOCK_POLL_INTERVAL, LOCK_TIMEOUT, get_cache
+from .models import Post
+from .pagination import CursorPage, check_cursor
+
+
+HOT_SIZE = 200
+# Bounds how long a list missing an update, e.g. after a crash, is served
+HOT_TIMEOUT = 3600
+
+
+def hot_key(group_id):
+    return f"group-hot:{group_id}"
+
+
+def _acquire(cache, key):
+    deadline = time.time() + LOCK_TIMEOUT
+    while not cache.add(f"{key}:lock", 1, LOCK_TIMEOUT):
+        if time.time() >= deadline:
+            return False
+        time.sleep(LOCK_POLL_INTERVAL)
+    return True
+
+
+def _load(group_id):
+    rows = list(
+        Post.objects.filter(group_id=group_id)
+        .order_by("-pub_date", "-id")
+        .values_list("pub_date", "id")[:HOT_SIZE + 1]
+    )
+    # Complete lists hold every post of the group
+    return rows[:HOT_SIZE], len(rows) <= HOT_SIZE
+
+
+def recent(group_id):
+    """Return ([(pub_date, id)] newest first, complete), or None while another worker holds the list."""
+    cache = get_cache()
+    key = hot_key(group_id)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+    if not cache.add(f"{key}:lock", 1, LOCK_TIMEOUT):
+        return None
+    try:
+        entry = _load(group_id)
+        cache.set(key, entry, HOT_TIMEOUT)
+    finally:
+        cache.delete(f"{key}:lock")
+    return entry
+
+
+def _update(group_id, change):
+    cache = get_cache()
+    key = hot_key(group_id)
+    if not _acquire(cache, key):
+        cache.delete(key)
+        return
+    try:
+        entry = cache.get(key)
+        if entry is not None:
+            cache.set(key, change(*entry), HOT_TIMEOUT)
+    finally:
+        cache.delete(f"{key}:lock")
+
+
+def add(post):
+    if not post.group_id:
+        return
+    item = (post.pub_date, post.id)
+
+    def change(rows, complete):
+        rows = sorted({*rows, item}, reverse=True)
+        return rows[:HOT_SIZE], complete and len(rows) <= HOT_SIZE
+
+    _update(post.group_id, change)
+
+
+def remove(group_id, post_id):
+    if not group_id:
+        return
+    _update(group_id, lambda rows, complete: ([row for row in rows if row[1] != post_id], complete))
+
+
+def forget(group_id):
+    """Drop the list of a group written to without signals, e.g. by bulk_create()."""
+    get_cache().delete(hot_key(group_id))
+
+
+def _window(rows, complete, per_page, after, before):
+    """Key values of a cursor page taken from the list, None when it reaches past its end."""
+    if before is not None:
+        before = tuple(before)
+        end = next((i for i, row in enumerate(rows) if row <= before), len(rows))
+        if end == len(rows) and not complete:
+            return None
+        start = max(0, end - per_page)
+        window = rows[start:end]
+        return (window, window[-1] if window else list(before),
+                window[0] if start > 0 else None, True, start > 0)
+
+    start = 0 if after is None else next((i for i, row in enumerate(rows) if row < tuple(after)), len(rows))
+    window = rows[start:start + per_page + 1]
+    has_next = len(window) > per_page
+    if not has_next and not complete:
+        return None
+    window = window[:per_page]
+    return (window, window[-1] if has_next else None,
+            window[0] if window and after is not None else None, has_next, after is not None)
+
+
+def get_page(group_id, paginator, after=None, before=None):
+    """A CursorPage of the group served from its list, or None."""
+    try:
+        # Cursors are compared with the (pub_date, id) of the list
+        after = check_cursor(after, paginator.key_types) if after is not None else None
+        before = check_cursor(before, paginator.key_types) if before is not None else None
+    except ValueError:
+        return None
+    entry = recent(group_id)
+    if entry is None:
+        return None
+    window = _window(*entry, paginator.per_page, after, before)
+    if window is None:
+        return None
+    rows, next_values, previous_values, has_next, has_previous = window
+    posts = paginator.queryset.in_bulk([pk for _, pk in rows])
+    object_list = [posts[pk] for _, pk in rows if pk in posts]
+    return CursorPage(
+        object_list, paginator,
+        next_values=list(next_values) if next_values else None,
+        previous_values=list(previous_values) if previous_values else None,
+        has_next=has_next, has_previous=has_previous,
+    )
@@ -0,0 +1,174 @@
+"""Background jobs for the slow side effects of writes.
+
+posts.signals enqueues a job per side effect whose cost grows with the
+data (timeline fan-out, search indexing, image renditions), so write
+requests only insert a row. Tasks are functions registered with @task,
+see posts.tasks. They receive JSON arguments and should recompute from the
+current state of the database rather than from the event that queued them:
+a job may run late, twice or after a newer one.
+
+The backend is chosen by POSTS_JOB_BACKEND:
+
+- DatabaseBackend stores jobs in the Job table, in the transaction of the
+  write that queued them. `python manage.py run_worker` runs them, retrying
+  failures with exponential backoff up to the task's max_attempts. Jobs of
+  a worker that died are taken over when their lease expires.
+- EagerBackend runs jobs immediately, for tests and single-process setups.
+  Its only attempt is the last one.
+
+A task's `on_failure` function is called with its arguments once the last
+attempt has failed, e.g. to record that a result will not come.
+
+A job queued with the `key` of a queued job that has not started yet is
+dropped, so a burst of edits to a post indexes it once.
+"""
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker may run a job before others consider it dead
+LEASE_SECONDS = 300
+MAX_BACKOFF = 3600
+
+TASKS = {}
+
+
+def task(name, max_attempts=3, on_failure=None):
+    def register(function):
+        function.max_attempts = max_attempts
+        function.on_failure = on_failure
+        TASKS[name] = function
+        return function
+    return register
+
+
+def run_task(name, args):
+    TASKS[name](*args)
+
+
+def give_up(name, args):
+    on_failure = TASKS[name].on_failure
+    if on_failure is not None:
+        on_failure(*args)
+
+
+class EagerBackend:
+    def enqueue(self, name, args, key=None, delay=0):
+        try:
+            run_task(name, args)
+        except Exception:
+            give_up(name, args)
+            raise
+
+
+class DatabaseBackend:
+    def enqueue(self, name, args, key=None, delay=0):
+        job = Job(
+            name=name, args=json.dumps(args), key=key,
+            max_attempts=TASKS[name].max_attempts,
+            run_at=timezone.now() + timedelta(seconds=delay),
+        )
+        try:
+            with transaction.atomic():
+                job.save()
+        except IntegrityError:
+            # The queued job with this key has not started, it will see our changes
+            return None
+        return job
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    path = settings.POSTS_JOB_BACKEND
+    if _backend is None or _backend.path != path:
+        _backend = import_string(path)()
+        _backend.path = path
+    return _backend
+
+
+def enqueue(name, *args, key=None, delay=0):
+    """Run the task `name` with `args` in the background."""
+    if name not in TASKS:
+        raise KeyError(f"Unknown task {name}")
+    return get_backend().enqueue(name, list(args), key=key, delay=delay)
+
+
+# Worker
+
+def _claimable(now):
+    return Q(status=Job.PENDING, run_at__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now)
+
+
+def claim():
+    """Take the next due job, or return None."""
+    now = timezone.now()
+    candidates = Job.objects.filter(_claimable(now)).order_by("run_at", "id").values_list("id", flat=True)[:10]
+    for pk in candidates:
+        # Losing the race for a job leaves it to the worker that won
+        claimed = Job.objects.filter(_claimable(now), pk=pk).update(
+            status=Job.RUNNING,
+            locked_until=now + timedelta(seconds=LEASE_SECONDS),
+            attempts=F("attempts") + 1,
+            # Writes from now on need a new job to be picked up
+            key=None,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job, returns whether it succeeded."""
+    try:
+        run_task(job.name, json.loads(job.args))
+    except Exception as e:
+        logger.exception("Job %s %s failed", job.pk, job)
+        rows = Job.objects.filter(pk=job.pk)
+        if job.attempts >= job.max_attempts:
+            rows.update(status=Job.FAILED, locked_until=None, last_error=repr(e))
+            give_up(job.name, json.loads(job.args))
+        else:
+            delay = min(2 ** job.attempts, MAX_BACKOFF)
+            rows.update(status=Job.PENDING, locked_until=None, last_error=repr(e),
+                        run_at=timezone.now() + timedelta(seconds=delay))
+        return False
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def work(once=False, poll_interval=1.0, max_jobs=None, log=None):
+    """Run due jobs, returns (succeeded, failed) counts.
+
+    With `once` it stops when no job is due instead of polling for more.
+    """
+    log = log or (lambda message: None)
+    succeeded = failed = 0
+    while max_jobs is None or succeeded + failed < max_jobs:
+        close_old_connections()
+        job = claim()
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        if run_job(job):
+            succeeded += 1
+        else:
+            failed += 1
+            log(f"Job {job.pk} {job} failed, attempt {job.attempts} of {job.max_attempts}")
+    return succeeded, failed
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = "Benchmark every posts URL on the seeded dataset and compare with a baseline"
+
+    MODES = {"load": "under load", "wsgi": "WSGI", "asgi": "ASGI"}
+
+    def add_arguments(self, parser):
+        parser.add_argument("routes", nargs="*", help="Only benchmark these routes")
+        parser.add_argument("--requests", type=int, default=50, help="Test client requests per route")
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--load-requests", type=int, default=200,
+                            help="Requests per route through the WSGI server, 0 to skip")
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--servers", action="store_true",
+                            help="Also compare the WSGI and ASGI applications in process")
+        parser.add_argument("--save", metavar="PATH", help="Write the report as a JSON baseline")
+        parser.add_argument("--compare", metavar="PATH", help="Fail on regressions against this baseline")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="Allowed relative p95 growth before it counts as a regression")
+
+    def handle(self, *args, **options):
+        verbose = options["verbosity"] > 1
+        try:
+            report = benchmark.run(
+                requests=options["requests"],
+                warmup=options["warmup"],
+                load_requests=options["load_requests"],
+                concurrency=options["concurrency"],
+                only=options["routes"],
+                compare_servers=options["servers"],
+                log=self.stdout.write if verbose else None,
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.stdout.write(
+            f"{'route':<20}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}{'rss kb':>10}{'req/s':>9}"
+        )
+        for name, modes in report["routes"].items():
+            for mode, row in modes.items():
+                label = name if mode == "client" else f"  {self.MODES.get(mode, mode)}"
+                self.stdout.write(
+                    f"{label:<20}{row['p50']:>9}{row['p95']:>9}{row['p99']:>9}"
+                    f"{row.get('queries', ''):>9}{row.get('rss_kb', ''):>10}{row.get('rps', ''):>9}"
+                )
+
+        if options["save"]:
+            benchmark.save(report, options["save"])
+            self.stdout.write(f"Baseline saved to {options['save']}")
+        if options["compare"]:
+            try:
+                baseline = benchmark.read(options["compare"])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline: {e}")
+            regressions = benchmark.compare(report, baseline, options["tolerance"])
+            if regressions:
+                raise CommandError("Regressions:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = "Compare the time to render a feed page of post cards with templates and with posts.cards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--per-page", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=200)
+
+    def handle(self, *args, **options):
+        report = benchmark.render(per_page=options["per_page"], repeat=options["repeat"])
+        self.stdout.write(f"{'ms per page':<14}{'warm':>10}{'uncached':>10}")
+        for name, row in report.items():
+            self.stdout.write(f"{name:<14}{row['warm']:>10}{row['uncached']:>10}")
+        template, renderer = report["template"], report["renderer"]
+        self.stdout.write(
+            f"{'speedup':<14}{template['warm'] / renderer['warm']:>9.1f}x"
+            f"{template['uncached'] / renderer['uncached']:>9.1f}x"
+        )
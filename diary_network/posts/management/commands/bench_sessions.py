@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = "Compare a login_required page with database sessions and with cached sessions and users"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--path", default="/follow/")
+
+    def handle(self, *args, **options):
+        report = benchmark.sessions(requests=options["requests"], path=options["path"])
+        self.stdout.write(f"{'sessions':<10}{'queries':>8}{'p50 ms':>10}{'p95 ms':>10}")
+        for mode, row in report.items():
+            self.stdout.write(f"{mode:<10}{row['queries']:>8}{row['p50']:>10}{row['p95']:>10}")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import generate_renditions
+
+
+class Command(BaseCommand):
+    help = "Generate image renditions of posts that have none yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Regenerate renditions of every post")
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image="").exclude(image=None)
+        if not options["all"]:
+            posts = posts.filter(renditions="")
+        count = 0
+        for post_id in posts.values_list("id", flat=True).iterator():
+            generate_renditions(post_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Renditions generated for {count} posts"))
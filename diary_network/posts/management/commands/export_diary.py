@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import archive
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = "Stream the posts, comments and follows of users, or of everyone, as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("usernames", nargs="*", help="Only export these users")
+        parser.add_argument("--format", choices=archive.FORMATS, default="ndjson")
+        parser.add_argument("--output", metavar="PATH", help="Write to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        users = None
+        if options["usernames"]:
+            users = list(User.objects.filter(username__in=options["usernames"]))
+            unknown = set(options["usernames"]) - {user.username for user in users}
+            if unknown:
+                raise CommandError(f"Unknown users: {', '.join(sorted(unknown))}")
+
+        lines = archive.lines(archive.records(users), options["format"])
+        if not options["output"]:
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+        try:
+            with open(options["output"], "w", newline="", encoding="utf-8") as f:
+                f.writelines(lines)
+        except OSError as e:
+            raise CommandError(e)
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import archive
+
+
+class Command(BaseCommand):
+    help = "Import posts, comments and follows exported by export_diary"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="NDJSON or CSV file, or - for stdin")
+        parser.add_argument("--format", choices=archive.FORMATS,
+                            help="Defaults to csv for .csv files and ndjson otherwise")
+        parser.add_argument("--batch-size", type=int, default=archive.BATCH_SIZE)
+        parser.add_argument("--no-index", action="store_true",
+                            help="Skip search indexing, run rebuild_search_index afterwards")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        format = options["format"] or ("csv" if path.endswith(".csv") else "ndjson")
+        importer = archive.Importer(batch_size=options["batch_size"], index=not options["no_index"])
+        try:
+            if path == "-":
+                created, skipped = importer.run(archive.read(sys.stdin, format))
+            else:
+                with open(path, newline="", encoding="utf-8") as f:
+                    created, skipped = importer.run(archive.read(f, format))
+        except OSError as e:
+            raise CommandError(e)
+        except (KeyError, ValueError) as e:
+            raise CommandError(f"Malformed record: {e}")
+
+        message = ", ".join(f"{created[kind]} {kind}s" for kind in ("post", "comment", "follow")) + " imported"
+        if sum(skipped.values()):
+            message += f", {sum(skipped.values())} records skipped"
+        self.stdout.write(self.style.SUCCESS(message))
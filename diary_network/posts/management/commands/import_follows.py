@@ -0,0 +1,46 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import follows
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = "Import follows from a CSV file of 'follower,author' usernames"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file, or - for stdin")
+        parser.add_argument("--unfollow", action="store_true", help="Remove the listed follows instead")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if path == "-":
+            rows = list(csv.reader(sys.stdin))
+        else:
+            try:
+                with open(path, newline="") as f:
+                    rows = list(csv.reader(f))
+            except OSError as e:
+                raise CommandError(e)
+
+        rows = [row for row in rows if len(row) >= 2]
+        usernames = {name.strip() for row in rows for name in row[:2]}
+        ids = dict(User.objects.filter(username__in=usernames).values_list("username", "id"))
+        pairs = []
+        for row in rows:
+            follower, author = row[0].strip(), row[1].strip()
+            if follower in ids and author in ids:
+                pairs.append((ids[follower], ids[author]))
+        skipped = len(rows) - len(pairs)
+
+        if options["unfollow"]:
+            count = follows.bulk_unfollow(pairs)
+            message = f"{count} follows removed"
+        else:
+            count = follows.bulk_follow(pairs)
+            message = f"{count} follows created"
+        if skipped:
+            message += f", {skipped} rows with unknown users skipped"
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts.formatting import BACKFILL_BATCH_SIZE, backfill
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Store the rendered HTML of posts and comments rendered with an older format version"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+        parser.add_argument("--force", action="store_true", help="Render every row again")
+
+    def handle(self, *args, **options):
+        for model in (Post, Comment):
+            updated = backfill(model, batch_size=options["batch_size"], force=options["force"])
+            self.stdout.write(f"{model._meta.verbose_name_plural}: {updated} rendered")
+        self.stdout.write(self.style.SUCCESS("Texts rendered"))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from posts import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (fan-out, search indexing, image renditions)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit when no job is due")
+        parser.add_argument("--max-jobs", type=int, help="Exit after this many jobs")
+        parser.add_argument("--poll-interval", type=float, default=1.0,
+                            help="Seconds to wait between checks of an empty queue")
+
+    def handle(self, *args, **options):
+        verbose = options["verbosity"] > 1
+        try:
+            succeeded, failed = jobs.work(
+                once=options["once"],
+                poll_interval=options["poll_interval"],
+                max_jobs=options["max_jobs"],
+                log=self.stderr.write if verbose else None,
+            )
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(f"{succeeded} jobs done, {failed} failed"))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = "Seed a synthetic dataset for benchmarks (users are named bench_<id>)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", choices=sorted(benchmark.SCALES), default="small")
+        parser.add_argument("--users", type=int, help="Override the number of users of the scale")
+        parser.add_argument("--posts", type=int, help="Override the number of posts of the scale")
+        parser.add_argument("--groups", type=int, help="Override the number of groups of the scale")
+        parser.add_argument("--follows-per-user", type=int, default=20, help="Average follows per user")
+        parser.add_argument("--heavy-share", type=float, default=0.01,
+                            help="Share of posts with --heavy-comments comments")
+        parser.add_argument("--heavy-comments", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0, help="Random seed")
+        parser.add_argument("--no-index", action="store_true", help="Do not rebuild the search index")
+        parser.add_argument("--flush", action="store_true", help="Delete previously seeded data first")
+
+    def handle(self, *args, **options):
+        if options["flush"]:
+            deleted = benchmark.flush()
+            self.stdout.write(f"{deleted} seeded users deleted")
+        sizes = dict(benchmark.SCALES[options["scale"]])
+        for name in sizes:
+            if options[name] is not None:
+                sizes[name] = options[name]
+        if sizes["users"] < 2 or sizes["posts"] < 1:
+            raise CommandError("At least 2 users and 1 post are needed")
+        counts = benchmark.seed(
+            **sizes,
+            follows_per_user=options["follows_per_user"],
+            heavy_share=options["heavy_share"],
+            heavy_comments=options["heavy_comments"],
+            seed=options["seed"],
+            index=not options["no_index"],
+            log=lambda message: self.stdout.write(f"  {message}"),
+        )
+        summary = ", ".join(f"{count} {name}" for name, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Seeded {summary}"))
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.db import copy_sqlite
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database into the replica files of DIARY_DB_REPLICAS"
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES["default"]
+        if not settings.POSTS_DB_REPLICAS:
+            raise CommandError("No replicas configured, set DIARY_DB_REPLICAS")
+        for alias in settings.POSTS_DB_REPLICAS:
+            replica = settings.DATABASES[alias]
+            if "sqlite3" not in primary["ENGINE"] or "sqlite3" not in replica["ENGINE"]:
+                raise CommandError(f"{alias} is not SQLite, use the replication of the database server")
+            copy_sqlite(primary["NAME"], replica["NAME"])
+            self.stdout.write(f"{alias}: {replica['NAME']}")
+        self.stdout.write(self.style.SUCCESS(f"{len(settings.POSTS_DB_REPLICAS)} replicas synced"))
@@ -0,0 +1,210 @@
+"""Content-addressed storage and serving of post images.
+
+Uploads are written to a temporary file in chunks by HashingUploadHandler,
+which hashes them on the way, so large images are never held in memory.
+ContentAddressedStorage then names each file after the SHA-256 of its
+content, e.g. posts/3f/3fa0...c1.png, and moves it in place only if no
+post has uploaded the same image before.
+
+A MediaFile row counts the posts referencing each stored file: saving an
+upload acquires a reference and posts.signals releases it when a post is
+deleted or its image replaced. The file and its thumbnails are deleted
+once the last reference is gone. posts.counters.reconcile() repairs the
+counts.
+
+MediaFilesMiddleware (posts.middleware) serves MEDIA_URL with serve(),
+which answers conditional and byte range requests. Content-addressed names
+never change content and are cached by clients for a year.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import FileResponse, HttpResponse, HttpResponseNotFound, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+
+CHUNK_SIZE = 64 * 1024
+CONTENT_NAME = re.compile(r"(?:^|/)[0-9a-f]{2}/([0-9a-f]{64})(?:\.[^./]+)?$")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MAX_AGE = 3600
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_digest(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploads to a temporary file, hashing them on the way."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Files named after their content, stored once however often they are saved."""
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        digest = getattr(content, "sha256", None) or file_digest(content)
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        name = "/".join(filter(None, (directory, digest[:2], digest + extension)))
+        acquire(name)
+        if not self.exists(name):
+            stored = self._save(name, content)
+            if stored != name:
+                # Written meanwhile by another upload of the same content
+                self.delete(stored)
+        return name
+
+
+media_storage = ContentAddressedStorage()
+
+
+# Reference counts
+
+def _media_files():
+    # posts.models imports this module for the storage of Post.image
+    return apps.get_model("posts", "MediaFile").objects
+
+
+def is_content_addressed(name):
+    return bool(name and CONTENT_NAME.search(name))
+
+
+def acquire(name):
+    rows = _media_files().filter(name=name)
+    if rows.update(refs=F("refs") + 1):
+        return
+    try:
+        with transaction.atomic():
+            _media_files().create(name=name, refs=1)
+    except IntegrityError:
+        rows.update(refs=F("refs") + 1)
+
+
+def _delete_unreferenced(names):
+    # An image may have been uploaded again since it was released
+    uploaded = set(_media_files().filter(name__in=names).values_list("name", flat=True))
+    for name in set(names) - uploaded:
+        delete_thumbnails(ImageFile(name, media_storage))
+
+
+def release(name):
+    """Drop a reference to a stored file, deleting it with its last one."""
+    if not is_content_addressed(name):
+        return
+    rows = _media_files().filter(name=name)
+    if rows.filter(refs__lte=1).delete()[0]:
+        transaction.on_commit(lambda: _delete_unreferenced([name]))
+    else:
+        rows.update(refs=F("refs") - 1)
+
+
+# Serving
+
+def parse_range(header, size):
+    """(first, last) byte of a single range, None to send the whole file.
+
+    Raises ValueError when the range starts past the end of the file.
+    Multiple ranges are answered with the whole file, which RFC 7233 allows.
+    """
+    match = RANGE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last or not int(last):
+            return None
+        return max(0, size - int(last)), size - 1
+    first = int(first)
+    if first >= size:
+        raise ValueError(f"Range starts at {first} of {size} bytes")
+    if last and int(last) < first:
+        return None
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def _read(path, first, last):
+    with open(path, "rb") as f:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def serve(request, name):
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        return HttpResponseNotFound()
+    if not os.path.isfile(path):
+        return HttpResponseNotFound()
+    stat = os.stat(path)
+    content = CONTENT_NAME.search(name)
+    etag = quote_etag(content.group(1) if content else f"{int(stat.st_mtime)}-{stat.st_size}")
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Cache-Control": (f"public, max-age={IMMUTABLE_MAX_AGE}, immutable" if content
+                          else f"public, max-age={MAX_AGE}"),
+        "Accept-Ranges": "bytes",
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        span = None
+        # A stale If-Range means the client's partial copy is outdated
+        if_range = request.META.get("HTTP_IF_RANGE")
+        if if_range is None or if_range in (etag, headers["Last-Modified"]):
+            try:
+                span = parse_range(request.META.get("HTTP_RANGE", ""), stat.st_size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{stat.st_size}"
+                return response
+        if span is None:
+            response = FileResponse(open(path, "rb"), content_type=content_type)
+        else:
+            first, last = span
+            response = StreamingHttpResponse(_read(path, first, last), status=206, content_type=content_type)
+            response["Content-Range"] = f"bytes {first}-{last}/{stat.st_size}"
+            response["Content-Length"] = last - first + 1
+        response["X-Content-Type-Options"] = "nosniff"
+    for header, value in headers.items():
+        response[header] = value
+    return response
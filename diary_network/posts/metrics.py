@@ -0,0 +1,97 @@
+"""In-process request metrics.
+
+Histograms are kept per view in the memory of the worker process and
+exposed in the Prometheus text format by the metrics view, so each worker
+has to be scraped on its own. posts.middleware fills them in.
+"""
+import threading
+
+
+# Upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {round(self.total, 6)}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.db_duration = Histogram(DURATION_BUCKETS)
+        self.template_duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+HISTOGRAMS = (
+    ("duration", "posts_request_duration_seconds", "Time spent in the view and its middleware"),
+    ("db_duration", "posts_request_db_seconds", "Time spent in database queries"),
+    ("template_duration", "posts_request_template_seconds", "Time spent rendering templates"),
+    ("queries", "posts_request_queries", "Database queries per request"),
+)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view, sample):
+        with self._lock:
+            metrics = self._views.get(view)
+            if metrics is None:
+                metrics = self._views[view] = ViewMetrics()
+            metrics.duration.observe(sample.duration)
+            metrics.db_duration.observe(sample.db_duration)
+            metrics.template_duration.observe(sample.template_duration)
+            metrics.queries.observe(sample.queries)
+            metrics.cache_hits += sample.cache_hits
+            metrics.cache_misses += sample.cache_misses
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = []
+            for attr, name, help_text in HISTOGRAMS:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for view, metrics in views:
+                    lines += getattr(metrics, attr).lines(name, f'view="{view}"')
+            lines += ["# HELP posts_cache_requests_total Cache reads by result",
+                      "# TYPE posts_cache_requests_total counter"]
+            for view, metrics in views:
+                for result, count in (("hit", metrics.cache_hits), ("miss", metrics.cache_misses)):
+                    lines.append(f'posts_cache_requests_total{{view="{view}",result="{result}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
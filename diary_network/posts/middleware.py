@@ -0,0 +1,248 @@
+"""Request middleware of the posts app."""
+import functools
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.cache import caches
+from django.db import connections
+from django.http import HttpResponseNotAllowed
+from django.template.backends.django import Template
+from django.utils.functional import SimpleLazyObject
+
+from . import auth, db, media, staticfiles
+from .metrics import registry
+
+
+DEFAULT_MODULES = ("posts.views", "users.views")
+
+_state = threading.local()
+_MISSING = object()
+
+
+class Sample:
+    def __init__(self):
+        # Queries run on the threads of posts.parallel too
+        self.lock = threading.Lock()
+        self.view = None
+        self.duration = 0.0
+        self.db_duration = 0.0
+        self.template_duration = 0.0
+        self.template_depth = 0
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def time_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.db_duration += time.perf_counter() - started
+                self.queries += 1
+
+    def server_timing(self):
+        return ", ".join((
+            f'db;dur={self.db_duration * 1000:.2f};desc="{self.queries} queries"',
+            f"tpl;dur={self.template_duration * 1000:.2f}",
+            f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+            f"total;dur={self.duration * 1000:.2f}",
+        ))
+
+
+def _current():
+    return getattr(_state, "sample", None)
+
+
+def current_sample():
+    """Sample of the request served by this thread, None when it is not instrumented."""
+    return _current()
+
+
+@contextmanager
+def sampling(sample):
+    """Record the queries and cache reads of this thread in `sample` meanwhile.
+
+    posts.parallel enters it on its threads with the sample of the request.
+    """
+    if sample is None:
+        yield
+        return
+    _count_cache_reads()
+    _state.sample = sample
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(sample.time_query))
+            yield
+    finally:
+        _state.sample = None
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, context=None, request=None):
+        sample = _current()
+        # Only the outermost render is timed, it includes the nested ones
+        if sample is None or sample.template_depth:
+            return render(self, context, request)
+        sample.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            sample.template_duration += time.perf_counter() - started
+            sample.template_depth -= 1
+    wrapper.timed = True
+    return wrapper
+
+
+def _counted_get(get):
+    # get_many() and get_or_set() of the backends go through get() too
+    @functools.wraps(get)
+    def wrapper(key, default=None, version=None):
+        value = get(key, _MISSING, version=version)
+        sample = _current()
+        if sample is not None:
+            with sample.lock:
+                if value is _MISSING:
+                    sample.cache_misses += 1
+                else:
+                    sample.cache_hits += 1
+        return default if value is _MISSING else value
+    return wrapper
+
+
+def _count_cache_reads():
+    # Cache instances are per thread, wrap each one the first time it is seen
+    for alias in settings.CACHES:
+        cache = caches[alias]
+        if not getattr(cache, "reads_counted", False):
+            cache.get = _counted_get(cache.get)
+            cache.reads_counted = True
+
+
+class PerformanceMiddleware:
+    """Sampled per-request performance instrumentation.
+
+    A share POSTS_METRICS_SAMPLE_RATE of the requests served by the views in
+    POSTS_METRICS_MODULES is instrumented: database queries are timed with
+    execute wrappers, the outermost template render of the request is timed,
+    and reads of every configured cache are counted as hits or misses. The
+    numbers are sent back in a Server-Timing header and recorded in the
+    histograms of posts.metrics. Requests that are not sampled only pay for
+    one random() call.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not getattr(Template.render, "timed", False):
+            Template.render = _timed_render(Template.render)
+
+    def __call__(self, request):
+        rate = getattr(settings, "POSTS_METRICS_SAMPLE_RATE", 0)
+        if rate <= 0 or random.random() >= rate:
+            return self.get_response(request)
+
+        sample = Sample()
+        with sampling(sample):
+            started = time.perf_counter()
+            response = self.get_response(request)
+            sample.duration = time.perf_counter() - started
+
+        if sample.view is not None:
+            registry.record(sample.view, sample)
+            response["Server-Timing"] = sample.server_timing()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        sample = _current()
+        if sample is None:
+            return None
+        module = getattr(view_func, "__module__", "")
+        if module in getattr(settings, "POSTS_METRICS_MODULES", DEFAULT_MODULES):
+            sample.view = f"{module}.{view_func.__name__}"
+        return None
+
+
+class ReplicaMiddleware:
+    """Serve safe requests from a read replica unless the client wrote recently.
+
+    See posts.db. Must come before the session and authentication
+    middleware so that their reads are routed too.
+    """
+
+    SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.POSTS_DB_REPLICAS:
+            return self.get_response(request)
+
+        cookie = settings.POSTS_DB_PIN_COOKIE
+        use_replicas = request.method in self.SAFE_METHODS and cookie not in request.COOKIES
+        request.read_db = db.start_request(use_replicas)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = db.end_request()
+        if wrote:
+            response.set_cookie(cookie, "1", max_age=settings.POSTS_DB_PIN_SECONDS, httponly=True)
+        return response
+
+
+class StaticFilesMiddleware:
+    """Serve STATIC_URL from STATIC_ROOT without going through the rest of the stack.
+
+    See posts.staticfiles. Must come first so that asset requests skip the
+    other middleware, and only applies when STATIC_URL is a local path.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        prefix = settings.STATIC_URL
+        if not settings.STATIC_ROOT or not prefix.startswith("/") or not request.path_info.startswith(prefix):
+            return self.get_response(request)
+        if request.method not in ("GET", "HEAD"):
+            return HttpResponseNotAllowed(["GET", "HEAD"])
+        return staticfiles.serve(request, request.path_info[len(prefix):])
+
+
+class MediaFilesMiddleware:
+    """Serve MEDIA_URL from MEDIA_ROOT without going through the rest of the stack.
+
+    See posts.media. Comes right after StaticFilesMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        prefix = settings.MEDIA_URL
+        if not settings.MEDIA_ROOT or not prefix.startswith("/") or not request.path_info.startswith(prefix):
+            return self.get_response(request)
+        if request.method not in ("GET", "HEAD"):
+            return HttpResponseNotAllowed(["GET", "HEAD"])
+        return media.serve(request, request.path_info[len(prefix):])
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """AuthenticationMiddleware resolving request.user with posts.auth.get_user()."""
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: self.get_user(request))
+
+    @staticmethod
+    def get_user(request):
+        if not hasattr(request, "_cached_user"):
+            request._cached_user = auth.get_user(request)
+        return request._cached_user
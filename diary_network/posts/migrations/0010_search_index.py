@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def create_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # Document ids are pk * 3 + kind, see posts.search.doc_id()
+    schema_editor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS posts_search USING fts5(body)")
+    schema_editor.execute("INSERT INTO posts_search(rowid, body) SELECT id * 3, text FROM posts_post")
+    schema_editor.execute("INSERT INTO posts_search(rowid, body) SELECT id * 3 + 1, text FROM posts_comment")
+    schema_editor.execute(
+        "INSERT INTO posts_search(rowid, body) "
+        "SELECT id * 3 + 2, title || char(10) || description FROM posts_group"
+    )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS posts_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_post_renditions'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
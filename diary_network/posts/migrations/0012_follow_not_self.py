@@ -0,0 +1,34 @@
+# Generated by Django 2.2 on 2026-10-18 15:27
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+
+def remove_self_follows(apps, schema_editor):
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+
+    user_ids = set(
+        Follow.objects.filter(user_id=models.F('author_id')).values_list('user_id', flat=True)
+    )
+    Follow.objects.filter(user_id__in=user_ids, author_id=models.F('user_id')).delete()
+    for user_id in user_ids:
+        UserStats.objects.filter(user_id=user_id).update(
+            followers_count=Follow.objects.filter(author_id=user_id).count(),
+            follows_count=Follow.objects.filter(user_id=user_id).count(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_self_follows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.CheckConstraint(check=models.Q(_negated=True, user=django.db.models.expressions.F('author')), name='posts_follow_not_self'),
+        ),
+    ]
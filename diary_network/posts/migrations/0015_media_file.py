@@ -0,0 +1,26 @@
+# Generated by Django 2.2 on 2026-10-18 16:22
+
+from django.db import migrations, models
+import posts.media
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_rendered_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFile',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('refs', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=posts.media.ContentAddressedStorage(), upload_to='posts/'),
+        ),
+    ]
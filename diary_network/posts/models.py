@@ -1,8 +1,42 @@
+import json
+
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils.safestring import mark_safe
+
+from . import formatting
+from .media import media_storage
 
 User = get_user_model() 
 
+# Columns read by posts.cards, comments.html and user links
+AUTHOR_FIELDS = ("username", "first_name", "last_name")
+POST_FEED_FIELDS = (
+    "id", "text", "text_html", "text_format", "pub_date", "updated", "image", "renditions", "author", "group",
+    *(f"author__{field}" for field in AUTHOR_FIELDS),
+    "group__slug", "group__title",
+)
+COMMENT_FEED_FIELDS = (
+    "id", "text", "text_html", "text_format", "created", "post", "author",
+    *(f"author__{field}" for field in AUTHOR_FIELDS),
+)
+
+
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Posts with their authors and groups, limited to what the templates render."""
+        return self.select_related("author", "group").only(*POST_FEED_FIELDS)
+
+    def for_page(self):
+        """for_feed() with the comment counter shown on the post page."""
+        return self.select_related("author", "group", "stats").only(*POST_FEED_FIELDS, "stats__comments_count")
+
+
+class CommentQuerySet(models.QuerySet):
+    def for_feed(self):
+        return self.select_related("author").only(*COMMENT_FEED_FIELDS)
+
+
 class Group(models.Model):
     title = models.CharField(max_length=63)
     slug = models.SlugField(unique=True)
@@ -12,25 +46,162 @@ class Group(models.Model):
         return self.title
 
 
-class Post(models.Model):
+class RenderedText(models.Model):
+    """A text stored together with its HTML, see posts.formatting."""
+    text_html = models.TextField(blank=True, default="", editable=False)
+    text_format = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def render_text(self):
+        self.text_html = self.render(self.text)
+        self.text_format = formatting.FORMAT_VERSION
+
+    @property
+    def body_html(self):
+        if self.text_format == formatting.FORMAT_VERSION:
+            return mark_safe(self.text_html)
+        return self.render(self.text)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "text" in update_fields:
+            self.render_text()
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "text_html", "text_format"}
+        super().save(*args, **kwargs)
+
+
+class Post(RenderedText):
     text = models.TextField()
     pub_date = models.DateTimeField("date published", auto_now_add=True)
+    updated = models.DateTimeField("date updated", auto_now=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="author_posts")
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="group_posts",
                               blank=True, null=True)
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    image = models.ImageField(upload_to='posts/', storage=media_storage, blank=True, null=True)
+    # JSON {rendition name: url}, filled in by posts.thumbnails
+    renditions = models.TextField(blank=True, default="")
+
+    render = staticmethod(formatting.render_post)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"], name="posts_post_feed_idx"),
+            models.Index(fields=["author", "-pub_date", "-id"], name="posts_post_author_feed_idx"),
+            models.Index(fields=["group", "-pub_date", "-id"], name="posts_post_group_feed_idx"),
+        ]
 
     def __str__(self):
         return str(self.id)
 
+    @property
+    def cache_version(self):
+        """Changes on every save, used to key cached renderings of the post."""
+        return int(self.updated.timestamp() * 1000000)
+
+    @property
+    def rendition_urls(self):
+        return json.loads(self.renditions) if self.renditions else {}
+
+    @property
+    def renditions_pending(self):
+        return bool(self.image) and not self.renditions
+
+    @property
+    def comments_count(self):
+        try:
+            return self.stats.comments_count
+        except PostStats.DoesNotExist:
+            return 0
 
-class Comment(models.Model):
+
+class Comment(RenderedText):
     text = models.TextField()
     created = models.DateTimeField("date commented", auto_now_add=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="author_comments")
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="post_comments")
 
+    render = staticmethod(formatting.render_comment)
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "-created", "-id"], name="posts_comment_post_idx"),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="follower")
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "author"], name="posts_follow_unique"),
+            models.CheckConstraint(check=~models.Q(user=models.F("author")), name="posts_follow_not_self"),
+        ]
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="timeline")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("user", "post")
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "-post"], name="posts_timeline_feed_idx"),
+            models.Index(fields=["user", "author"], name="posts_timeline_author_idx"),
+        ]
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    follows_count = models.PositiveIntegerField(default=0)
+
+
+class PostStats(models.Model):
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    comments_count = models.PositiveIntegerField(default=0)
+
+
+class MediaFile(models.Model):
+    """Number of posts referencing a file of posts.media.ContentAddressedStorage."""
+    name = models.CharField(max_length=255, primary_key=True)
+    refs = models.PositiveIntegerField(default=0)
+
+
+class Job(models.Model):
+    """A queued side effect of a write, see posts.jobs."""
+    PENDING = "pending"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUSES = [(PENDING, "pending"), (RUNNING, "running"), (FAILED, "failed")]
+
+    name = models.CharField(max_length=63)
+    # JSON list of arguments
+    args = models.TextField(default="[]")
+    # Unique among queued jobs, a job with the key of a queued one is dropped
+    key = models.CharField(max_length=255, unique=True, blank=True, null=True)
+    status = models.CharField(max_length=15, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField()
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_at"], name="posts_job_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name}{self.args}"
@@ -0,0 +1,272 @@
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import DateTimeField, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.http import urlencode
+
+from .cache import generation, get_or_compute
+from . import db
+
+
+FEED_PAGE_SIZE = 10
+FEED_KEYS = ("pub_date", "id")
+FEED_CACHE_TIMEOUT = 20
+# Numbered pages past this one are not offered, so page links and their
+# count stay bounded on large feeds
+MAX_PAGE_NUMBER = 50
+
+
+def encode_cursor(values):
+    """Pack the key values of a row into an opaque url-safe token."""
+    raw = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    data = json.dumps(raw, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(token, types=None):
+    """Unpack a token of encode_cursor(), raises ValueError if it is broken.
+
+    With `types`, e.g. (datetime, int), the values must also be of these
+    types position by position, see check_cursor().
+    """
+    padded = token + "=" * (-len(token) % 4)
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(raw, list):
+        raise ValueError("Invalid cursor")
+    values = []
+    for value in raw:
+        if isinstance(value, str):
+            value = parse_datetime(value)
+            if value is None:
+                raise ValueError("Invalid cursor")
+        values.append(value)
+    return values if types is None else check_cursor(values, types)
+
+
+def check_cursor(values, types):
+    """Return cursor values if they are of `types`, raises ValueError otherwise.
+
+    Tokens come from clients: a forged one must not reach the database or
+    comparisons with real key values.
+    """
+    if len(values) != len(types):
+        raise ValueError("Invalid cursor")
+    for value, type_ in zip(values, types):
+        # bool is an int, and naive datetimes do not compare with aware ones
+        if not isinstance(value, type_) or isinstance(value, bool):
+            raise ValueError("Invalid cursor")
+        if isinstance(value, datetime) and timezone.is_aware(value) != settings.USE_TZ:
+            raise ValueError("Invalid cursor")
+    return values
+
+
+def key_type(model, key):
+    """Type of the cursor values of an ordering key, e.g. "pub_date" or "post__id"."""
+    *path, name = key.split("__")
+    for part in path:
+        model = model._meta.get_field(part).related_model
+    # Other keys are primary and foreign keys
+    return datetime if isinstance(model._meta.get_field(name), DateTimeField) else int
+
+
+def keyset_filter(keys, values, lookup):
+    """Lexicographic (k1, k2, ...) <lookup> (v1, v2, ...) as a Q object."""
+    condition = Q()
+    for i, key in enumerate(keys):
+        equal = {k: v for k, v in zip(keys[:i], values[:i])}
+        equal[f"{key}__{lookup}"] = values[i]
+        condition |= Q(**equal)
+    return condition
+
+
+class BoundedPaginator(Paginator):
+    """Paginator over the first MAX_PAGE_NUMBER pages of a queryset.
+
+    Its count is a LIMITed read of primary keys along the feed index
+    instead of a COUNT(*) of the whole feed.
+    """
+
+    def __init__(self, object_list, per_page, max_pages=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.max_pages = max_pages or MAX_PAGE_NUMBER
+
+    @cached_property
+    def count(self):
+        return len(self.object_list.values_list("pk", flat=True)[:self.max_pages * self.per_page])
+
+
+class CursorPage:
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, next_values=None, previous_values=None,
+                 has_next=False, has_previous=False):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_values = next_values
+        self.previous_values = previous_values
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f"<CursorPage of {len(self.object_list)} items>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_token(self):
+        return encode_cursor(self.next_values) if self._has_next else None
+
+    @property
+    def previous_token(self):
+        if self._has_previous and self.previous_values is not None:
+            return encode_cursor(self.previous_values)
+        return None
+
+    def state(self):
+        """Picklable contents of the page, without the paginator and its queryset."""
+        return (self.object_list, self.next_values, self.previous_values,
+                self._has_next, self._has_previous)
+
+    def next_query(self):
+        return urlencode({"after": self.next_token}) if self._has_next else ""
+
+    def previous_query(self):
+        token = self.previous_token
+        return urlencode({"before": token}) if token else ""
+
+
+class CursorPaginator:
+    """Keyset paginator for querysets ordered newest first on `keys`.
+
+    Pages are addressed by the key values of their boundary rows, so every
+    page costs one indexed range read of `per_page + 1` rows and no COUNT.
+    """
+
+    def __init__(self, queryset, per_page, keys=FEED_KEYS):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = tuple(keys)
+
+    @cached_property
+    def key_types(self):
+        return tuple(key_type(self.queryset.model, key) for key in self.keys)
+
+    def _key_values(self, obj):
+        values = []
+        for key in self.keys:
+            value = obj
+            for attr in key.split("__"):
+                value = getattr(value, attr)
+            values.append(value)
+        return values
+
+    def page(self, after=None, before=None):
+        descending = [f"-{key}" for key in self.keys]
+        ascending = list(self.keys)
+
+        if before is not None:
+            rows = list(
+                self.queryset.filter(keyset_filter(self.keys, before, "gt"))
+                .order_by(*ascending)[:self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return CursorPage(
+                rows, self,
+                next_values=self._key_values(rows[-1]) if rows else before,
+                previous_values=self._key_values(rows[0]) if has_previous else None,
+                has_next=True,
+                has_previous=has_previous,
+            )
+
+        queryset = self.queryset
+        if after is not None:
+            queryset = queryset.filter(keyset_filter(self.keys, after, "lt"))
+        rows = list(queryset.order_by(*descending)[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return CursorPage(
+            rows, self,
+            next_values=self._key_values(rows[-1]) if has_next else None,
+            previous_values=self._key_values(rows[0]) if rows and after is not None else None,
+            has_next=has_next,
+            has_previous=after is not None,
+        )
+
+    def parse(self, after_token=None, before_token=None):
+        """Decode page tokens, dropping broken ones."""
+        try:
+            after = decode_cursor(after_token, self.key_types) if after_token else None
+            before = decode_cursor(before_token, self.key_types) if before_token else None
+        except ValueError:
+            after = before = None
+        return after, before
+
+    def get_page(self, after_token=None, before_token=None):
+        """Like Paginator.get_page(): a broken token falls back to the first page."""
+        after, before = self.parse(after_token, before_token)
+        return self.page(after=after, before=before)
+
+
+def get_feed_page(request, queryset, per_page=FEED_PAGE_SIZE, keys=FEED_KEYS, cache_scope=None, source=None):
+    """Return (page, paginator) for a feed.
+
+    Feeds are cursor paginated by default. The numbered Paginator, with its
+    COUNT(*) and OFFSET scan, is only used when the request explicitly asks
+    for a page number, and only covers the first MAX_PAGE_NUMBER pages.
+
+    `source(paginator, after, before)` may serve a cursor page from
+    elsewhere, e.g. posts.hot, or return None to read it from the queryset.
+    Cursor pages of feeds with a `cache_scope` are cached until the scope's
+    generation is bumped, see posts.signals.
+    """
+    page_number = request.GET.get("page")
+    if page_number is not None:
+        ordering = [f"-{key}" for key in keys]
+        paginator = BoundedPaginator(queryset.order_by(*ordering), per_page)
+        return paginator.get_page(page_number), paginator
+
+    paginator = CursorPaginator(queryset, per_page, keys)
+    after, before = request.GET.get("after"), request.GET.get("before")
+    if source is not None:
+        page = source(paginator, *paginator.parse(after, before))
+        if page is not None:
+            return page, paginator
+    if cache_scope is None:
+        return paginator.get_page(after, before), paginator
+
+    cursor = hashlib.md5(f"{after}:{before}".encode()).hexdigest()
+    key = f"feed:{cache_scope}:{generation(cache_scope)}:{per_page}:{cursor}"
+    # A lagging replica could store a page older than the generation it is keyed by
+    state = get_or_compute(key, lambda: paginator.get_page(after, before).state(), FEED_CACHE_TIMEOUT,
+                           store=db.current_replica() is None)
+    object_list, next_values, previous_values, has_next, has_previous = state
+    page = CursorPage(object_list, paginator, next_values, previous_values, has_next, has_previous)
+    return page, paginator
@@ -0,0 +1,74 @@
+"""Run the independent queries of a view concurrently.
+
+`gather()` runs each callable on a thread of a shared pool, every thread
+with its own database connection, and returns their results in order, so
+a view waits for its slowest query instead of the sum of all of them.
+Callables must evaluate their querysets, e.g. with list(). Replica
+routing and the metrics sample of the request (posts.db,
+posts.middleware) carry over to the pool threads.
+
+Inside a transaction the calls run one after another in the calling
+thread: other connections would not see its uncommitted rows. The same
+happens with POSTS_QUERY_WORKERS = 0, the default. The pool is shared by
+every request thread of the process; calls that find no idle worker run
+in the calling thread rather than wait behind other requests.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from . import db, middleware
+
+
+_executor = None
+_idle = None
+
+
+def get_executor():
+    global _executor, _idle
+    workers = settings.POSTS_QUERY_WORKERS
+    if _executor is None or _executor.workers != workers:
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="queries")
+        _executor.workers = workers
+        _idle = threading.BoundedSemaphore(workers)
+    return _executor
+
+
+def _run(idle, function, replica, sample):
+    try:
+        with db.routing(replica) as wrote, middleware.sampling(sample):
+            try:
+                return function(), wrote()
+            finally:
+                close_old_connections()
+    finally:
+        idle.release()
+
+
+def gather(*functions):
+    """Results of calling every function, concurrently when possible."""
+    if (len(functions) < 2 or not settings.POSTS_QUERY_WORKERS
+            or connections["default"].in_atomic_block):
+        return [function() for function in functions]
+
+    executor = get_executor()
+    idle = _idle
+    replica, sample = db.current_replica(), middleware.current_sample()
+    futures = []
+    for function in functions[1:]:
+        if not idle.acquire(blocking=False):
+            break
+        futures.append(executor.submit(_run, idle, function, replica, sample))
+    # The calling thread would only wait, let it run the first one and
+    # those left without a worker
+    inline = [functions[0], *functions[1 + len(futures):]]
+    try:
+        results = [function() for function in inline]
+    finally:
+        wait(futures)
+    outcomes = [future.result() for future in futures]
+    if any(wrote for _, wrote in outcomes):
+        db.mark_written()
+    return results[:1] + [result for result, _ in outcomes] + results[1:]
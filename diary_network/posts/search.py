@@ -0,0 +1,211 @@
+"""Full-text search over posts, comments and groups.
+
+Documents live in one inverted index addressed by a document id that packs
+the kind and primary key of the object. On SQLite the index is the FTS5
+table created by migration 0010; on other databases it is a pure-Python
+BM25 index stored in the file named by POSTS_SEARCH_INDEX. Model signals
+keep it up to date, see posts.signals.
+"""
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Comment, Group, Post
+
+
+KINDS = ("post", "comment", "group")
+FTS_TABLE = "posts_search"
+TOKEN_RE = re.compile(r"\w+")
+
+
+def doc_id(kind, pk):
+    return pk * len(KINDS) + KINDS.index(kind)
+
+
+def split_doc_id(doc):
+    return KINDS[doc % len(KINDS)], doc // len(KINDS)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def document_body(kind, obj):
+    if kind == "group":
+        return f"{obj.title}\n{obj.description}"
+    return obj.text
+
+
+class SQLiteFTSBackend:
+    def index(self, doc, body):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [doc])
+            cursor.execute(f"INSERT INTO {FTS_TABLE}(rowid, body) VALUES (%s, %s)", [doc, body])
+
+    def remove(self, doc):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [doc])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def search(self, terms, after=None, limit=10, kind=None):
+        # Quote every term so user input is never parsed as FTS5 syntax
+        match = " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        sql = (
+            f"SELECT doc, score FROM (SELECT rowid AS doc, bm25({FTS_TABLE}) AS score "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s) WHERE 1"
+        )
+        params = [match]
+        if kind is not None:
+            sql += " AND doc %% %s = %s"
+            params += [len(KINDS), KINDS.index(kind)]
+        if after is not None:
+            sql += " AND (score > %s OR (score = %s AND doc > %s))"
+            params += [after[0], after[0], after[1]]
+        sql += " ORDER BY score, doc LIMIT %s"
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+class FileIndexBackend:
+    """BM25 inverted index kept in a standalone file."""
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    @property
+    def db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path)
+            db.executescript(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                " term TEXT, doc INTEGER, tf INTEGER, PRIMARY KEY (term, doc)) WITHOUT ROWID;"
+                "CREATE TABLE IF NOT EXISTS docs (doc INTEGER PRIMARY KEY, length INTEGER, terms TEXT);"
+            )
+            self._local.db = db
+        return db
+
+    def index(self, doc, body):
+        counts = Counter(tokenize(body))
+        with self.db as db:
+            self._remove(db, doc)
+            db.execute(
+                "INSERT INTO docs (doc, length, terms) VALUES (?, ?, ?)",
+                (doc, sum(counts.values()), " ".join(counts)),
+            )
+            db.executemany(
+                "INSERT INTO postings (term, doc, tf) VALUES (?, ?, ?)",
+                ((term, doc, tf) for term, tf in counts.items()),
+            )
+
+    def _remove(self, db, doc):
+        row = db.execute("SELECT terms FROM docs WHERE doc = ?", (doc,)).fetchone()
+        if row is None:
+            return
+        db.executemany(
+            "DELETE FROM postings WHERE term = ? AND doc = ?",
+            ((term, doc) for term in row[0].split()),
+        )
+        db.execute("DELETE FROM docs WHERE doc = ?", (doc,))
+
+    def remove(self, doc):
+        with self.db as db:
+            self._remove(db, doc)
+
+    def clear(self):
+        with self.db as db:
+            db.execute("DELETE FROM postings")
+            db.execute("DELETE FROM docs")
+
+    def search(self, terms, after=None, limit=10, kind=None):
+        db = self.db
+        total, total_length = db.execute("SELECT COUNT(*), SUM(length) FROM docs").fetchone()
+        if not total:
+            return []
+        average_length = total_length / total
+
+        scores = None
+        for term in set(terms):
+            postings = db.execute(
+                "SELECT postings.doc, postings.tf, docs.length FROM postings "
+                "JOIN docs ON docs.doc = postings.doc WHERE term = ?", (term,)
+            ).fetchall()
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            term_scores = {}
+            for doc, tf, length in postings:
+                norm = tf + self.k1 * (1 - self.b + self.b * length / average_length)
+                term_scores[doc] = idf * tf * (self.k1 + 1) / norm
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc: score + term_scores[doc] for doc, score in scores.items() if doc in term_scores}
+
+        # Same convention as FTS5 bm25(): lower is better
+        hits = sorted((-score, doc) for doc, score in (scores or {}).items())
+        if kind is not None:
+            hits = [hit for hit in hits if split_doc_id(hit[1])[0] == kind]
+        if after is not None:
+            hits = [hit for hit in hits if hit > (after[0], after[1])]
+        return [(doc, score) for score, doc in hits[:limit]]
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if connection.vendor == "sqlite":
+            _backend = SQLiteFTSBackend()
+        else:
+            _backend = FileIndexBackend(settings.POSTS_SEARCH_INDEX)
+    return _backend
+
+
+def index_object(kind, obj):
+    get_backend().index(doc_id(kind, obj.pk), document_body(kind, obj))
+
+
+def remove_object(kind, pk):
+    get_backend().remove(doc_id(kind, pk))
+
+
+def search(query, after=None, limit=10, kind=None):
+    """Ranked (kind, pk, score, doc) hits, best first, after a (score, doc) cursor."""
+    terms = tokenize(query)
+    if not terms:
+        return []
+    return [
+        (*split_doc_id(doc), score, doc)
+        for doc, score in get_backend().search(terms, after=after, limit=limit, kind=kind)
+    ]
+
+
+def rebuild():
+    backend = get_backend()
+    backend.clear()
+    count = 0
+    sources = (
+        ("post", Post.objects.only("id", "text")),
+        ("comment", Comment.objects.only("id", "text")),
+        ("group", Group.objects.only("id", "title", "description")),
+    )
+    for kind, queryset in sources:
+        for obj in queryset.iterator():
+            backend.index(doc_id(kind, obj.pk), document_body(kind, obj))
+            count += 1
+    return count
@@ -0,0 +1,114 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_generation, get_cache, post_scopes
+from .counters import bump_post, bump_user
+from .models import Comment, Follow, Group, Post, User
+from . import auth, conditional, db, follows, hot, jobs, media
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        bump_user(instance.author_id, "posts_count")
+    bump_generation(*post_scopes(instance))
+    hot.add(instance)
+    if created:
+        jobs.enqueue("fan_out", instance.pk, key=f"fan_out:{instance.pk}")
+    jobs.enqueue("index", "post", instance.pk, key=f"index:post:{instance.pk}")
+    if instance.renditions_pending:
+        jobs.enqueue("renditions", instance.pk, key=f"renditions:{instance.pk}")
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    bump_user(instance.author_id, "posts_count", -1)
+    bump_generation(*post_scopes(instance))
+    hot.remove(instance.group_id, instance.pk)
+    jobs.enqueue("index", "post", instance.pk, key=f"index:post:{instance.pk}")
+    media.release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        bump_post(instance.post_id, "comments_count")
+    bump_generation(f"post:{instance.post_id}")
+    jobs.enqueue("index", "comment", instance.pk, key=f"index:comment:{instance.pk}")
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    bump_post(instance.post_id, "comments_count", -1)
+    bump_generation(f"post:{instance.post_id}")
+    jobs.enqueue("index", "comment", instance.pk, key=f"index:comment:{instance.pk}")
+
+
+@receiver(pre_save, sender=Group)
+def group_saving(sender, instance, **kwargs):
+    # Lookups by the slug before a rename are memoized as well
+    instance._saved_slug = (
+        Group.objects.filter(pk=instance.pk).values_list("slug", flat=True).first() if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    # Cards show the group's title on the index, profiles, follow feeds and
+    # post pages; the latter are keyed by their authors, a job bumps them
+    bump_generation(f"group:{instance.pk}", "index")
+    slugs = {instance.slug, getattr(instance, "_saved_slug", None)} - {None}
+    get_cache().delete_many([conditional.group_key(slug) for slug in slugs])
+    jobs.enqueue("index", "group", instance.pk, key=f"index:group:{instance.pk}")
+    if not created:
+        jobs.enqueue("group_pages", instance.pk, key=f"group_pages:{instance.pk}")
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    bump_generation(f"group:{instance.pk}")
+    get_cache().delete(conditional.group_key(instance.slug))
+    jobs.enqueue("index", "group", instance.pk, key=f"index:group:{instance.pk}")
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    auth.forget_user(instance.pk)
+    # Logging in only updates last_login, which no page shows
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    # Names are shown on the profile, its posts and on post cards of the
+    # index; group pages and comments elsewhere may be many, a job bumps them
+    bump_generation("index", f"author:{instance.pk}")
+    get_cache().delete(conditional.user_id_key(instance.username))
+    jobs.enqueue("user_pages", instance.pk, key=f"user_pages:{instance.pk}")
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    auth.forget_user(instance.pk)
+    bump_generation("index", f"author:{instance.pk}")
+    get_cache().delete(conditional.user_id_key(instance.username))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        bump_user(instance.author_id, "followers_count")
+        bump_user(instance.user_id, "follows_count")
+        conditional.follow_changed(instance.user_id, instance.author_id)
+        follows.sync_later(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    bump_user(instance.author_id, "followers_count", -1)
+    bump_user(instance.user_id, "follows_count", -1)
+    conditional.follow_changed(instance.user_id, instance.author_id)
+    follows.sync_later(instance.user_id, instance.author_id)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    db.configure_connection(connection)
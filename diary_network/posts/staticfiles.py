@@ -0,0 +1,179 @@
+"""Build and serving of the static files collected into STATIC_ROOT.
+
+`python manage.py collectstatic` is the build step. CompressedManifestStorage
+stores every file a second time under a name holding a hash of its content,
+as ManifestStaticFilesStorage does, so {% static %} links change whenever a
+file does. With the rcssmin and rjsmin packages installed it then minifies
+the CSS and JavaScript that is not minified yet. It writes .gz and, with
+the brotli package installed, .br variants of text files next to them.
+
+posts.middleware.StaticFilesMiddleware serves STATIC_URL with serve(),
+before sessions, authentication and the url resolver: the best variant for
+the Accept-Encoding of the request is streamed with FileResponse, which
+WSGI servers send with their file wrapper, i.e. sendfile(), and hashed
+names are cached by clients for a year.
+"""
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, HttpResponseNotFound, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+
+COMPRESSIBLE = (".css", ".js", ".map", ".svg", ".txt", ".html", ".json", ".xml", ".ico", ".ttf", ".eot")
+# Smaller files do not gain enough to pay for the variant lookups
+MIN_COMPRESS_SIZE = 256
+# Variants saving less than this share of the size are not kept
+MIN_COMPRESS_RATIO = 0.95
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# Hashed names, e.g. css/site.0123456789ab.css, never change content
+HASHED_NAME = re.compile(r"\.[0-9a-f]{12}\.[^./]+$")
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MAX_AGE = 60
+
+
+# Regular expressions cannot tell code from strings, comments and regexes,
+# without rcssmin and rjsmin files are left as they are
+
+
+def minify_css(css):
+    if rcssmin is not None:
+        return rcssmin.cssmin(css)
+    return css
+
+
+def minify_js(js):
+    if rjsmin is not None:
+        return rjsmin.jsmin(js)
+    return js
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js}
+
+
+def minify(path):
+    """Minify a CSS or JavaScript file in place, returns whether it changed."""
+    root, extension = os.path.splitext(path)
+    minifier = MINIFIERS.get(extension)
+    if minifier is None or root.endswith(".min") or ".min." in os.path.basename(root):
+        return False
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    minified = minifier(source)
+    if len(minified) >= len(source):
+        return False
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(minified)
+    return True
+
+
+def _compressors():
+    yield ".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield ".br", lambda data: brotli.compress(data, quality=11)
+
+
+def compress(path):
+    """Write the compressed variants of a file worth it, returns their suffixes."""
+    if not path.endswith(COMPRESSIBLE):
+        return []
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return []
+    written = []
+    for suffix, compressor in _compressors():
+        compressed = compressor(data)
+        if len(compressed) < len(data) * MIN_COMPRESS_RATIO:
+            with open(path + suffix, "wb") as f:
+                f.write(compressed)
+            written.append(suffix)
+        elif os.path.exists(path + suffix):
+            # Left over from a build of an older version of the file
+            os.remove(path + suffix)
+    return written
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted({*paths, *self.hashed_files.values()}):
+            if self.exists(name):
+                path = self.path(name)
+                minify(path)
+                compress(path)
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Not built, e.g. before the first collectstatic in development
+            # and tests: link the file under its own name
+            return name
+
+
+def find(name, accept_encoding=""):
+    """(path, content encoding) of the variant of a collected file to send, or None."""
+    try:
+        path = safe_join(settings.STATIC_ROOT, name)
+    except SuspiciousFileOperation:
+        return None
+    if not os.path.isfile(path):
+        return None
+    accepted = {token.split(";")[0].strip() for token in accept_encoding.split(",")}
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def serve(request, name):
+    found = find(name, request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    if found is None:
+        return HttpResponseNotFound()
+    path, encoding = found
+    stat = os.stat(path)
+    if HASHED_NAME.search(name):
+        cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = f"public, max-age={MAX_AGE}"
+
+    if not was_modified_since(request.META.get("HTTP_IF_MODIFIED_SINCE"), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        content_type, _ = mimetypes.guess_type(name)
+        response = FileResponse(open(path, "rb"), content_type=content_type or "application/octet-stream")
+        response["Last-Modified"] = http_date(stat.st_mtime)
+        response["X-Content-Type-Options"] = "nosniff"
+        if encoding:
+            response["Content-Encoding"] = encoding
+    response["Cache-Control"] = cache_control
+    if name.endswith(COMPRESSIBLE):
+        response["Vary"] = "Accept-Encoding"
+    return response
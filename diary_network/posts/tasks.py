@@ -0,0 +1,59 @@
+"""Tasks run by posts.jobs, queued from posts.signals and posts.follows."""
+from .cache import bump_generation
+from .jobs import task
+from .models import Comment, Follow, Group, Post, User
+from . import conditional, search, thumbnails, timeline
+
+
+SEARCH_MODELS = {"post": Post, "comment": Comment, "group": Group}
+
+
+@task("fan_out")
+def fan_out(post_id):
+    post = Post.objects.only("id", "author", "pub_date").filter(pk=post_id).first()
+    if post is None:
+        return
+    timeline.fan_out(post)
+    # Follow feeds were answered without the post until now
+    bump_generation(f"author:{post.author_id}")
+
+
+@task("sync_follow")
+def sync_follow(user_id, author_id):
+    """Bring a follower's timeline in line with whether the follow exists."""
+    user, author = User(id=user_id), User(id=author_id)
+    if Follow.objects.filter(user_id=user_id, author_id=author_id).exists():
+        timeline.add_author(user, author)
+    else:
+        timeline.remove_author(user, author)
+    conditional.follow_changed(user_id, author_id)
+
+
+@task("user_pages")
+def user_pages(user_id):
+    """Invalidate the group pages and the comments of other posts showing a user's name."""
+    # Deduplicated here, DISTINCT would sort the rows read along the author index
+    groups = Post.objects.filter(author_id=user_id, group__isnull=False).order_by().values_list("group_id", flat=True)
+    posts = Comment.objects.filter(author_id=user_id).order_by().values_list("post_id", flat=True)
+    bump_generation(*{f"group:{pk}" for pk in groups}, *{f"post:{pk}" for pk in posts})
+
+
+@task("group_pages")
+def group_pages(group_id):
+    """Invalidate the profiles, follow feeds and post pages showing a group's title."""
+    authors = Post.objects.filter(group_id=group_id).order_by().values_list("author_id", flat=True)
+    bump_generation(*{f"author:{pk}" for pk in authors})
+
+
+@task("index")
+def index(kind, pk):
+    obj = SEARCH_MODELS[kind].objects.filter(pk=pk).first()
+    if obj is None:
+        search.remove_object(kind, pk)
+    else:
+        search.index_object(kind, obj)
+
+
+@task("renditions", max_attempts=5, on_failure=thumbnails.mark_failed)
+def renditions(post_id):
+    thumbnails.generate_renditions(post_id)
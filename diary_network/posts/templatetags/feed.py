@@ -0,0 +1,31 @@
+from django import template
+
+from posts.cards import CardRenderer
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts):
+    """Cards of a page of posts, see posts.cards."""
+    return CardRenderer(context["user"]).render(posts)
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post):
+    return CardRenderer(context["user"]).render([post])
+
+
+@register.filter
+def page_window(page, radius=2):
+    """Numbers of the first, last and nearby pages of a numbered page, None marking gaps."""
+    last = page.paginator.num_pages
+    numbers = sorted({1, last, *range(max(1, page.number - radius), min(last, page.number + radius) + 1)})
+    window = []
+    previous = 0
+    for number in numbers:
+        if number - previous > 1:
+            window.append(None)
+        window.append(number)
+        previous = number
+    return window
@@ -1,6 +1,52 @@
-from django.test import TestCase, Client
+import asyncio
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-from .models import Group, Post, User
+from PIL import Image
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.paginator import Paginator
+from django.core.wsgi import get_wsgi_application
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import F
+from django.templatetags.static import static
+from django.test import SimpleTestCase, TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from diary_network.asgi import WsgiToAsgi
+
+from . import (archive, auth, benchmark, bus, db, feeds, follows, formatting, hot, jobs, media, pagination, parallel,
+               staticfiles, tasks)
+from .cache import bump_generation, generation, get_or_compute, post_card_key
+from .cache_backends import FileBasedCache
+from .cards import CardRenderer
+from .formatting import FORMAT_VERSION
+from .metrics import registry
+from .middleware import Sample, current_sample, sampling
+from .models import Comment, Follow, Group, Job, MediaFile, Post, PostStats, TimelineEntry, User, UserStats
+from .pagination import CursorPaginator, decode_cursor, encode_cursor
+from .search import FileIndexBackend, search
+from .templatetags.feed import page_window
 
 
 class PostsCasesTest(TestCase):
@@ -21,6 +67,22 @@ class PostsCasesTest(TestCase):
         response = self.client.get("/new/", follow=True)
         self.assertEqual([("/accounts/login/?next=/new/", 302)], response.redirect_chain)
 
+    def test_reserved_usernames(self):
+        """Имена, совпадающие с адресами сайта, нельзя занять при регистрации и редактировании"""
+        for username in ("search", "metrics", "export", "follow", "new", "admin"):
+            response = self.client.post("/TestUser/edit/", {"username": username, "email": "mail@mail.ru"})
+            self.assertFormError(response, "form", "username", "Это имя занято адресом сайта")
+        self.client.post("/TestUser/edit/", {"username": "api", "email": "mail@mail.ru"})
+        self.assertTrue(User.objects.filter(username="api").exists())
+
+        self.client.logout()
+        data = {"username": "export", "email": "new@mail.ru", "password1": "n3w-passw0rd!",
+                "password2": "n3w-passw0rd!"}
+        response = self.client.post("/auth/signup/", data)
+        self.assertFormError(response, "form", "username", "Это имя занято адресом сайта")
+        self.client.post("/auth/signup/", dict(data, username="NewUser"))
+        self.assertTrue(User.objects.filter(username="NewUser").exists())
+
 
 class NewPostCaseTest(TestCase):
     def setUp(self):
@@ -105,13 +167,13 @@ class followCaseTests(TestCase):
 
     def test_follow(self):
         """Авторизованный пользователь может подписываться на других пользователей"""
-        self.client.get("/TestUser2/follow/")
+        self.client.post("/TestUser2/follow/")
         response = self.client.get("/TestUser/")
         self.assertEqual(response.context["follows"], 1)
 
     def test_unfollow(self):
         """Авторизованный пользователь может удалять других пользователей из подписок."""
-        self.client.get("/TestUser2/unfollow/")
+        self.client.post("/TestUser2/unfollow/")
         response = self.client.get("/TestUser/")
         self.assertEqual(response.context["follows"], 0)
     
@@ -130,3 +192,2022 @@ class followCaseTests(TestCase):
         self.client.login(username="TestUser2", password="text2super3")
         response = self.client.get("/follow/")
         self.assertNotContains(response, "Test post")
+
+
+class CursorPaginationCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="asdfgh12ter")
+        self.client.login(username="TestUser", password="asdfgh12ter")
+        self.group = Group.objects.create(title="Test group", slug="test-group", description="Test")
+        self.posts = [
+            Post.objects.create(text=f"Post number {i:02d}", author=self.user, group=self.group)
+            for i in range(25)
+        ]
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_cursor_roundtrip(self):
+        """Курсор кодируется в непрозрачный токен и восстанавливается без потерь"""
+        post = self.posts[0]
+        token = encode_cursor([post.pub_date, post.id])
+        self.assertEqual(decode_cursor(token), [post.pub_date, post.id])
+        with self.assertRaises(ValueError):
+            decode_cursor("not-a-cursor")
+
+    def test_walk_feed_forward_and_back(self):
+        """Лента проходится курсорами вперёд и назад без пропусков и повторов"""
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        seen = []
+        page = paginator.get_page()
+        pages = [page]
+        while True:
+            seen.extend(post.id for post in page)
+            if not page.has_next():
+                break
+            page = paginator.get_page(after_token=page.next_token)
+            pages.append(page)
+        self.assertEqual(seen, [post.id for post in reversed(self.posts)])
+        self.assertEqual(len(pages), 3)
+
+        previous = paginator.get_page(before_token=pages[2].previous_token)
+        self.assertEqual([p.id for p in previous], [p.id for p in pages[1]])
+        self.assertTrue(previous.has_previous())
+
+    def test_index_skips_count(self):
+        """Курсорная страница главной не выполняет COUNT(*) и OFFSET"""
+        first = self.client.get("/")
+        token = first.context["page"].next_token
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/?after={token}")
+        self.assertContains(response, "Post number 14")
+        self.assertNotContains(response, "Post number 15")
+        for query in queries.captured_queries:
+            self.assertNotIn("COUNT(", query["sql"].upper())
+            self.assertNotIn("OFFSET", query["sql"].upper())
+
+    def test_page_number_mode(self):
+        """Нумерованные страницы по-прежнему доступны по параметру page"""
+        response = self.client.get("/?page=3")
+        self.assertEqual(response.context["page"].number, 3)
+        self.assertContains(response, "Post number 00")
+
+    def test_broken_token(self):
+        """Повреждённый токен открывает первую страницу"""
+        response = self.client.get("/?after=broken")
+        self.assertContains(response, "Post number 24")
+
+    def test_forged_token(self):
+        """Токен со значениями не тех типов считается повреждённым"""
+        post = self.posts[0]
+        forged = [
+            [1, 2],
+            [post.pub_date.isoformat(), None],
+            [post.pub_date.isoformat(), {"a": 1}],
+            [post.pub_date.isoformat(), True],
+            [post.pub_date.replace(tzinfo=None).isoformat(), post.id],
+            [post.id, post.pub_date.isoformat()],
+        ]
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        for values in forged:
+            token = encode_cursor(values)
+            self.assertEqual(paginator.parse(token, token), (None, None))
+            for url in ("/", f"/group/{self.group.slug}/", f"/{self.user.username}/"):
+                response = self.client.get(f"{url}?after={token}")
+                self.assertContains(response, "Post number 24")
+
+    def test_group_feed_paginated(self):
+        """Лента сообщества выводится постранично"""
+        response = self.client.get(f"/group/{self.group.slug}/")
+        self.assertEqual(len(response.context["page"]), 10)
+        self.assertTrue(response.context["page"].has_next())
+
+
+class TimelineCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.author = User.objects.create_user(username="Author", email="mail2@mail.ru", password="text2super3")
+        self.client.login(username="Author", password="text2super3")
+
+    def follow(self):
+        self.client.login(username="TestUser", password="text2super3")
+        self.client.post("/Author/follow/")
+
+    def test_fan_out_on_post_new(self):
+        """Новая запись автора попадает в ленту подписчиков"""
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.post("/new/", {"text": "Fresh post"})
+        post = Post.objects.get(text="Fresh post")
+        self.assertTrue(TimelineEntry.objects.filter(user=self.user, post=post).exists())
+
+    def test_follow_backfills_and_unfollow_cleans(self):
+        """Подписка подтягивает старые записи автора, отписка их убирает"""
+        Post.objects.create(text="Old post", author=self.author)
+        self.follow()
+        response = self.client.get("/follow/")
+        self.assertContains(response, "Old post")
+
+        self.client.post("/Author/unfollow/")
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        response = self.client.get("/follow/")
+        self.assertNotContains(response, "Old post")
+
+    def test_post_delete_cleans_timeline(self):
+        """Удалённая запись исчезает из лент подписчиков"""
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.post("/new/", {"text": "Short lived"})
+        post = Post.objects.get(text="Short lived")
+        self.client.get(f"/Author/{post.pk}/delete/")
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+    def test_feed_cost_independent_of_follows(self):
+        """Число запросов ленты не зависит от количества подписок"""
+        self.follow()
+        with CaptureQueriesContext(connection) as few:
+            self.client.get("/follow/")
+        for i in range(20):
+            author = User.objects.create_user(username=f"Author{i}", password="text2super3")
+            Post.objects.create(text=f"Post {i}", author=author)
+            self.client.post(f"/Author{i}/follow/")
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get("/follow/")
+        self.assertContains(response, "Post 19")
+        self.assertEqual(len(few), len(many))
+
+    def test_rebuild_command(self):
+        """Команда rebuild_timelines восстанавливает ленты по подпискам"""
+        Post.objects.create(text="Archived post", author=self.author)
+        # Without signals, so no job fills the timeline
+        Follow.objects.bulk_create([Follow(user=self.user, author=self.author)])
+        self.assertFalse(TimelineEntry.objects.exists())
+        call_command("rebuild_timelines", stdout=StringIO())
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 1)
+
+
+class CounterCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.author = User.objects.create_user(username="Author", email="mail2@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.post = Post.objects.create(text="Test post", author=self.author)
+
+    def test_counters_follow_writes(self):
+        """Счётчики записей, подписок и комментариев обновляются при создании и удалении"""
+        self.client.post("/Author/follow/")
+        self.client.post(f"/Author/{self.post.pk}/comment/", {"text": "Test comment"})
+        author_stats = UserStats.objects.get(user=self.author)
+        self.assertEqual(author_stats.posts_count, 1)
+        self.assertEqual(author_stats.followers_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.user).follows_count, 1)
+        self.assertEqual(PostStats.objects.get(post=self.post).comments_count, 1)
+
+        self.client.post("/Author/unfollow/")
+        Comment.objects.all().delete()
+        self.assertEqual(UserStats.objects.get(user=self.author).followers_count, 0)
+        self.assertEqual(UserStats.objects.get(user=self.user).follows_count, 0)
+        self.assertEqual(PostStats.objects.get(post=self.post).comments_count, 0)
+
+    def test_sidebar_without_aggregates(self):
+        """Боковая панель профиля не выполняет агрегирующих запросов"""
+        self.client.get("/Author/")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/Author/")
+        self.assertEqual(response.context["posts_count"], 1)
+        for query in queries.captured_queries:
+            self.assertNotIn("COUNT(", query["sql"].upper())
+
+    def test_reconcile_repairs_drift(self):
+        """Команда reconcile_counters исправляет расхождения счётчиков"""
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        UserStats.objects.filter(user=self.user).delete()
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("2 rows fixed", out.getvalue())
+        self.assertEqual(UserStats.objects.get(user=self.author).posts_count, 1)
+        self.assertTrue(UserStats.objects.filter(user=self.user).exists())
+
+
+class FollowWriteCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.author = User.objects.create_user(username="Author", email="mail2@mail.ru", password="text2super3")
+        self.other = User.objects.create_user(username="Other", email="mail3@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+
+    def test_repeated_follow_and_unfollow(self):
+        """Повторная подписка и отписка не меняют счётчики дважды"""
+        follows.follow(self.other, self.author)
+        self.client.post("/Author/follow/")
+        self.client.post("/Author/follow/")
+        self.assertEqual(Follow.objects.filter(author=self.author).count(), 2)
+        self.assertEqual(UserStats.objects.get(user=self.author).followers_count, 2)
+
+        self.client.post("/Author/unfollow/")
+        self.client.post("/Author/unfollow/")
+        self.assertEqual(UserStats.objects.get(user=self.author).followers_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.user).follows_count, 0)
+
+    def test_unfollow_without_follow(self):
+        """Отписка без подписки выполняет один DELETE и ничего не меняет"""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(follows.unfollow(self.user, self.author))
+        sql = [query["sql"] for query in queries.captured_queries if "SAVEPOINT" not in query["sql"]]
+        self.assertEqual(len(sql), 1)
+        self.assertTrue(sql[0].startswith("DELETE"))
+
+    def test_follow_without_select(self):
+        """Подписка выполняет одну вставку без предварительного чтения"""
+        follows.follow(self.user, self.author)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(follows.follow(self.user, self.author))
+        sql = [query["sql"] for query in queries.captured_queries if "SAVEPOINT" not in query["sql"]]
+        self.assertEqual(len(sql), 1)
+        self.assertTrue(sql[0].startswith("INSERT"))
+        self.assertEqual(UserStats.objects.get(user=self.author).followers_count, 1)
+
+    def test_follow_and_unfollow_need_post(self):
+        """GET-запросы на подписку и отписку не меняют подписки"""
+        self.client.get("/Author/follow/")
+        self.assertFalse(Follow.objects.filter(user=self.user, author=self.author).exists())
+        self.client.post("/Author/follow/")
+        self.client.get("/Author/unfollow/")
+        self.assertTrue(Follow.objects.filter(user=self.user, author=self.author).exists())
+        self.client.post("/Author/unfollow/")
+        self.assertFalse(Follow.objects.filter(user=self.user, author=self.author).exists())
+
+    def test_bulk_follow_counts_inserted(self):
+        """Массовая подписка считает только добавленные строки"""
+        follows.follow(self.user, self.author)
+        pairs = [(self.user.id, self.author.id), (self.other.id, self.author.id), (self.other.id, self.author.id)]
+        self.assertEqual(follows.bulk_follow(pairs), 1)
+        self.assertEqual(UserStats.objects.get(user=self.author).followers_count, 2)
+        self.assertEqual(UserStats.objects.get(user=self.other).follows_count, 1)
+        self.assertEqual(follows.bulk_unfollow(pairs), 2)
+        self.assertEqual(UserStats.objects.get(user=self.author).followers_count, 0)
+
+    @override_settings(POSTS_DB_REPLICAS=["replica1"])
+    def test_unfollow_writes_primary(self):
+        """Отписка удаляет строку в основной базе даже при чтении с реплики"""
+        self.client.post("/Author/follow/")
+        # "replica1" is not configured, any read of follows routed there would fail
+        def db_for_read(model, **hints):
+            return "replica1" if model is Follow else "default"
+
+        # The timeline task runs in a worker, outside of the request
+        with mock.patch("posts.db.ReplicaRouter.db_for_read", side_effect=db_for_read), \
+                mock.patch("posts.follows.sync_later"):
+            self.assertTrue(follows.unfollow(self.user, self.author))
+        self.assertFalse(Follow.objects.using("default").filter(user=self.user, author=self.author).exists())
+
+    def test_constraints(self):
+        """База данных не допускает дублей и подписки на себя"""
+        Follow.objects.create(user=self.user, author=self.author)
+        for user, author in ((self.user, self.author), (self.user, self.user)):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                Follow.objects.create(user=user, author=author)
+        self.assertFalse(follows.follow(self.user, self.user))
+
+    def test_import_command(self):
+        """Команда import_follows массово добавляет и удаляет подписки"""
+        Post.objects.create(text="Imported post", author=self.author)
+        follows.follow(self.user, self.author)
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+            f.write("TestUser,Author\nOther,Author\nOther,TestUser\nOther,Other\nGhost,Author\n")
+            f.flush()
+            out = StringIO()
+            call_command("import_follows", f.name, stdout=out)
+            self.assertIn("2 follows created, 1 rows with unknown users skipped", out.getvalue())
+            self.assertEqual(UserStats.objects.get(user=self.author).followers_count, 2)
+            self.assertEqual(UserStats.objects.get(user=self.other).follows_count, 2)
+            self.assertTrue(TimelineEntry.objects.filter(user=self.other, author=self.author).exists())
+
+            call_command("import_follows", f.name, "--unfollow", stdout=out)
+        self.assertFalse(Follow.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(UserStats.objects.get(user=self.author).followers_count, 0)
+        self.assertEqual(UserStats.objects.get(user=self.other).follows_count, 0)
+
+
+# Queries per page, including the session and user lookups of login_required
+# Sessions and their users come from the cache, see posts.auth
+QUERY_BUDGETS = {
+    "index": 0,
+    "group": 1,
+    "profile": 3,
+    "post": 5,
+    "follow": 1,
+}
+
+
+class QueryBudgetCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.group = Group.objects.create(title="Test group", slug="test-group", description="Test")
+        for i in range(12):
+            author = User.objects.create_user(username=f"Author{i}", first_name=f"Name{i}", password="text2super3")
+            Post.objects.create(text=f"Post {i}", author=author, group=self.group)
+            self.client.post(f"/Author{i}/follow/")
+        self.post = Post.objects.filter(author__username="Author0").get()
+        for i in range(12):
+            Comment.objects.create(text=f"Comment {i}", author=User.objects.get(username=f"Author{i}"), post=self.post)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def assertQueryBudget(self, name, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(queries), QUERY_BUDGETS[name],
+            "\n".join(query["sql"] for query in queries.captured_queries),
+        )
+
+    def test_index_budget(self):
+        """Главная страница укладывается в бюджет запросов"""
+        self.assertQueryBudget("index", "/")
+
+    def test_group_budget(self):
+        """Лента сообщества укладывается в бюджет запросов"""
+        self.assertQueryBudget("group", f"/group/{self.group.slug}/")
+
+    def test_profile_budget(self):
+        """Профиль укладывается в бюджет запросов"""
+        self.assertQueryBudget("profile", "/Author0/")
+
+    def test_post_budget(self):
+        """Страница записи с комментариями укладывается в бюджет запросов"""
+        self.assertQueryBudget("post", f"/Author0/{self.post.pk}/")
+
+    def test_follow_budget(self):
+        """Лента подписок укладывается в бюджет запросов"""
+        self.assertQueryBudget("follow", "/follow/")
+
+
+class PostCardCacheCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.other = User.objects.create_user(username="Other", email="mail2@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.post = Post.objects.create(text="Cached post", author=self.user)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_card_cached_per_post(self):
+        """Карточка записи кешируется по ключу записи"""
+        self.client.get("/")
+        self.assertIsNotNone(cache.get(post_card_key(self.post)))
+
+    def test_controls_not_shared_between_users(self):
+        """Кнопки редактирования не попадают в кеш и не видны другим пользователям"""
+        edit_url = f"/TestUser/{self.post.pk}/edit/"
+        self.assertContains(self.client.get("/"), edit_url)
+        self.client.login(username="Other", password="text2super3")
+        response = self.client.get("/")
+        self.assertContains(response, "Cached post")
+        self.assertNotContains(response, edit_url)
+
+    def test_edit_and_delete_invalidate(self):
+        """Редактирование и удаление записи сбрасывают её карточку"""
+        self.client.get("/")
+        old_key = post_card_key(self.post)
+        self.client.post(f"/TestUser/{self.post.pk}/edit/", {"text": "Edited post"})
+        self.assertIsNone(cache.get(old_key))
+        self.assertContains(self.client.get("/"), "Edited post")
+
+        self.post.refresh_from_db()
+        new_key = post_card_key(self.post)
+        self.assertIsNotNone(cache.get(new_key))
+        self.client.get(f"/TestUser/{self.post.pk}/delete/")
+        self.assertIsNone(cache.get(new_key))
+
+
+class StampedeCacheCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.calls = 0
+
+    def tearDown(self):
+        cache.clear()
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_value_reused(self):
+        """Значение вычисляется один раз и дальше берётся из кеша"""
+        self.assertEqual(get_or_compute("key", self.compute, 60), 1)
+        self.assertEqual(get_or_compute("key", self.compute, 60), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_served_while_locked(self):
+        """Пока другой процесс пересчитывает значение, отдаётся устаревшее"""
+        cache.set("key", ("stale", 1.0, time.time() - 1), 60)
+        cache.add("key:lock", 1, 10)
+        self.assertEqual(get_or_compute("key", self.compute, 60), "stale")
+        self.assertEqual(self.calls, 0)
+
+    def test_early_expiry(self):
+        """Дорогое значение пересчитывается заранее, до истечения срока"""
+        cache.set("key", ("old", 3600.0, time.time() + 1), 60)
+        self.assertEqual(get_or_compute("key", self.compute, 60), 1)
+
+    def test_waits_for_lock_holder(self):
+        """Без значения в кеше процесс ждёт результат держателя блокировки"""
+        cache.add("key:lock", 1, 10)
+        self.assertEqual(get_or_compute("key", self.compute, 60, lock_timeout=0.1), 1)
+
+    def test_generation_bump(self):
+        """Сброс поколения инвалидирует закешированную ленту"""
+        first = generation("index")
+        bump_generation("index")
+        self.assertEqual(generation("index"), first + 1)
+
+        self.client.get("/")
+        Post.objects.create(text="Brand new post", author=self.user)
+        self.assertContains(self.client.get("/"), "Brand new post")
+
+    def test_file_cache_add_across_processes(self):
+        """Ключ файлового кеша добавляется только одним из процессов"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        context = multiprocessing.get_context("fork")
+        start, results = context.Event(), context.Queue()
+        keys = [f"lock-{i}" for i in range(300)]
+        processes = [context.Process(target=add_file_cache_keys, args=(directory, keys, start, results))
+                     for _ in range(3)]
+        for process in processes:
+            process.start()
+        start.set()
+        added = sum((results.get(timeout=60) for _ in processes), [])
+        for process in processes:
+            process.join()
+        self.assertEqual(sorted(added), sorted(keys))
+
+    def test_file_cache_generation_never_expires(self):
+        """Поколения в файловом кеше не истекают после увеличения"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file_cache = FileBasedCache(directory, {"TIMEOUT": 300})
+        with mock.patch("posts.cache.get_cache", return_value=file_cache):
+            first = generation("index")
+            bump_generation("index")
+            bump_generation("index")
+            with mock.patch("time.time", return_value=time.time() + 3600):
+                self.assertEqual(generation("index"), first + 2)
+        file_cache.set("counter", 1, 60)
+        self.assertEqual(file_cache.incr("counter", 5), 6)
+        with mock.patch("time.time", return_value=time.time() + 120):
+            self.assertIsNone(file_cache.get("counter"))
+            with self.assertRaises(ValueError):
+                file_cache.incr("counter")
+
+
+def add_file_cache_keys(directory, keys, start, results):
+    file_cache = FileBasedCache(directory, {})
+    start.wait()
+    results.put([key for key in keys if file_cache.add(key, os.getpid(), 60)])
+
+
+def make_image(name="image.png", size=(1200, 800), color="red"):
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, "PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class ThumbnailCaseTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        cache.clear()
+
+    @override_settings(POSTS_JOB_BACKEND="posts.jobs.EagerBackend")
+    def test_renditions_on_upload(self):
+        """При загрузке изображения создаются превью всех размеров"""
+        self.client.post("/new/", {"text": "With image", "image": make_image()})
+        post = Post.objects.get(text="With image")
+        self.assertEqual(set(post.rendition_urls), {"card", "small", "square"})
+        response = self.client.get("/")
+        self.assertContains(response, post.rendition_urls["card"])
+        self.assertNotContains(response, "Изображение обрабатывается")
+
+    @override_settings(POSTS_JOB_BACKEND="posts.jobs.DatabaseBackend")
+    def test_placeholder_while_pending(self):
+        """Пока превью не готовы, вместо изображения выводится заглушка"""
+        self.client.post("/new/", {"text": "Pending image", "image": make_image()})
+        post = Post.objects.get(text="Pending image")
+        self.assertTrue(post.renditions_pending)
+        self.assertContains(self.client.get("/"), "Изображение обрабатывается")
+
+    @override_settings(POSTS_JOB_BACKEND="posts.jobs.EagerBackend")
+    def test_new_image_on_edit(self):
+        """Замена изображения при редактировании пересоздаёт превью"""
+        self.client.post("/new/", {"text": "Edited image", "image": make_image()})
+        post = Post.objects.get(text="Edited image")
+        old = post.rendition_urls["card"]
+        self.client.post(
+            f"/TestUser/{post.pk}/edit/",
+            {"text": "Edited image", "image": make_image("other.png", color="blue")},
+        )
+        post.refresh_from_db()
+        self.assertNotEqual(post.rendition_urls["card"], old)
+
+    @override_settings(POSTS_JOB_BACKEND="posts.jobs.DatabaseBackend")
+    def test_failed_after_last_attempt(self):
+        """Ошибка генерации превью повторяется и помечается только после последней попытки"""
+        self.client.post("/new/", {"text": "Broken image", "image": make_image()})
+        post = Post.objects.get(text="Broken image")
+        with mock.patch("posts.thumbnails.get_thumbnail", side_effect=OSError("Disk full")), \
+                self.assertLogs("posts.jobs", "ERROR"):
+            for attempt in range(tasks.renditions.max_attempts):
+                Job.objects.update(run_at=timezone.now())
+                jobs.work(once=True)
+                post.refresh_from_db()
+                self.assertEqual(post.renditions_pending, attempt < tasks.renditions.max_attempts - 1)
+        self.assertEqual(post.rendition_urls, {"failed": True})
+        self.assertEqual(Job.objects.get(name="renditions").status, Job.FAILED)
+
+
+class SearchCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.group = Group.objects.create(title="Gardening", slug="gardening", description="Tomatoes and roses")
+        self.post = Post.objects.create(text="My tomatoes are ripe", author=self.user, group=self.group)
+        self.comment = Comment.objects.create(text="Send me some tomatoes", author=self.user, post=self.post)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_search_all_kinds(self):
+        """Поиск находит записи, комментарии и сообщества"""
+        found = {(kind, pk) for kind, pk, _, _ in search("tomatoes")}
+        self.assertEqual(found, {("post", self.post.pk), ("comment", self.comment.pk), ("group", self.group.pk)})
+        response = self.client.get("/search/?q=tomatoes")
+        self.assertContains(response, "My tomatoes are ripe")
+        self.assertContains(response, "Send me some tomatoes")
+        self.assertContains(response, "Gardening")
+
+    def test_index_follows_changes(self):
+        """Индекс обновляется при редактировании и удалении"""
+        self.client.post(f"/TestUser/{self.post.pk}/edit/", {"text": "My cucumbers are ripe"})
+        self.assertEqual([pk for _, pk, _, _ in search("cucumbers")], [self.post.pk])
+        self.assertEqual([kind for kind, _, _, _ in search("ripe tomatoes")], [])
+        self.client.get(f"/TestUser/{self.post.pk}/delete/")
+        self.assertEqual(search("cucumbers"), [])
+        self.assertEqual(search("send"), [])
+
+    def test_user_syntax_is_escaped(self):
+        """Спецсимволы в запросе не ломают поиск"""
+        response = self.client.get('/search/?q=tomatoes" OR (NEAR*')
+        self.assertEqual(response.status_code, 200)
+
+    def test_paginated_results(self):
+        """Результаты поиска выводятся постранично по курсору"""
+        for i in range(12):
+            Post.objects.create(text=f"Harvest report {i}", author=self.user)
+        first = self.client.get("/search/?q=harvest").context["page"]
+        self.assertEqual(len(first), 10)
+        second = self.client.get(f"/search/?q=harvest&{first.next_query()}").context["page"]
+        self.assertEqual(len(second), 2)
+        seen = {result["object"].pk for result in first} | {result["object"].pk for result in second}
+        self.assertEqual(len(seen), 12)
+
+    def test_forged_cursor(self):
+        """Курсор поиска не того вида открывает первую страницу"""
+        for values in ([1.5], [-1.5, {"a": 1}], [1, 2], [-1.5, 2.5], [-1.5, True], [-1.5, 2, 3]):
+            response = self.client.get(f"/search/?q=tomatoes&after={encode_cursor(values)}")
+            self.assertContains(response, "My tomatoes are ripe")
+
+    def test_admin_search(self):
+        """Поиск в админке использует полнотекстовый индекс"""
+        User.objects.create_superuser(username="Admin", email="admin@mail.ru", password="text2super3")
+        self.client.login(username="Admin", password="text2super3")
+        Post.objects.create(text="Unrelated", author=self.user)
+        response = self.client.get("/admin/posts/post/?q=tomatoes")
+        self.assertEqual(list(response.context["cl"].result_list), [self.post])
+
+    def test_file_index_backend(self):
+        """Файловый индекс ранжирует документы по BM25"""
+        with tempfile.NamedTemporaryFile(suffix=".sqlite3") as index_file:
+            backend = FileIndexBackend(index_file.name)
+            backend.index(3, "apple apple banana")
+            backend.index(6, "apple cherry")
+            backend.index(9, "cherry")
+            self.assertEqual([doc for doc, _ in backend.search(["apple"])], [3, 6])
+            first = backend.search(["apple"], limit=1)
+            self.assertEqual([doc for doc, _ in backend.search(["apple"], after=(first[0][1], 3))], [6])
+            backend.remove(3)
+            self.assertEqual([doc for doc, _ in backend.search(["apple"])], [6])
+
+
+FULL_SCAN_RE = re.compile(r"^SCAN (TABLE )?(\w+)$")
+# Lookup tables read whole on purpose: PostForm lists every group
+FULL_SCAN_ALLOWED = {"posts_group"}
+
+
+class QueryPlanCaseTests(TestCase):
+    """Every query of every posts view must use an index.
+
+    A plain `SCAN <table>` is a full table scan and `USE TEMP B-TREE` a sort
+    the index could not provide. Queries on the FTS5 table are exempt: they
+    are ordered by relevance, which always needs a sort.
+    """
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.author = User.objects.create_user(username="Author", email="mail2@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.group = Group.objects.create(title="Test group", slug="test-group", description="Test")
+        for i in range(12):
+            Post.objects.create(text=f"Post {i}", author=self.author, group=self.group)
+        self.post = Post.objects.create(text="Own post", author=self.user)
+        self.comment = Comment.objects.create(text="Comment", author=self.user, post=self.post)
+        self.client.post("/Author/follow/")
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def assertIndexedQueries(self, method, url, data=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            getattr(self.client, method)(url, data or {})
+        for query in queries.captured_queries:
+            sql = query["sql"]
+            if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql)
+                details = [row[-1] for row in cursor.fetchall()]
+            if any("VIRTUAL TABLE" in detail for detail in details):
+                continue
+            bad = [
+                detail for detail in details
+                if "TEMP B-TREE" in detail
+                or (FULL_SCAN_RE.match(detail) and FULL_SCAN_RE.match(detail).group(2) not in FULL_SCAN_ALLOWED)
+            ]
+            self.assertEqual(bad, [], f"{method.upper()} {url}: {sql}")
+
+    def test_feed_plans(self):
+        """Ленты читаются по индексам, без полного сканирования и сортировки"""
+        for url in ["/", "/?page=2", f"/group/{self.group.slug}/", "/Author/", "/follow/"]:
+            self.assertIndexedQueries("get", url)
+            page = self.client.get(url).context["page"]
+            if getattr(page, "is_cursor", False) and page.has_next():
+                self.assertIndexedQueries("get", f"{url}?{page.next_query()}")
+                after = self.client.get(f"{url}?{page.next_query()}").context["page"]
+                self.assertIndexedQueries("get", f"{url}?{after.previous_query()}")
+
+    def test_post_page_plans(self):
+        """Страница записи и поиск читаются по индексам"""
+        self.assertIndexedQueries("get", f"/TestUser/{self.post.pk}/")
+        self.assertIndexedQueries("get", "/search/?q=post")
+        self.assertIndexedQueries("get", "/new/")
+        self.assertIndexedQueries("get", f"/TestUser/{self.post.pk}/edit/")
+
+    def test_write_plans(self):
+        """Изменяющие запросы находят строки по индексам"""
+        self.assertIndexedQueries("post", "/new/", {"text": "New post", "group": self.group.pk})
+        self.assertIndexedQueries("post", f"/TestUser/{self.post.pk}/edit/", {"text": "Edited"})
+        self.assertIndexedQueries("post", f"/TestUser/{self.post.pk}/comment/", {"text": "Another"})
+        self.assertIndexedQueries("get", f"/TestUser/{self.post.pk}/comment/{self.comment.pk}/delete/")
+        self.assertIndexedQueries("post", "/Author/unfollow/")
+        self.assertIndexedQueries("post", "/Author/follow/")
+        self.assertIndexedQueries("post", "/TestUser/edit/", {"username": "TestUser"})
+        self.assertIndexedQueries("get", f"/TestUser/{self.post.pk}/delete/")
+
+
+class BenchmarkCaseTests(TestCase):
+    def setUp(self):
+        call_command("seed_data", "--scale", "tiny", "--users", "8", "--posts", "30", "--groups", "2",
+                     "--heavy-share", "0.1", "--heavy-comments", "5", stdout=StringIO())
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_seed_data(self):
+        """Команда seed_data создаёт согласованный набор данных"""
+        self.assertEqual(Post.objects.count(), 30)
+        self.assertEqual(User.objects.filter(username__startswith="bench_").count(), 8)
+        self.assertFalse(Follow.objects.filter(user=F("author")).exists())
+        self.assertEqual(
+            sum(UserStats.objects.values_list("followers_count", flat=True)), Follow.objects.count()
+        )
+        self.assertEqual(TimelineEntry.objects.count(), sum(
+            Post.objects.filter(author=author).count() for author in Follow.objects.values_list("author", flat=True)
+        ))
+        dates = list(Post.objects.order_by("id").values_list("pub_date", flat=True))
+        self.assertEqual(dates, sorted(dates))
+        self.assertLess(dates[0], dates[-1])
+
+    def test_bench_covers_routes_and_compares(self):
+        """Команда bench измеряет каждый маршрут и находит регрессии относительно базовой линии"""
+        cache.set("kept", 1, None)
+        index_generation = generation("index")
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/baseline.json"
+            call_command("bench", "--requests", "2", "--load-requests", "0", "--save", path, stdout=StringIO())
+            report = benchmark.read(path)
+            for name in ("index", "profile", "post_view", "follow_index", "post_delete", "comment_add"):
+                self.assertIn(name, report["routes"])
+            self.assertEqual(report["routes"]["index"]["client"]["status"], 200)
+            self.assertEqual(report["routes"]["page_not_found"]["client"]["status"], 404)
+            self.assertEqual(Post.objects.count(), 30)
+            # Writes were measured against a private cache
+            self.assertEqual(cache.get("kept"), 1)
+            self.assertEqual(generation("index"), index_generation)
+
+            queries = report["routes"]["post_view"]["client"]["queries"]
+            report["routes"]["post_view"]["client"]["queries"] = queries - 1
+            benchmark.save(report, path)
+            with self.assertRaisesMessage(CommandError, f"post_view: {queries - 1} -> {queries} queries"):
+                call_command("bench", "post_view", "--requests", "2", "--load-requests", "0", "--compare", path,
+                             stdout=StringIO())
+
+    def test_bench_sessions(self):
+        """Кешированные сессии убирают два запроса из каждой страницы"""
+        report = benchmark.sessions(requests=2)
+        self.assertEqual(report["database"]["queries"] - report["cached"]["queries"], 2)
+        self.assertEqual(report["cached"]["status"], 200)
+        out = StringIO()
+        call_command("bench_sessions", "--requests", "1", stdout=out)
+        self.assertIn("cached", out.getvalue())
+
+    def test_percentile(self):
+        """Перцентили считаются интерполяцией между соседними рангами"""
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50.5)
+        self.assertAlmostEqual(benchmark.percentile(values, 99), 99.01)
+        self.assertEqual(benchmark.percentile([3], 95), 3)
+
+
+class MetricsCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        Post.objects.create(text="Test post", author=self.user)
+        registry.reset()
+        cache.clear()
+
+    @override_settings(POSTS_METRICS_SAMPLE_RATE=1)
+    def test_server_timing_and_histograms(self):
+        """Выбранные запросы получают заголовок Server-Timing и попадают в гистограммы"""
+        self.client.get("/")
+        response = self.client.get("/")
+        timing = response["Server-Timing"]
+        # The feed, the session and its user all come from the cache
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="0 queries"')
+        self.assertRegex(timing, r"tpl;dur=[\d.]+")
+        self.assertRegex(timing, r'cache;desc="[1-9]\d* hits, \d+ misses"')
+
+        metrics = self.client.get("/metrics/").content.decode()
+        self.assertIn('posts_request_queries_count{view="posts.views.index"} 2', metrics)
+        self.assertIn('posts_request_queries_bucket{view="posts.views.index",le="5"} 2', metrics)
+        self.assertIn('posts_request_duration_seconds_bucket{view="posts.views.index",le="+Inf"} 2', metrics)
+        self.assertIn('posts_cache_requests_total{view="posts.views.index",result="hit"}', metrics)
+
+    @override_settings(POSTS_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests(self):
+        """Невыбранные запросы не инструментируются"""
+        response = self.client.get("/")
+        self.assertFalse(response.has_header("Server-Timing"))
+        self.assertNotIn("posts.views.index", registry.render())
+
+    def test_metrics_only_local(self):
+        """Метрики доступны только с внутренних адресов"""
+        response = self.client.get("/metrics/", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 404)
+
+
+class ReplicaRouterCaseTests(SimpleTestCase):
+    databases = {"default"}
+
+    def setUp(self):
+        self.router = db.ReplicaRouter()
+
+    def tearDown(self):
+        db.end_request()
+
+    @override_settings(POSTS_DB_REPLICAS=["replica1", "replica2"])
+    def test_router(self):
+        """Чтения безопасных запросов идут в одну реплику, после записи — в основную базу"""
+        self.assertEqual(self.router.db_for_read(Post), "default")
+        replica = db.start_request(use_replicas=True)
+        self.assertIn(replica, ["replica1", "replica2"])
+        self.assertEqual({self.router.db_for_read(Post) for _ in range(10)}, {replica})
+        self.assertEqual(self.router.db_for_read(Session), "default")
+        self.assertEqual(self.router.db_for_write(Post), "default")
+        self.assertEqual(self.router.db_for_read(Post), "default")
+        self.assertTrue(db.end_request())
+        self.assertFalse(self.router.allow_migrate("replica1", "posts"))
+
+        db.start_request(use_replicas=True)
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Post), "default")
+
+
+class ReplicaCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.post = Post.objects.create(text="Test post", author=self.user)
+
+    @override_settings(POSTS_DB_REPLICAS=["default"])
+    def test_read_your_writes(self):
+        """После записи клиент читает из основной базы, пока действует cookie"""
+        response = self.client.get("/")
+        self.assertEqual(response.wsgi_request.read_db, "default")
+        self.assertNotIn("db_pin", response.cookies)
+
+        response = self.client.post(f"/TestUser/{self.post.pk}/comment/", {"text": "Test comment"})
+        self.assertEqual(response.wsgi_request.read_db, None)
+        self.assertEqual(response.cookies["db_pin"]["max-age"], 5)
+
+        response = self.client.get("/")
+        self.assertEqual(response.wsgi_request.read_db, None)
+
+    @override_settings(POSTS_DB_REPLICAS=["default"])
+    def test_replica_reads_not_shared(self):
+        """Прочитанное с реплики не попадает в общий кеш и не получает ETag"""
+        cache.clear()
+        with mock.patch.object(cache, "set", wraps=cache.set) as cache_set:
+            for path in ("/", "/TestUser/"):
+                response = self.client.get(path)
+                self.assertEqual(response.wsgi_request.read_db, "default")
+                self.assertFalse(response.has_header("ETag"), path)
+        stored = [call[0][0] for call in cache_set.call_args_list]
+        self.assertFalse([key for key in stored if key.startswith(("feed:", "user-id:"))], stored)
+
+        with self.settings(POSTS_DB_REPLICAS=[]):
+            response = self.client.get("/")
+        self.assertTrue(response.has_header("ETag"))
+
+    def test_sqlite_files(self):
+        """Реплика копируется из основного файла, соединения используют WAL"""
+        with tempfile.TemporaryDirectory() as directory:
+            primary = sqlite3.connect(f"{directory}/primary.sqlite3")
+            db.apply_pragmas(primary)
+            self.assertEqual(primary.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            with primary:
+                primary.execute("CREATE TABLE t (x)")
+                primary.execute("INSERT INTO t VALUES (1)")
+            db.copy_sqlite(f"{directory}/primary.sqlite3", f"{directory}/replica.sqlite3")
+            primary.close()
+
+            replica = sqlite3.connect(f"{directory}/replica.sqlite3")
+            db.apply_pragmas(replica, read_only=True)
+            self.assertEqual(replica.execute("SELECT x FROM t").fetchall(), [(1,)])
+            with self.assertRaises(sqlite3.OperationalError):
+                replica.execute("INSERT INTO t VALUES (2)")
+            replica.close()
+
+
+def echo_application(environ, start_response):
+    body = environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))
+    start_response("201 Created", [("Content-Type", "text/plain"), ("X-Path", environ["PATH_INFO"])])
+    return [environ["HTTP_COOKIE"].encode(), b"|", b"", body]
+
+
+def call_asgi(application, path, method="GET", headers=(), chunks=(b"",)):
+    scope = {
+        "type": "http", "http_version": "1.1", "method": method, "scheme": "http", "path": path,
+        "query_string": b"", "headers": list(headers), "client": ("127.0.0.1", 1), "server": ("testserver", 80),
+    }
+    incoming = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1} for i, chunk in enumerate(chunks)
+    ]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    return sent
+
+
+class AsgiCaseTests(SimpleTestCase):
+    def test_bridge(self):
+        """ASGI-адаптер передаёт тело, заголовки и ответ WSGI-приложения"""
+        sent = call_asgi(
+            WsgiToAsgi(echo_application), "/тест/", method="POST",
+            headers=[(b"cookie", b"a=1"), (b"cookie", b"b=2"), (b"content-length", b"6")],
+            chunks=[b"abc", b"def"],
+        )
+        self.assertEqual(sent[0]["type"], "http.response.start")
+        self.assertEqual(sent[0]["status"], 201)
+        headers = dict(sent[0]["headers"])
+        self.assertEqual(headers[b"x-path"].decode("utf8"), "/тест/")
+        body = b"".join(message.get("body", b"") for message in sent[1:])
+        self.assertEqual(body, b"a=1; b=2|abcdef")
+        self.assertFalse(sent[-1]["more_body"])
+
+    def test_django_application(self):
+        """Django-приложение работает через ASGI"""
+        sent = call_asgi(WsgiToAsgi(get_wsgi_application()), "/")
+        self.assertEqual(sent[0]["status"], 302)
+        self.assertEqual(dict(sent[0]["headers"])[b"location"], b"/accounts/login/?next=/")
+
+
+class ParallelCaseTests(SimpleTestCase):
+    databases = {"default"}
+
+    @override_settings(POSTS_QUERY_WORKERS=2, POSTS_DB_REPLICAS=["replica1"])
+    def test_gather(self):
+        """Независимые запросы выполняются в потоках с маршрутизацией запроса"""
+        db.start_request(use_replicas=True)
+        try:
+            results = parallel.gather(
+                lambda: threading.current_thread().name,
+                lambda: (threading.current_thread().name, db.current_replica()),
+                lambda: (threading.current_thread().name, db.current_replica()),
+            )
+        finally:
+            db.end_request()
+        self.assertEqual(results[0], threading.current_thread().name)
+        for name, replica in results[1:]:
+            self.assertTrue(name.startswith("queries"))
+            self.assertEqual(replica, "replica1")
+
+        with self.assertRaises(ZeroDivisionError):
+            parallel.gather(lambda: 1, lambda: 1 / 0)
+
+        with transaction.atomic():
+            names = parallel.gather(lambda: threading.current_thread().name, lambda: threading.current_thread().name)
+        self.assertEqual(set(names), {threading.current_thread().name})
+
+    @override_settings(POSTS_QUERY_WORKERS=2)
+    def test_gather_sampled(self):
+        """Запросы в потоках учитываются в метриках запроса"""
+        sample = Sample()
+        with sampling(sample):
+            parallel.gather(*[lambda: list(User.objects.all())] * 3)
+        self.assertEqual(sample.queries, 3)
+        self.assertIsNone(current_sample())
+
+    @override_settings(POSTS_QUERY_WORKERS=1)
+    def test_gather_busy_pool(self):
+        """Без свободного потока запросы выполняются в вызывающем потоке, а не ждут"""
+        parallel.get_executor()
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        other = threading.Thread(target=parallel.gather, args=(lambda: None, block))
+        other.start()
+        try:
+            started.wait(5)
+            names = parallel.gather(lambda: None, lambda: threading.current_thread().name)
+        finally:
+            release.set()
+            other.join()
+        self.assertEqual(names[1], threading.current_thread().name)
+
+
+class ConditionalGetCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.author = User.objects.create_user(username="Author", email="mail2@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.group = Group.objects.create(title="Test group", slug="test-group", description="Test")
+        self.post = Post.objects.create(text="Test post", author=self.author, group=self.group)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def assertNotModified(self, path):
+        # The first response sets the CSRF cookie the page ETags depend on
+        self.client.get(path)
+        etag = self.client.get(path)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.templates, [])
+        # Only the session and the user of login_required
+        self.assertLessEqual(len(queries), 2)
+        return etag
+
+    def assertModified(self, path, etag):
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_feeds(self):
+        """Ленты отвечают 304, пока в них ничего не изменилось"""
+        paths = ["/", "/group/test-group/", "/Author/"]
+        etags = [self.assertNotModified(path) for path in paths]
+        Post.objects.create(text="Another post", author=self.author, group=self.group)
+        for path, etag in zip(paths, etags):
+            self.assertModified(path, etag)
+
+    def test_post_page(self):
+        """Страница записи меняет ETag при новом комментарии"""
+        path = f"/Author/{self.post.pk}/"
+        etag = self.assertNotModified(path)
+        self.client.post(f"{path}comment/", {"text": "Test comment"})
+        self.assertModified(path, etag)
+
+    def test_follow_feed_and_viewer(self):
+        """Лента подписок меняет ETag при подписке и новых записях, ETag зависит от читателя"""
+        etag = self.assertNotModified("/follow/")
+        self.client.post("/Author/follow/")
+        self.assertModified("/follow/", etag)
+        etag = self.assertNotModified("/follow/")
+        Post.objects.create(text="Fresh post", author=self.author)
+        self.assertModified("/follow/", etag)
+
+        etag = self.client.get("/")["ETag"]
+        self.client.login(username="Author", password="text2super3")
+        self.assertEqual(self.client.get("/", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_group_renamed(self):
+        """Переименование сообщества меняет ETag страниц с карточками его записей"""
+        self.client.post("/Author/follow/")
+        paths = ["/", "/Author/", f"/Author/{self.post.pk}/", "/follow/"]
+        etags = [self.assertNotModified(path) for path in paths]
+        self.group.title = "Renamed group"
+        self.group.save()
+        for path, etag in zip(paths, etags):
+            self.assertModified(path, etag)
+        self.assertContains(self.client.get("/"), "Renamed group")
+
+    def test_user_renamed(self):
+        """Смена имени меняет ETag сообществ и записей, где оно выводится"""
+        own = Post.objects.create(text="Own post", author=self.user)
+        Comment.objects.create(text="Author comment", author=self.author, post=own)
+        paths = ["/group/test-group/", f"/TestUser/{own.pk}/"]
+        etags = [self.assertNotModified(path) for path in paths]
+        self.author.first_name = "Renamed"
+        self.author.save()
+        for path, etag in zip(paths, etags):
+            self.assertModified(path, etag)
+
+        # The navigation bar shows the viewer's own username
+        etag = self.assertNotModified("/group/test-group/")
+        self.user.username = "RenamedUser"
+        self.user.save()
+        self.assertModified("/group/test-group/", etag)
+
+
+class FeedApiCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.author = User.objects.create_user(username="Author", email="mail2@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.group = Group.objects.create(title="Test group", slug="test-group", description="Test")
+        self.first = Post.objects.create(text="First post", author=self.author, group=self.group)
+        self.second = Post.objects.create(text="Second post", author=self.user)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_feed(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_latest_and_since(self):
+        """API отдает последние записи, а с курсором - только более новые"""
+        data = self.get_feed("/api/feed/")
+        self.assertEqual([post["id"] for post in data["posts"]], [self.second.id, self.first.id])
+        self.assertEqual(data["posts"][0]["url"], f"/TestUser/{self.second.id}/")
+        self.assertEqual(self.get_feed("/api/feed/", since=data["cursor"])["posts"], [])
+
+        third = Post.objects.create(text="Third post", author=self.author)
+        newer = self.get_feed("/api/feed/", since=data["cursor"])
+        self.assertEqual([post["id"] for post in newer["posts"]], [third.id])
+        self.assertFalse(newer["has_more"])
+        self.assertEqual(self.get_feed("/api/feed/", since=newer["cursor"])["cursor"], newer["cursor"])
+
+    def test_since_pages_forward(self):
+        """Много новых записей отдаются частями от старых к новым"""
+        cursor = self.get_feed("/api/feed/")["cursor"]
+        created = [Post.objects.create(text=f"Post {i}", author=self.author).id for i in range(25)]
+        data = self.get_feed("/api/feed/", since=cursor)
+        self.assertTrue(data["has_more"])
+        self.assertEqual([post["id"] for post in data["posts"]], created[:20][::-1])
+        data = self.get_feed("/api/feed/", since=data["cursor"])
+        self.assertFalse(data["has_more"])
+        self.assertEqual([post["id"] for post in data["posts"]], created[20:][::-1])
+
+    def test_feeds(self):
+        """API групп, профилей и подписок отдает только свои записи"""
+        self.client.post("/Author/follow/")
+        for path in ["/api/feed/group/test-group/", "/api/feed/user/Author/", "/api/feed/follow/"]:
+            self.assertEqual([post["id"] for post in self.get_feed(path)["posts"]], [self.first.id], path)
+        self.assertEqual(self.get_feed("/api/feed/group/test-group/")["posts"][0]["group"], "test-group")
+        self.assertEqual(self.client.get("/api/feed/group/missing/").status_code, 404)
+        self.assertEqual(self.client.get("/api/feed/user/missing/").status_code, 404)
+
+    def test_empty_feed_cursor(self):
+        """Курсор пустой ленты позволяет дождаться первой записи"""
+        data = self.get_feed("/api/feed/follow/")
+        self.assertEqual(data["posts"], [])
+        self.client.post("/Author/follow/")
+        data = self.get_feed("/api/feed/follow/", since=data["cursor"])
+        self.assertEqual([post["id"] for post in data["posts"]], [self.first.id])
+
+    def test_invalid_params(self):
+        """Некорректные курсор и время ожидания отклоняются"""
+        for params in [{"since": "garbage"}, {"since": encode_cursor([1, 2])}, {"wait": "-1"}, {"wait": "nan"}]:
+            self.assertEqual(self.client.get("/api/feed/", params).status_code, 400, params)
+
+    def test_long_poll_times_out(self):
+        """Долгий опрос без новых записей ждет не дольше wait"""
+        cursor = self.get_feed("/api/feed/")["cursor"]
+        started = time.monotonic()
+        data = self.get_feed("/api/feed/", since=cursor, wait=0.1)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        self.assertEqual(data["posts"], [])
+
+    def test_long_poll_wakes_on_new_post(self):
+        """Долгий опрос возвращается сразу после публикации записи"""
+        cursor = self.get_feed("/api/feed/user/Author/")["cursor"]
+        shared = connections["default"]
+        created = []
+
+        def publish_later():
+            # Write inside the test transaction through the blocked client's connection
+            connections["default"] = shared
+            time.sleep(0.2)
+            created.append(Post.objects.create(text="Late post", author=self.author))
+            bus.publish("index", f"author:{self.author.id}")
+
+        shared.inc_thread_sharing()
+        thread = threading.Thread(target=publish_later)
+        started = time.monotonic()
+        thread.start()
+        try:
+            data = self.get_feed("/api/feed/user/Author/", since=cursor, wait=10)
+        finally:
+            thread.join()
+            shared.dec_thread_sharing()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([post["id"] for post in data["posts"]], [created[0].id])
+
+    def test_follow_long_poll_before_fan_out(self):
+        """Долгий опрос подписок видит запись сразу, не дожидаясь заполнения ленты"""
+        self.client.post("/Author/follow/")
+        cursor = self.get_feed("/api/feed/follow/")["cursor"]
+        with mock.patch("posts.jobs.enqueue"):
+            third = Post.objects.create(text="Third post", author=self.author)
+        self.assertFalse(TimelineEntry.objects.filter(post=third).exists())
+        data = self.get_feed("/api/feed/follow/", since=cursor, wait=5)
+        self.assertEqual([post["id"] for post in data["posts"]], [third.id])
+
+    @override_settings(POSTS_FEED_MAX_WAITERS=0)
+    def test_waiters_bounded(self):
+        """Сверх лимита ожидающих запросы не удерживаются"""
+        cursor = self.get_feed("/api/feed/")["cursor"]
+        response = self.client.get("/api/feed/", {"since": cursor, "wait": 10})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "5")
+        response = self.client.get("/api/feed/", {"stream": 1})
+        self.assertEqual(b"".join(response.streaming_content), b"retry: 5000\n\n")
+        # Posts already there are returned without waiting
+        response = self.client.get("/api/feed/", {"since": encode_cursor(feeds.EPOCH), "wait": 10})
+        self.assertEqual(len(response.json()["posts"]), 2)
+
+    def test_post_new_publishes(self):
+        """Новая запись будит ожидающих ее ленты"""
+        seen = bus.snapshot(["index", f"author:{self.user.id}", f"group:{self.group.id}"])
+        self.client.post("/new/", {"text": "New post", "group": self.group.id})
+        self.assertTrue(bus.changed(seen))
+        self.assertTrue(bus.wait(seen, 0))
+
+    @override_settings(POSTS_FEED_STREAM_SECONDS=0)
+    def test_event_stream(self):
+        """Поток событий отдает записи и курсор для переподключения"""
+        response = self.client.get("/api/feed/", HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode()
+        self.assertIn("event: posts", body)
+        cursor = re.search(r"^id: (\S+)$", body, re.M).group(1)
+        response = self.client.get("/api/feed/", {"stream": 1}, HTTP_LAST_EVENT_ID=cursor)
+        self.assertNotIn("event: posts", b"".join(response.streaming_content).decode())
+
+
+class BusCaseTests(SimpleTestCase):
+    def test_wait(self):
+        """Ожидание завершается по таймауту или при публикации темы"""
+        seen = bus.snapshot(["bus-test"])
+        self.assertFalse(bus.wait(seen, 0.05))
+        threading.Timer(0.05, bus.publish, ["other", "bus-test"]).start()
+        self.assertTrue(bus.wait(seen, 5))
+        self.assertFalse(bus.changed(bus.snapshot(["bus-test"])))
+
+
+class HotGroupCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.group = Group.objects.create(title="Test group", slug="test-group", description="Test")
+        self.other = Group.objects.create(title="Other group", slug="other-group", description="Other")
+        self.posts = [
+            Post.objects.create(text=f"Post number {i:02d}", author=self.user, group=self.group)
+            for i in range(25)
+        ]
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def walk(self, path):
+        """Ids of every page reached with next links, then of the page before the last one."""
+        pages = []
+        response = self.client.get(path)
+        while True:
+            page = response.context["page"]
+            pages.append([post.id for post in page])
+            if not page.has_next():
+                break
+            response = self.client.get(f"{path}?{page.next_query()}")
+        previous = self.client.get(f"{path}?{page.previous_query()}").context["page"]
+        return pages, [post.id for post in previous]
+
+    def test_pages_match_database(self):
+        """Страницы из кэша недавних записей совпадают с выборкой из базы, в том числе за его границей"""
+        expected = [post.id for post in reversed(self.posts)]
+        for size in [200, 15, 5]:
+            cache.clear()
+            with mock.patch.object(hot, "HOT_SIZE", size):
+                pages, previous = self.walk("/group/test-group/")
+            self.assertEqual(sum(pages, []), expected, size)
+            self.assertEqual(previous, pages[1], size)
+
+    def test_served_from_hot_list(self):
+        """Первая страница сообщества читает записи по ключу, без диапазонного запроса"""
+        self.client.get("/group/test-group/")
+        Post.objects.create(text="Fresh post", author=self.user, group=self.group)
+        rows, complete = cache.get(hot.hot_key(self.group.id))
+        self.assertEqual(len(rows), 26)
+        self.assertTrue(complete)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/group/test-group/")
+        self.assertEqual(response.context["page"][0].text, "Fresh post")
+        sql = [query["sql"] for query in queries.captured_queries if "posts_post" in query["sql"]]
+        self.assertEqual(len(sql), 1)
+        self.assertIn(" IN (", sql[0])
+        self.assertFalse(any('FROM "posts_group"' in query["sql"] for query in queries.captured_queries))
+
+    def test_delete_and_move(self):
+        """Удаленные и перенесенные в другое сообщество записи пропадают из ленты"""
+        self.client.get("/group/test-group/")
+        self.posts[-1].delete()
+        moved = self.posts[-2]
+        self.client.post(f"/TestUser/{moved.id}/edit/", {"text": moved.text, "group": self.other.id})
+        first = [post.id for post in self.client.get("/group/test-group/").context["page"]]
+        self.assertEqual(first[0], self.posts[-3].id)
+        self.assertEqual([post.id for post in self.client.get("/group/other-group/").context["page"]], [moved.id])
+
+    def test_group_memoized(self):
+        """Сообщество по slug запоминается и обновляется при изменении"""
+        self.client.get("/group/test-group/")
+        self.group.title = "Renamed group"
+        self.group.save()
+        self.assertContains(self.client.get("/group/test-group/"), "Renamed group")
+        self.assertEqual(self.client.get("/group/missing/").status_code, 404)
+
+    def test_group_slug_renamed(self):
+        """После смены slug сообщество не открывается по старому адресу"""
+        self.client.get("/group/test-group/")
+        self.group.slug = "renamed-group"
+        self.group.save()
+        self.assertEqual(self.client.get("/group/test-group/").status_code, 404)
+        self.assertEqual(self.client.get("/group/renamed-group/").status_code, 200)
+
+    def test_forged_cursor(self):
+        """Курсор не тех типов не сравнивается со списком недавних записей"""
+        self.client.get("/group/test-group/")
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        naive = self.posts[5].pub_date.replace(tzinfo=None)
+        for cursor in ([1, 2], [naive, self.posts[5].id], [self.posts[5].pub_date, "5"]):
+            self.assertIsNone(hot.get_page(self.group.id, paginator, after=cursor))
+            self.assertIsNone(hot.get_page(self.group.id, paginator, before=cursor))
+
+    def test_page_numbers_bounded(self):
+        """Нумерованная пагинация ограничена по числу страниц"""
+        with mock.patch.object(pagination, "MAX_PAGE_NUMBER", 2):
+            response = self.client.get("/group/test-group/?page=3")
+        self.assertEqual(response.context["page"].number, 2)
+        self.assertEqual(response.context["paginator"].num_pages, 2)
+
+
+class CommentPaginationCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.post = Post.objects.create(text="Viral post", author=self.user)
+        self.comments = [
+            Comment.objects.create(text=f"Comment number {i:02d}", author=self.user, post=self.post)
+            for i in range(45)
+        ]
+        self.path = f"/TestUser/{self.post.id}/"
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_first_page_and_count(self):
+        """Страница записи выводит первую страницу комментариев и их общее число"""
+        response = self.client.get(self.path)
+        self.assertEqual(len(response.context["comment_list"]), 20)
+        self.assertContains(response, "Comment number 44")
+        self.assertNotContains(response, "Comment number 24")
+        self.assertContains(response, "Комментарии (45)")
+        self.assertContains(response, "Показать ещё")
+        # jQuery is not shipped with the site
+        self.assertNotContains(response, "$(")
+
+    def test_load_more(self):
+        """Остальные комментарии подгружаются частями через JSON"""
+        token = self.client.get(self.path).context["comment_list"].next_token
+        seen = []
+        while token:
+            data = self.client.get(f"{self.path}comments/", {"after": token}).json()
+            seen.extend(comment["id"] for comment in data["comments"])
+            self.assertIn("Удалить", data["html"])
+            token = data["next"]
+        self.assertEqual(seen, [comment.id for comment in reversed(self.comments[:25])])
+
+    def test_page_without_js(self):
+        """Без JavaScript следующая страница комментариев открывается по ссылке"""
+        token = self.client.get(self.path).context["comment_list"].next_token
+        response = self.client.get(self.path, {"comments_after": token})
+        self.assertContains(response, "Comment number 24")
+        self.assertNotContains(response, "Comment number 25")
+
+    def test_comment_query_bounded(self):
+        """Комментарии читаются с ограничением, а не целиком"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.path)
+        sql = [query["sql"] for query in queries.captured_queries if 'FROM "posts_comment"' in query["sql"]]
+        self.assertEqual(len(sql), 1)
+        self.assertIn("LIMIT 21", sql[0])
+
+    def test_count_follows_comments(self):
+        """Счетчик комментариев обновляется при добавлении и удалении"""
+        self.client.post(f"{self.path}comment/", {"text": "One more"})
+        self.assertContains(self.client.get(self.path), "Комментарии (46)")
+        self.comments[0].delete()
+        self.assertContains(self.client.get(self.path), "Комментарии (45)")
+        self.assertEqual(self.client.get("/TestUser/999/comments/").status_code, 404)
+
+
+class ArchiveCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.author = User.objects.create_user(username="Author", email="mail2@mail.ru", password="text2super3")
+        self.reader = User.objects.create_user(username="Reader", email="mail3@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        self.group = Group.objects.create(title="Test group", slug="test-group", description="Test")
+        self.posts = [
+            Post.objects.create(text=f"Post, \"quoted\" {i}", author=self.user, group=self.group if i % 2 else None)
+            for i in range(5)
+        ]
+        self.other = Post.objects.create(text="Other post", author=self.author)
+        Comment.objects.create(text="Own comment", author=self.user, post=self.other)
+        Comment.objects.create(text="Foreign comment", author=self.author, post=self.posts[0])
+        follows.follow(self.user, self.author)
+        follows.follow(self.reader, self.user)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def export(self, *args):
+        out = StringIO()
+        call_command("export_diary", *args, stdout=out)
+        return out.getvalue()
+
+    def test_export_endpoint(self):
+        """Пользователь выгружает свои записи, комментарии и подписки потоком"""
+        response = self.client.get("/export/")
+        self.assertTrue(response.streaming)
+        records = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([r["type"] for r in records], ["post"] * 5 + ["comment", "follow"])
+        self.assertEqual(records[-1], {"type": "follow", "user": "TestUser", "author": "Author"})
+
+        response = self.client.get("/export/", {"format": "csv"})
+        self.assertIn("TestUser.csv", response["Content-Disposition"])
+        rows = list(csv.reader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(tuple(rows[0]), archive.CSV_FIELDS)
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(self.client.get("/export/", {"format": "xml"}).status_code, 404)
+
+    def test_roundtrip(self):
+        """Выгрузка загружается обратно с теми же id, датами и счетчиками"""
+        for format in archive.FORMATS:
+            dump = self.export("--format", format)
+            dates = dict(Post.objects.values_list("id", "pub_date"))
+            Post.objects.all().delete()
+            Follow.objects.all().delete()
+            self.assertEqual(Comment.objects.count(), 0)
+
+            path = os.path.join(tempfile.mkdtemp(), f"archive.{format}")
+            self.addCleanup(shutil.rmtree, os.path.dirname(path))
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                f.write(dump)
+            out = StringIO()
+            call_command("import_diary", path, "--batch-size", "2", stdout=out)
+            self.assertIn("6 posts, 2 comments, 2 follows imported", out.getvalue())
+
+            self.assertEqual(dict(Post.objects.values_list("id", "pub_date")), dates)
+            self.assertEqual(Post.objects.get(pk=self.posts[1].pk).group_id, self.group.id)
+            self.assertEqual(Post.objects.get(pk=self.posts[0].pk).text, "Post, \"quoted\" 0")
+            self.assertEqual(PostStats.objects.get(post=self.posts[0]).comments_count, 1)
+            self.assertEqual(UserStats.objects.get(user=self.user).posts_count, 5)
+            self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 5)
+            self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 1)
+            self.assertEqual([hit[1] for hit in search("Other")], [self.other.pk])
+
+            out = StringIO()
+            call_command("import_diary", path, stdout=out)
+            self.assertIn("0 posts, 0 comments, 0 follows imported, 10 records skipped", out.getvalue())
+
+    def test_malformed_dates(self):
+        """Записи без даты или с неверной датой пропускаются как повреждённые"""
+        records = [
+            {"type": "post", "id": 1000, "author": "Author", "group": None, "date": "yesterday", "text": "Bad"},
+            {"type": "post", "id": 1001, "author": "Author", "group": None, "date": "2020-13-45T00:00:00+00:00",
+             "text": "Invalid"},
+            {"type": "post", "id": 1002, "author": "Author", "group": None, "date": "2020-01-01T00:00:00+00:00",
+             "text": "Good"},
+            {"type": "comment", "id": 1000, "author": "Author", "post": 1002, "date": None, "text": "Bad"},
+            {"type": "comment", "id": 1001, "author": "Author", "post": 1002, "date": "2020-01-02T00:00:00+00:00",
+             "text": "Good"},
+        ]
+        created, skipped = archive.Importer(index=False).run(records)
+        self.assertEqual(created, {"post": 1, "comment": 1})
+        self.assertEqual((skipped["malformed"], sum(skipped.values())), (3, 3))
+        self.assertEqual(list(Post.objects.filter(pk__gte=1000).values_list("text", flat=True)), ["Good"])
+
+    def test_missing_ids(self):
+        """Записи без идентификатора или без полей пропускаются как повреждённые"""
+        lines = [
+            "type,id,user,author,post,group,date,text,image\n",
+            "post,,,Author,,,2020-01-01T00:00:00+00:00,No id,\n",
+            "post,abc,,Author,,,2020-01-01T00:00:00+00:00,Bad id,\n",
+            "post,1000,,Author,,,2020-01-01T00:00:00+00:00,Good,\n",
+            "comment,,,Author,1000,,2020-01-02T00:00:00+00:00,No id,\n",
+        ]
+        records = [*archive.read(lines, "csv"), {"type": "post", "id": 1001, "author": "Author",
+                                                "date": "2020-01-01T00:00:00+00:00"}]
+        created, skipped = archive.Importer(index=False).run(records)
+        self.assertEqual(created, {"post": 2})
+        self.assertEqual((skipped["malformed"], sum(skipped.values())), (3, 3))
+        self.assertEqual(Post.objects.get(pk=1001).text, "")
+
+    def test_export_users(self):
+        """Выгрузка ограничивается указанными пользователями"""
+        lines = self.export("Author").splitlines()
+        self.assertEqual([json.loads(line)["type"] for line in lines], ["post", "comment"])
+        with self.assertRaises(CommandError):
+            self.export("Nobody")
+
+    def test_admin_changelist_queries(self):
+        """Список записей в админке не выполняет запросов на каждую строку"""
+        User.objects.create_superuser(username="Admin", email="admin@mail.ru", password="text2super3")
+        self.client.login(username="Admin", password="text2super3")
+        self.client.get("/admin/posts/post/")
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get("/admin/posts/post/").status_code, 200)
+        for i in range(10):
+            Post.objects.create(text=f"More {i}", author=self.author, group=self.group)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get("/admin/posts/post/")
+        self.assertEqual(len(many), len(few))
+
+
+FLAKY_CALLS = []
+
+
+@jobs.task("test_flaky", max_attempts=2)
+def flaky_task(fail):
+    FLAKY_CALLS.append(fail)
+    if fail:
+        raise RuntimeError("Flaky task failed")
+
+
+@override_settings(POSTS_JOB_BACKEND="posts.jobs.DatabaseBackend")
+class JobCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.author = User.objects.create_user(username="Author", email="mail2@mail.ru", password="text2super3")
+        self.client.login(username="Author", password="text2super3")
+        Follow.objects.create(user=self.user, author=self.author)
+        Job.objects.all().delete()
+        FLAKY_CALLS.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def run_worker(self):
+        out = StringIO()
+        call_command("run_worker", "--once", stdout=out)
+        return out.getvalue()
+
+    def test_post_new_defers_side_effects(self):
+        """Новая запись сохраняется сразу, рассылка по лентам и индексация выполняются обработчиком"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post("/new/", {"text": "Queued tomatoes"})
+        self.assertFalse(any("posts_timelineentry" in query["sql"] for query in queries.captured_queries))
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(sorted(Job.objects.values_list("name", flat=True)), ["fan_out", "index"])
+
+        self.assertIn("2 jobs done, 0 failed", self.run_worker())
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(len(search("tomatoes")), 1)
+        self.assertFalse(Job.objects.exists())
+
+    def test_idempotency_key(self):
+        """Повторные изменения до запуска задачи ставят в очередь одну задачу"""
+        post = Post.objects.create(text="Draft", author=self.author)
+        for i in range(3):
+            post.text = f"Draft {i}"
+            post.save()
+        self.assertEqual(Job.objects.filter(name="index").count(), 1)
+        self.run_worker()
+        self.assertEqual([hit[1] for hit in search("Draft")], [post.pk])
+
+        job = jobs.claim()
+        self.assertIsNone(job)
+        post.save()
+        self.assertEqual(Job.objects.filter(name="index").count(), 1)
+
+    def test_follow_synced_by_state(self):
+        """Подписка и отписка до запуска задач оставляют ленту пустой"""
+        Post.objects.create(text="Old post", author=self.user)
+        self.run_worker()
+        follows.follow(self.author, self.user)
+        follows.unfollow(self.author, self.user)
+        self.run_worker()
+        self.assertFalse(TimelineEntry.objects.filter(user=self.author).exists())
+        follows.follow(self.author, self.user)
+        self.run_worker()
+        self.assertEqual(TimelineEntry.objects.filter(user=self.author).count(), 1)
+
+    def test_retries_then_fails(self):
+        """Упавшая задача повторяется с задержкой, а после последней попытки помечается как сбойная"""
+        jobs.enqueue("test_flaky", True, key="flaky")
+        with self.assertLogs("posts.jobs", "ERROR"):
+            self.assertIn("0 jobs done, 1 failed", self.run_worker())
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn("Flaky task failed", job.last_error)
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs("posts.jobs", "ERROR"):
+            self.run_worker()
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts, job.key), (Job.FAILED, 2, None))
+        self.assertEqual(FLAKY_CALLS, [True, True])
+        self.assertIsNotNone(jobs.enqueue("test_flaky", False, key="flaky"))
+
+    def test_expired_lease_taken_over(self):
+        """Задачу упавшего обработчика забирает другой после истечения аренды"""
+        jobs.enqueue("test_flaky", False)
+        self.assertIsNotNone(jobs.claim())
+        self.assertIsNone(jobs.claim())
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertIn("1 jobs done", self.run_worker())
+        self.assertEqual(FLAKY_CALLS, [False])
+
+    @override_settings(POSTS_JOB_BACKEND="posts.jobs.EagerBackend")
+    def test_eager_backend(self):
+        """В синхронном режиме задачи выполняются сразу"""
+        jobs.enqueue("test_flaky", False)
+        self.assertEqual(FLAKY_CALLS, [False])
+        self.assertFalse(Job.objects.exists())
+        with self.assertRaises(KeyError):
+            jobs.enqueue("missing_task")
+
+
+class CardRenderCaseTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="Пользователь", first_name="Имя", last_name="Фамилия",
+                                             email="mail@mail.ru", password="text2super3")
+        self.other = User.objects.create_user(username="Other", email="mail2@mail.ru", password="text2super3")
+        self.group = Group.objects.create(title="Group <b>", slug="test-group")
+        self.post = Post.objects.create(text="First <line>\nsecond line", author=self.user, group=self.group)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_card_markup(self):
+        """Карточка содержит те же ссылки, что и reverse(), и экранированный текст"""
+        html = CardRenderer(self.user).render([self.post])
+        for url in (reverse("profile", args=[self.user.username]),
+                    reverse("group", args=[self.group.slug]),
+                    reverse("post", args=[self.user.username, self.post.id]),
+                    reverse("post_edit", args=[self.user.username, self.post.id])):
+            self.assertIn(f'href="{url}"', html)
+        self.assertIn("@Имя Фамилия", html)
+        self.assertIn("Group &lt;b&gt;", html)
+        self.assertIn("First &lt;line&gt;<br>second line", html)
+
+    def test_names_not_cached(self):
+        """Новые имена автора и сообщества видны в уже закешированной карточке"""
+        CardRenderer(self.other).render([self.post])
+        User.objects.filter(pk=self.user.pk).update(first_name="Новое", username="Renamed")
+        Group.objects.filter(pk=self.group.pk).update(title="Renamed group", slug="renamed-group")
+        post = Post.objects.for_feed().get(pk=self.post.pk)
+        self.assertIsNotNone(cache.get(post_card_key(post)))
+        html = CardRenderer(self.other).render([post])
+        self.assertIn("@Новое Фамилия", html)
+        self.assertIn('href="/Renamed/"', html)
+        self.assertIn("Renamed group", html)
+        self.assertIn('href="/group/renamed-group/"', html)
+
+    def test_owner_buttons(self):
+        """Кнопки редактирования выводятся только автору записи"""
+        edit_url = reverse("post_edit", args=[self.user.username, self.post.id])
+        self.assertNotIn(edit_url, CardRenderer(self.other).render([self.post]))
+        self.assertNotIn(edit_url, CardRenderer(AnonymousUser()).render([self.post]))
+
+    def test_bodies_read_at_once(self):
+        """Закешированные карточки страницы читаются одним запросом к кешу"""
+        posts = [self.post] + [Post.objects.create(text=f"Post {i}", author=self.other) for i in range(3)]
+        first = CardRenderer(self.other).render(posts)
+        with mock.patch.object(cache, "get_many", wraps=cache.get_many) as get_many, \
+                mock.patch.object(cache, "set_many") as set_many:
+            self.assertEqual(CardRenderer(self.other).render(posts), first)
+        get_many.assert_called_once()
+        set_many.assert_not_called()
+
+    def test_page_window(self):
+        """Переключатель страниц выводит соседние страницы и пропуски, а не все номера"""
+        paginator = Paginator(range(1000), 10)
+        self.assertEqual(page_window(paginator.get_page(25)), [1, None, 23, 24, 25, 26, 27, None, 100])
+        self.assertEqual(page_window(paginator.get_page(2)), [1, 2, 3, 4, None, 100])
+        self.assertEqual(page_window(Paginator(range(30), 10).get_page(1)), [1, 2, 3])
+
+    def test_bench_render(self):
+        """Замер рендеринга сравнивает шаблоны и пакетный рендеринг"""
+        report = benchmark.render(per_page=4, repeat=2)
+        self.assertEqual(set(report), {"template", "renderer"})
+        out = StringIO()
+        call_command("bench_render", "--per-page", "2", "--repeat", "1", stdout=out)
+        self.assertIn("speedup", out.getvalue())
+
+
+class RenderedTextCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_rendered_on_write(self):
+        """HTML текста сохраняется при создании и редактировании записей и комментариев"""
+        self.client.post("/new/", {"text": "New <post>\nline"})
+        post = Post.objects.get()
+        self.assertEqual((post.text_html, post.text_format), ("New &lt;post&gt;<br>line", FORMAT_VERSION))
+        self.client.post(f"/TestUser/{post.id}/edit/", {"text": "Edited & saved"})
+        post.refresh_from_db()
+        self.assertEqual(post.text_html, "Edited &amp; saved")
+        self.client.post(f"/TestUser/{post.id}/comment/", {"text": "<i>Comment</i>"})
+        self.assertEqual(Comment.objects.get().text_html, "&lt;i&gt;Comment&lt;/i&gt;")
+
+    def test_templates_use_stored_html(self):
+        """Страницы выводят сохраненный HTML, а не форматируют текст заново"""
+        post = Post.objects.create(text="Post text", author=self.user)
+        Comment.objects.create(text="Comment text", author=self.user, post=post)
+        Post.objects.update(text_html="Stored <em>post</em>")
+        Comment.objects.update(text_html="Stored <em>comment</em>")
+        self.assertContains(self.client.get("/"), "Stored <em>post</em>")
+        self.assertContains(self.client.get(f"/TestUser/{post.id}/"), "Stored <em>comment</em>")
+
+    def test_backfill(self):
+        """Команда render_texts дописывает HTML старых строк частями"""
+        posts = [Post.objects.create(text=f"Old <{i}>", author=self.user) for i in range(5)]
+        Comment.objects.create(text="Old comment", author=self.user, post=posts[0])
+        Post.objects.update(text_html="", text_format=0)
+        Comment.objects.update(text_html="", text_format=0)
+        post = Post.objects.get(pk=posts[0].pk)
+        self.assertEqual(post.body_html, "Old &lt;0&gt;")
+
+        out = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command("render_texts", "--batch-size", "2", stdout=out)
+        self.assertIn("posts: 5 rendered", out.getvalue())
+        self.assertIn("comments: 1 rendered", out.getvalue())
+        reads = [q["sql"] for q in queries.captured_queries if q["sql"].startswith('SELECT "posts_post"')]
+        self.assertEqual(len(reads), 4)
+        self.assertTrue(all("LIMIT 2" in sql for sql in reads))
+        self.assertFalse(Post.objects.exclude(text_format=FORMAT_VERSION).exists())
+        self.assertEqual(Post.objects.get(pk=posts[4].pk).text_html, "Old &lt;4&gt;")
+        self.assertEqual(formatting.backfill(Post), 0)
+
+
+STATIC_CSS = """/* Site styles */
+body {
+    background: url("../img/dot.png");
+    margin: 0;
+}
+""" + "".join(f".card-{i} > a,\n.card-{i} p {{\n    padding: {i}px;\n    color: #333;\n}}\n" for i in range(20))
+
+
+class StaticFilesCaseTests(SimpleTestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        self.addCleanup(shutil.rmtree, self.root)
+        for name, content in (("css/site.css", STATIC_CSS), ("img/dot.png", "png"),
+                              ("js/lib.min.js", "var a=1;" * 100)):
+            os.makedirs(os.path.join(self.source, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.source, name), "w") as f:
+                f.write(content)
+        settings = override_settings(
+            STATIC_ROOT=self.root, STATICFILES_DIRS=[self.source],
+            STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"],
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def build(self):
+        call_command("collectstatic", interactive=False, verbosity=0)
+
+    def get(self, url, **headers):
+        response = self.client.get(url, **headers)
+        if response.streaming:
+            response.content_bytes = b"".join(response.streaming_content)
+        response.close()
+        return response
+
+    def test_links_before_build(self):
+        """До сборки ссылки на статику ведут на исходные имена файлов"""
+        self.assertEqual(static("css/site.css"), "/static/css/site.css")
+
+    def test_build(self):
+        """collectstatic добавляет хеш к именам, минифицирует и сжимает файлы"""
+        self.build()
+        url = static("css/site.css")
+        self.assertRegex(url, r"^/static/css/site\.[0-9a-f]{12}\.css$")
+        with open(os.path.join(self.root, url[len("/static/"):])) as f:
+            css = f.read()
+        if staticfiles.rcssmin is not None:
+            self.assertNotIn("Site styles", css)
+            self.assertIn(".card-1>a,.card-1 p{padding:1px", css)
+        else:
+            self.assertIn(".card-1 > a,\n.card-1 p {\n    padding: 1px;", css)
+        self.assertIn(static("img/dot.png").rsplit("/", 1)[1], css)
+        with open(os.path.join(self.root, url[len("/static/"):] + ".gz"), "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()).decode(), css)
+        self.assertEqual(static("js/lib.min.js").count(".min."), 1)
+        self.assertEqual(static("missing.css"), "/static/missing.css")
+
+    def test_minify_without_packages(self):
+        """Без rcssmin и rjsmin стили и скрипты не изменяются"""
+        css = '.a::after { content: "x ; y { z }"; }\n'
+        js = 'var s = "a  /* b */  c";\n'
+        with mock.patch.object(staticfiles, "rcssmin", None), mock.patch.object(staticfiles, "rjsmin", None):
+            self.assertEqual(staticfiles.minify_css(css), css)
+            self.assertEqual(staticfiles.minify_js(js), js)
+
+    def test_serving(self):
+        """Статика отдается до сессий и представлений, сжатой и с долгим кешированием"""
+        self.build()
+        url = static("css/site.css")
+        # SimpleTestCase fails on any query, e.g. of the session middleware
+        response = self.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Encoding"], "br" if staticfiles.brotli else "gzip")
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertNotIn("Set-Cookie", response)
+
+        plain = self.get(url)
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        self.assertIn(b".card-1", plain.content_bytes)
+        self.assertEqual(self.get("/static/css/site.css")["Cache-Control"], "public, max-age=60")
+        self.assertEqual(self.get(url, HTTP_IF_MODIFIED_SINCE=plain["Last-Modified"]).status_code, 304)
+
+    def test_not_found(self):
+        """Отсутствующие файлы и выход за STATIC_ROOT дают 404 без обращения к представлениям"""
+        self.build()
+        self.assertEqual(self.get("/static/css/missing.css").status_code, 404)
+        self.assertEqual(self.get("/static/../settings.py").status_code, 404)
+        self.assertEqual(self.get("/static/%2e%2e/%2e%2e/etc/passwd").status_code, 404)
+        self.assertEqual(self.client.post("/static/css/site.css").status_code, 405)
+
+
+class MediaCaseTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        # TestCase never commits, run the deletions right away
+        on_commit = mock.patch.object(transaction, "on_commit", side_effect=lambda function: function())
+        on_commit.start()
+        self.addCleanup(on_commit.stop)
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+
+    def tearDown(self):
+        cache.clear()
+
+    def new_post(self, text, image):
+        self.client.post("/new/", {"text": text, "image": image})
+        return Post.objects.get(text=text)
+
+    def stored_files(self):
+        directory = os.path.join(self.media_root, "posts")
+        return sorted(os.path.relpath(os.path.join(root, name), self.media_root).replace(os.sep, "/")
+                      for root, _, names in os.walk(directory) for name in names)
+
+    def test_upload_handler(self):
+        """Загрузка пишется во временный файл частями и хешируется по пути"""
+        data = make_image().read()
+        handler = media.HashingUploadHandler()
+        handler.new_file("image", "image.png", "image/png", len(data))
+        for start in range(0, len(data), 1000):
+            self.assertIsNone(handler.receive_data_chunk(data[start:start + 1000], start))
+        uploaded = handler.file_complete(len(data))
+        self.assertTrue(os.path.exists(uploaded.temporary_file_path()))
+        self.assertEqual(uploaded.sha256, media.file_digest(SimpleUploadedFile("image.png", data)))
+        uploaded.close()
+
+    def test_duplicates_share_file(self):
+        """Одинаковые изображения хранятся одним файлом до удаления последней записи"""
+        first = self.new_post("First", make_image())
+        second = self.new_post("Second", make_image("copy.png"))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r"^posts/[0-9a-f]{2}/[0-9a-f]{64}\.png$")
+        self.assertEqual(self.stored_files(), [first.image.name])
+        with open(first.image.path, "rb") as f:
+            self.assertIn(media.file_digest(File(f)), first.image.name)
+        self.assertEqual(MediaFile.objects.get().refs, 2)
+
+        self.client.get(f"/TestUser/{first.id}/delete/")
+        self.assertEqual(MediaFile.objects.get().refs, 1)
+        self.assertEqual(self.stored_files(), [second.image.name])
+        self.client.get(f"/TestUser/{second.id}/delete/")
+        self.assertFalse(MediaFile.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_replaced_image_released(self):
+        """Замененное при редактировании изображение удаляется"""
+        post = self.new_post("Post", make_image())
+        old = post.image.name
+        self.client.post(f"/TestUser/{post.id}/edit/", {"text": "Post", "image": make_image(color="blue")})
+        post.refresh_from_db()
+        self.assertNotEqual(post.image.name, old)
+        self.assertEqual(self.stored_files(), [post.image.name])
+        self.assertEqual(list(MediaFile.objects.values_list("name", "refs")), [(post.image.name, 1)])
+
+    def test_reconcile(self):
+        """reconcile_counters пересчитывает ссылки на файлы, не трогая загрузки без записи"""
+        post = self.new_post("Post", make_image())
+        # Stored by an upload whose post is not saved yet
+        pending = media.media_storage.save("posts/pending.png", make_image(color="green"))
+        MediaFile.objects.filter(name=post.image.name).update(refs=5)
+        call_command("reconcile_counters", stdout=StringIO())
+        self.assertEqual(dict(MediaFile.objects.values_list("name", "refs")), {post.image.name: 1, pending: 1})
+        self.assertEqual(self.stored_files(), sorted([post.image.name, pending]))
+
+    def test_serving(self):
+        """Файлы отдаются с кешированием, условными запросами и диапазонами байтов"""
+        post = self.new_post("Post", make_image())
+        url = post.image.url
+        with open(post.image.path, "rb") as f:
+            data = f.read()
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(b"".join(response.streaming_content), data)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        etag = response["ETag"]
+        response.close()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        response = self.client.get(url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(data)}")
+        self.assertEqual(b"".join(response.streaming_content), data[10:20])
+        response = self.client.get(url, HTTP_RANGE="bytes=-5", HTTP_IF_RANGE=etag)
+        self.assertEqual(b"".join(response.streaming_content), data[-5:])
+        response = self.client.get(url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        response = self.client.get(url, HTTP_RANGE=f"bytes={len(data)}-")
+        self.assertEqual((response.status_code, response["Content-Range"]), (416, f"bytes */{len(data)}"))
+
+        self.assertEqual(self.client.get("/media/posts/missing.png").status_code, 404)
+        self.assertEqual(self.client.get("/media/../settings.py").status_code, 404)
+
+
+class CachedAuthCaseTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="TestUser", email="mail@mail.ru", password="text2super3")
+        self.client.login(username="TestUser", password="text2super3")
+        on_commit = mock.patch.object(transaction, "on_commit", side_effect=lambda function: function())
+        on_commit.start()
+        self.addCleanup(on_commit.stop)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [q["sql"] for q in queries.captured_queries
+                          if 'FROM "django_session"' in q["sql"] or 'FROM "auth_user"' in q["sql"]]
+
+    def test_session_and_user_cached(self):
+        """Сессия и пользователь читаются из кеша, а сессия сохраняется и в базе"""
+        self.assertTrue(Session.objects.filter(session_key=self.client.session.session_key).exists())
+        _, queries = self.auth_queries("/follow/")
+        self.assertEqual(len(queries), 2)
+        response, queries = self.auth_queries("/follow/")
+        self.assertEqual(queries, [])
+        self.assertEqual(response.context["user"], self.user)
+        self.assertIsNotNone(cache.get(auth.user_key(self.user.id)))
+
+    def test_password_hash_not_cached(self):
+        """Хеш пароля не попадает в кеш и читается из базы только при обращении"""
+        self.client.get("/follow/")
+        response, queries = self.auth_queries("/follow/")
+        self.assertEqual(queries, [])
+        self.assertNotIn(self.user.password, pickle.dumps(cache.get(auth.user_key(self.user.id))).decode("latin1"))
+        user = response.context["user"]
+        self.assertIn("password", user.get_deferred_fields())
+        self.assertTrue(user.check_password("text2super3"))
+
+    def test_profile_edit_invalidates(self):
+        """Редактирование профиля сбрасывает закешированного пользователя"""
+        self.client.get("/follow/")
+        self.client.post("/TestUser/edit/", {"first_name": "Новое", "last_name": "Имя",
+                                              "username": "TestUser", "email": "mail@mail.ru"})
+        response = self.client.get("/follow/")
+        self.assertEqual(response.context["user"].first_name, "Новое")
+
+    def test_password_change_logs_out_other_sessions(self):
+        """Смена пароля завершает другие сессии, несмотря на кеш"""
+        other = Client()
+        other.login(username="TestUser", password="text2super3")
+        self.assertEqual(other.get("/follow/").status_code, 200)
+        response = self.client.post("/auth/password_change/", {
+            "old_password": "text2super3", "new_password1": "n3w-passw0rd!", "new_password2": "n3w-passw0rd!",
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.get("/follow/").status_code, 200)
+        self.assertEqual(other.get("/follow/").status_code, 302)
+
+    def test_deactivated_user_logged_out(self):
+        """Заблокированный пользователь перестает быть авторизованным"""
+        self.client.get("/follow/")
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/follow/").status_code, 302)
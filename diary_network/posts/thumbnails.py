@@ -0,0 +1,54 @@
+"""Image renditions generated off the request path.
+
+posts.signals queues a "renditions" job (posts.jobs) for posts whose image
+has not been rendered yet. The job renders every size in RENDITIONS with
+sorl and stores the resulting URLs on Post.renditions, so templates only
+emit precomputed URLs. Until then posts.cards shows a placeholder. Errors
+are left to the job runner to retry, and the post is only marked as failed
+once the job gives up.
+"""
+import json
+
+from django.utils import timezone
+from sorl.thumbnail import get_thumbnail
+
+from .cache import bump_generation, post_scopes
+from .models import Post
+
+RENDITIONS = {
+    "card": ("960x339", {"crop": "center", "upscale": True}),
+    "small": ("480x170", {"crop": "center", "upscale": True}),
+    "square": ("150x150", {"crop": "center"}),
+}
+
+
+def generate_renditions(post_id):
+    """Render every size of a post's image and store their URLs on the post."""
+    try:
+        post = Post.objects.only("id", "image", "author", "group").get(pk=post_id)
+    except Post.DoesNotExist:
+        return
+    if not post.image:
+        return
+
+    renditions = {
+        name: get_thumbnail(post.image, geometry, **options).url
+        for name, (geometry, options) in RENDITIONS.items()
+    }
+    _store(post, renditions)
+
+
+def mark_failed(post_id):
+    """Record that a post's image could not be rendered, after the last attempt."""
+    post = Post.objects.only("id", "image", "author", "group").filter(pk=post_id).first()
+    if post is not None and post.image:
+        _store(post, {"failed": True})
+
+
+def _store(post, renditions):
+    # The image may have been replaced while we were working
+    Post.objects.filter(pk=post.pk, image=post.image.name).update(
+        renditions=json.dumps(renditions), updated=timezone.now()
+    )
+    bump_generation(*post_scopes(post))
+
@@ -0,0 +1,132 @@
+"""Materialized per-user follow timelines.
+
+Every post is copied (fan-out on write) into the timeline of each follower
+of its author, so the follow feed is a single range read on
+(user, -pub_date, -post) no matter how many authors a user follows.
+"""
+from django.db.models import Q
+
+from .models import POST_FEED_FIELDS, Follow, Post, TimelineEntry
+
+
+TIMELINE_KEYS = ("pub_date", "post_id")
+BATCH_SIZE = 500
+
+
+def _bulk_insert(entries):
+    batch = []
+    count = 0
+    for entry in entries:
+        batch.append(entry)
+        count += 1
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+    return count
+
+
+def fan_out(post):
+    """Push a new post into the timelines of its author's followers."""
+    follower_ids = (
+        Follow.objects.filter(author_id=post.author_id)
+        .values_list("user_id", flat=True)
+        .iterator()
+    )
+    _bulk_insert(
+        TimelineEntry(user_id=user_id, post_id=post.id, author_id=post.author_id, pub_date=post.pub_date)
+        for user_id in follower_ids
+    )
+
+
+def fan_out_posts(posts):
+    """fan_out() for many posts at once, e.g. after bulk_create()."""
+    followers = {}
+    rows = Follow.objects.filter(author_id__in={post.author_id for post in posts}).values_list("user_id", "author_id")
+    for user_id, author_id in rows.iterator():
+        followers.setdefault(author_id, []).append(user_id)
+    return _bulk_insert(
+        TimelineEntry(user_id=user_id, post_id=post.id, author_id=post.author_id, pub_date=post.pub_date)
+        for post in posts
+        for user_id in followers.get(post.author_id, ())
+    )
+
+
+def remove_post(post):
+    TimelineEntry.objects.filter(post_id=post.id).delete()
+
+
+def add_author(user, author):
+    """Backfill the posts of a newly followed author."""
+    posts = (
+        Post.objects.filter(author_id=author.id)
+        .values_list("id", "pub_date")
+        .iterator()
+    )
+    _bulk_insert(
+        TimelineEntry(user_id=user.id, post_id=post_id, author_id=author.id, pub_date=pub_date)
+        for post_id, pub_date in posts
+    )
+
+
+def remove_author(user, author):
+    TimelineEntry.objects.filter(user_id=user.id, author_id=author.id).delete()
+
+
+def add_authors(pairs):
+    """Backfill timelines for (user_id, author_id) follow pairs."""
+    followers = {}
+    for user_id, author_id in pairs:
+        followers.setdefault(author_id, []).append(user_id)
+    if not followers:
+        return 0
+    posts = (
+        Post.objects.filter(author_id__in=followers)
+        .values_list("id", "author_id", "pub_date")
+        .iterator()
+    )
+    return _bulk_insert(
+        TimelineEntry(user_id=user_id, post_id=post_id, author_id=author_id, pub_date=pub_date)
+        for post_id, author_id, pub_date in posts
+        for user_id in followers[author_id]
+    )
+
+
+def remove_authors(pairs):
+    condition = Q()
+    for user_id, author_id in pairs:
+        condition |= Q(user_id=user_id, author_id=author_id)
+    if condition:
+        TimelineEntry.objects.filter(condition).delete()
+
+
+def rebuild(users=None):
+    """Rebuild timelines from Follow and Post rows, returns the number of entries written."""
+    follows = Follow.objects.all()
+    entries = TimelineEntry.objects.all()
+    if users is not None:
+        follows = follows.filter(user__in=users)
+        entries = entries.filter(user__in=users)
+    entries.delete()
+
+    written = 0
+    for user_id, author_id in follows.values_list("user_id", "author_id").iterator():
+        posts = (
+            Post.objects.filter(author_id=author_id)
+            .values_list("id", "pub_date")
+            .iterator()
+        )
+        written += _bulk_insert(
+            TimelineEntry(user_id=user_id, post_id=post_id, author_id=author_id, pub_date=pub_date)
+            for post_id, pub_date in posts
+        )
+    return written
+
+
+def timeline_for(user):
+    return (
+        TimelineEntry.objects.filter(user_id=user.id)
+        .select_related("post__author", "post__group")
+        .only("pub_date", "post", *(f"post__{field}" for field in POST_FEED_FIELDS))
+    )
@@ -11,11 +11,19 @@ urlpatterns = [
     path("group/<slug:slug>/", views.group_posts, name="group"),
     
     path("<username>/<int:post_id>/comment/", views.comment_add, name="comment_add"),
+    path("<username>/<int:post_id>/comments/", views.comment_list, name="comment_list"),
     path("<username>/<int:post_id>/comment/<int:comment_id>/delete/", views.comment_delete, name="comment_delete"),
     
+    path("follow/", views.follow_index, name="follow"),
+    path("search/", views.search_view, name="search"),
+    path("metrics/", views.metrics, name="metrics"),
+    path("export/", views.export, name="export"),
+    path("api/feed/", views.api_index, name="api_index"),
+    path("api/feed/follow/", views.api_follow, name="api_follow"),
+    path("api/feed/group/<slug:slug>/", views.api_group, name="api_group"),
+    path("api/feed/user/<str:username>/", views.api_profile, name="api_profile"),
     path('<str:username>/', views.profile, name='profile'),
     path("<username>/edit/", views.profile_edit, name="profile_edit"),
-    path("follow/", views.follow_index, name="follow"),
     path("<username>/follow/", views.profile_follow, name="profile_follow"), 
     path("<username>/unfollow/", views.profile_unfollow, name="profile_unfollow"),
     
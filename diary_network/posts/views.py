@@ -1,14 +1,35 @@
+import json
+import time
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.views.decorators.http import condition
 
+from .cache import bump_generation, invalidate_post_card, post_scopes
+from .counters import user_stats
 from .forms import CommentForm, PostForm, UserEditForm
-from .models import Comment, Follow, Group, Post, User
+from .metrics import registry
+from .models import Comment, Follow, Group, Post, User, UserStats
+from .pagination import CursorPage, CursorPaginator, decode_cursor, encode_cursor, get_feed_page
+from . import archive, bus, conditional, feeds, follows, hot, media, parallel, search, timeline
+
+
+SEARCH_PAGE_SIZE = 10
+COMMENT_PAGE_SIZE = 20
+COMMENT_KEYS = ("created", "id")
+
+# Comment lines keeping idle event streams open through proxies
+STREAM_KEEPALIVE = 15
+# Seconds after which a request turned away by bus.slot() should try again
+WAIT_RETRY_AFTER = 5
 
 
 # Code templates
 
-def page_not_found(request, exception):
+def page_not_found(request, exception=None):
     return render(
         request, 
         "misc/404.html", 
@@ -24,31 +45,38 @@ def server_error(request):
 # Posts section
 
 @login_required
+@condition(etag_func=conditional.index_etag)
 def index(request):
-    post_list = Post.objects.order_by('-pub_date').all()
-    paginator = Paginator(post_list, 10)
-
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.for_feed()
+    page, paginator = get_feed_page(request, post_list, cache_scope="index")
     return render(request, 'index.html', {'page': page, 'paginator': paginator})
 
 
 @login_required
+@condition(etag_func=conditional.group_etag)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    posts = Post.objects.filter(group=group).order_by("-pub_date")
-    return render(request, "group.html", {"group": group, "posts": posts})
+    group = conditional.group_by_slug(slug)
+    if group is None:
+        raise Http404
+    post_list = Post.objects.for_feed().filter(group=group)
+    page, paginator = get_feed_page(
+        request, post_list, cache_scope=f"group:{group.id}",
+        source=lambda paginator, after, before: hot.get_page(group.id, paginator, after, before),
+    )
+    return render(request, "group.html", {"group": group, "page": page, "paginator": paginator})
 
 
 @login_required
 def post_new(request):
     if request.method == 'POST':
-        form = PostForm(request.POST)
+        form = PostForm(request.POST, files=request.FILES or None)
 
         if form.is_valid():
             post = form.save(commit=False)
             post.author = request.user
+            # Fan-out and renditions are queued by posts.signals
             post.save()
+            bus.publish(*post_scopes(post))
             return redirect('index')
 
         return render(request, 'post_new.html', {'form': form})
@@ -58,27 +86,31 @@ def post_new(request):
  
  
 @login_required
+@condition(etag_func=conditional.post_etag)
 def post_view(request, username, post_id):
-    profile = get_object_or_404(User, username=username)
-    post = get_object_or_404(Post, pk=post_id)
-    post_list = Post.objects.filter(author = profile).order_by("-pub_date").all()
-    posts_count = post_list.count()
+    # None of these depend on each other, see posts.parallel
+    comments = comment_paginator(post_id)
+    profile, post, comment_page, stats, following = parallel.gather(
+        lambda: get_object_or_404(User, username=username),
+        lambda: get_object_or_404(Post.objects.for_page(), pk=post_id),
+        lambda: comments.get_page(request.GET.get("comments_after")),
+        lambda: UserStats.objects.filter(user__username=username).first(),
+        lambda: Follow.objects.filter(user=request.user.id, author__username=username).exists(),
+    )
+    if stats is None:
+        stats = user_stats(profile)
     
     form = CommentForm()
-    comment_list = Comment.objects.filter(post=post).order_by("-created").all()
-    
-    followers = Follow.objects.filter(author=profile.id).count()
-    follows = Follow.objects.filter(user=profile.id).count()
-    following = Follow.objects.filter(user=request.user.id, author=profile.id).all()
     
     context = {
         "form": form, 
         "profile": profile, 
         "post": post,
-        "posts_count": posts_count, 
-        "comment_list": comment_list,
-        "followers": followers, 
-        "follows": follows,
+        "posts_count": stats.posts_count, 
+        "comment_list": comment_page,
+        "comments_count": post.comments_count,
+        "followers": stats.followers_count, 
+        "follows": stats.follows_count,
         "following": following
     } 
     return render(request, "post.html", context)
@@ -93,9 +125,20 @@ def post_edit(request, username, post_id):
 
     title = "Редактировать запись"
     btn_caption = "Сохранить"
+    old_group_id = post.group_id
+    old_image = post.image.name
     form = PostForm(request.POST or None, files=request.FILES or None, instance=post)
     if request.method == "POST" and form.is_valid():
+        invalidate_post_card(post)
+        if "image" in form.changed_data:
+            # posts.signals queues rendering of the new image
+            post.renditions = ""
         form.save()
+        if "image" in form.changed_data:
+            media.release(old_image)
+        if old_group_id and old_group_id != post.group_id:
+            bump_generation(f"group:{old_group_id}")
+            hot.remove(old_group_id, post.id)
         return redirect("post", username=request.user.username, post_id=post_id)
     return render(request, "post_new.html", {"form": form, "title": title, "btn_caption": btn_caption, "post": post})
 
@@ -105,11 +148,67 @@ def post_delete(request, username, post_id):
     if request.user.username != username:
         return redirect(f"/{username}/{post_id}")
     post = get_object_or_404(Post, pk=post_id)
+    timeline.remove_post(post)
+    invalidate_post_card(post)
     post.delete()
     return redirect("profile", username=username)
 
+@login_required
+def search_view(request):
+    query = request.GET.get("q", "").strip()
+    try:
+        # Search cursors are (score, doc id) rather than key values of a model
+        after = decode_cursor(request.GET["after"], (float, int)) if "after" in request.GET else None
+    except ValueError:
+        after = None
+
+    hits = search.search(query, after=after, limit=SEARCH_PAGE_SIZE + 1) if query else []
+    has_next = len(hits) > SEARCH_PAGE_SIZE
+    hits = hits[:SEARCH_PAGE_SIZE]
+
+    ids = {kind: [pk for hit_kind, pk, _, _ in hits if hit_kind == kind] for kind in search.KINDS}
+    objects = {
+        "post": Post.objects.for_feed().in_bulk(ids["post"]),
+        "comment": Comment.objects.select_related("author", "post__author").in_bulk(ids["comment"]),
+        "group": Group.objects.in_bulk(ids["group"]),
+    }
+    results = [
+        {"kind": kind, "object": objects[kind][pk]}
+        for kind, pk, _, _ in hits if pk in objects[kind]
+    ]
+    next_values = [hits[-1][2], hits[-1][3]] if has_next else None
+    page = CursorPage(results, None, next_values=next_values, has_next=has_next, has_previous=after is not None)
+    return render(request, "search.html", {"query": query, "page": page})
+
+
 # Comment section
 
+def comment_paginator(post_id):
+    """Comments of a post newest first, COMMENT_PAGE_SIZE at a time."""
+    return CursorPaginator(Comment.objects.for_feed().filter(post_id=post_id), COMMENT_PAGE_SIZE, COMMENT_KEYS)
+
+
+@login_required
+def comment_list(request, username, post_id):
+    """A further page of comments, for the "more comments" link of post.html."""
+    post = get_object_or_404(Post.objects.select_related("author").only("id", "author__username"), pk=post_id)
+    page = comment_paginator(post_id).get_page(request.GET.get("after"))
+    html = render_to_string("comment_list.html", {"comment_list": page, "post": post}, request)
+    return JsonResponse({
+        "comments": [
+            {
+                "id": comment.id,
+                "author": comment.author.username,
+                "text": comment.text,
+                "created": comment.created.isoformat(),
+            }
+            for comment in page
+        ],
+        "html": html,
+        "next": page.next_token,
+    })
+
+
 @login_required
 def comment_add(request, username, post_id):
     post = get_object_or_404(Post, id=post_id)
@@ -126,7 +225,7 @@ def comment_add(request, username, post_id):
 @login_required
 def comment_delete(request, username, post_id, comment_id):
     comment = get_object_or_404(Comment, pk=comment_id)
-    if request.user.username == comment.author.username:
+    if request.user.id == comment.author_id:
         comment.delete()
     return redirect("post", username=username, post_id=post_id)  
 
@@ -134,20 +233,18 @@ def comment_delete(request, username, post_id, comment_id):
 # Profile section
 
 @login_required
+@condition(etag_func=conditional.profile_etag)
 def profile(request, username):
     profile = get_object_or_404(User, username=username)
-    post_list = Post.objects.filter(author = profile).order_by("-pub_date").all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    posts_count = post_list.count()
-    page = paginator.get_page(page_number)
-    
-    followers = Follow.objects.filter(author=profile.id).count()
-    follows = Follow.objects.filter(user=profile.id).count()
-    following = Follow.objects.filter(user=request.user.id, author=profile.id).all()
+    post_list = Post.objects.for_feed().filter(author = profile)
+    (page, paginator), stats, following = parallel.gather(
+        lambda: get_feed_page(request, post_list, cache_scope=f"author:{profile.id}"),
+        lambda: user_stats(profile),
+        lambda: Follow.objects.filter(user=request.user.id, author=profile.id).exists(),
+    )
     
-    context = {"profile": profile, "page": page, "paginator": paginator, "posts_count": posts_count, \
-        "followers": followers, "follows": follows, "following": following}
+    context = {"profile": profile, "page": page, "paginator": paginator, "posts_count": stats.posts_count, \
+        "followers": stats.followers_count, "follows": stats.follows_count, "following": following}
     return render(request, "profile.html", context)
 
 
@@ -164,34 +261,163 @@ def profile_edit(request, username):
 
 
 @login_required
+@condition(etag_func=conditional.follow_etag)
 def follow_index(request):
-    following = Follow.objects.filter(user=request.user).all()
-    author_list = []
-    for author in following:
-        author_list.append(author.author.id)
-        
-    post_list = Post.objects.filter(author__in=author_list).order_by("-pub_date").all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    entries = timeline.timeline_for(request.user)
+    page, paginator = get_feed_page(request, entries, keys=timeline.TIMELINE_KEYS)
+    page.object_list = [entry.post for entry in page]
     return render(request, "follow.html", {"page": page, "paginator": paginator})
 
 
 @login_required
 def profile_follow(request, username):
-    user = request.user
     author = get_object_or_404(User, username=username)
-    follow_check = Follow.objects.filter(user=user.id, author=author.id).count()
-    if follow_check == 0 and author.id != user.id:
-        Follow.objects.create(user=request.user, author=author)
+    # Links and prefetchers must not follow
+    if request.method == "POST":
+        follows.follow(request.user, author)
     return redirect("profile", username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    user = request.user.id
     author = get_object_or_404(User, username=username)
-    follow_check = Follow.objects.filter(user=user, author=author.id).count()
-    if follow_check == 1:
-        Follow.objects.filter(user=request.user, author=author).delete()
+    # Nor unfollow
+    if request.method == "POST":
+        follows.unfollow(request.user, author)
     return redirect("profile", username=username)
+
+
+# Feed API section
+
+@login_required
+def api_index(request):
+    return feed_response(request, feeds.index_feed())
+
+
+@login_required
+def api_group(request, slug):
+    group_id = conditional.group_id(slug)
+    if group_id is None:
+        raise Http404
+    return feed_response(request, feeds.group_feed(group_id))
+
+
+@login_required
+def api_profile(request, username):
+    author_id = conditional.user_id(username)
+    if author_id is None:
+        raise Http404
+    return feed_response(request, feeds.author_feed(author_id))
+
+
+@login_required
+def api_follow(request):
+    return feed_response(request, feeds.follow_feed(request.user))
+
+
+def feed_response(request, feed):
+    """New posts of a feed as JSON, see posts.feeds.
+
+    ?since=<cursor> returns only the posts after it, ?wait=<seconds> holds
+    the request until one is published (long-polling), and ?stream=1 or an
+    Accept: text/event-stream header turns the response into server-sent
+    events.
+    """
+    token = request.GET.get("since") or request.META.get("HTTP_LAST_EVENT_ID")
+    try:
+        since = feeds.parse_cursor(token) if token else None
+        wait = float(request.GET.get("wait", 0))
+    except ValueError:
+        return JsonResponse({"error": "Invalid since or wait"}, status=400)
+    if not wait >= 0:
+        return JsonResponse({"error": "Invalid since or wait"}, status=400)
+    wait = min(wait, settings.POSTS_FEED_WAIT_MAX)
+
+    if request.GET.get("stream") or "text/event-stream" in request.META.get("HTTP_ACCEPT", ""):
+        response = StreamingHttpResponse(feed_events(feed, since), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    seen = bus.snapshot(feed.topics)
+    posts, cursor, has_more = feed.newer(since)
+    if since is not None and wait and not posts:
+        with bus.slot() as free:
+            if not free:
+                response = JsonResponse({"error": "Too many waiting requests"}, status=503)
+                response["Retry-After"] = WAIT_RETRY_AFTER
+                return response
+            deadline = time.monotonic() + wait
+            while not posts and bus.wait(seen, deadline - time.monotonic()):
+                seen = bus.snapshot(feed.topics)
+                # A replica may lag behind the post that woke us up
+                posts, cursor, has_more = feed.newer(since, using="default")
+    return JsonResponse(feed_payload(posts, cursor, has_more))
+
+
+def feed_payload(posts, cursor, has_more):
+    return {
+        "posts": [feeds.serialize(post) for post in posts],
+        "cursor": encode_cursor(cursor),
+        "has_more": has_more,
+    }
+
+
+def feed_events(feed, since):
+    """Server-sent events of a feed for POSTS_FEED_STREAM_SECONDS.
+
+    EventSource clients then reconnect on their own, sending the cursor of
+    the last event as Last-Event-ID.
+    """
+    with bus.slot() as free:
+        if not free:
+            yield f"retry: {WAIT_RETRY_AFTER * 1000}\n\n"
+            return
+        yield from _feed_events(feed, since)
+
+
+def _feed_events(feed, since):
+    deadline = time.monotonic() + settings.POSTS_FEED_STREAM_SECONDS
+    yield "retry: 1000\n\n"
+    using = None
+    while True:
+        seen = bus.snapshot(feed.topics)
+        posts, cursor, has_more = feed.newer(since, using=using)
+        if posts:
+            since = cursor
+            data = json.dumps(feed_payload(posts, cursor, has_more), separators=(",", ":"))
+            yield f"id: {encode_cursor(cursor)}\nevent: posts\ndata: {data}\n\n"
+            if has_more:
+                continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if not bus.wait(seen, min(remaining, STREAM_KEEPALIVE)):
+            yield ": keepalive\n\n"
+        using = "default"
+
+
+# Export section
+
+@login_required
+def export(request):
+    """The user's posts, comments and follows as NDJSON or CSV, see posts.archive."""
+    format = request.GET.get("format", "ndjson")
+    if format not in archive.FORMATS:
+        raise Http404
+    content_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(
+        archive.lines(archive.records([request.user]), format),
+        content_type=f"{content_type}; charset=utf-8",
+    )
+    response["Content-Disposition"] = f'attachment; filename="{request.user.username}.{format}"'
+    return response
+
+
+# Monitoring section
+
+def metrics(request):
+    """Request histograms of this worker process, only shown to INTERNAL_IPS."""
+    if request.META.get("REMOTE_ADDR") not in settings.INTERNAL_IPS:
+        raise Http404
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")
@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 
 from django import forms
 
+from posts.forms import validate_username
+
 
 User = get_user_model()
 
@@ -12,6 +14,11 @@ class CreationForm(UserCreationForm):
         model = User
         fields = ("first_name", "last_name", "username", "email")
 
+    def clean_username(self):
+        username = self.cleaned_data["username"]
+        validate_username(username)
+        return username
+
 
 class ContactForm(forms.Form):
     subject = forms.CharField(max_length=100)